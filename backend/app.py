@@ -1,5 +1,5 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -8,32 +8,140 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 import uuid
 import os
+import hashlib
+import json
+import asyncio
 import shutil
-import httpx  # For downloading Replicate image
+import re
+import time
 from pathlib import Path
 from typing import Optional
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
-# Local modules
-from .preprocess import canny_edge
+# Load environment variables from .env file (before the local modules, some read settings on import)
+load_dotenv()
+
+# Local modules. The imaging modules (cv2, numpy, PIL) are imported by the warm-up after
+# startup, or on first use, so the process answers /health right away (see lifespan)
+from .options import (
+    parse_control_filters, EDGE_PREVIEW_SIZES, DEFAULT_LOW_THRESHOLD, DEFAULT_HIGH_THRESHOLD, DEFAULT_BLUR_KSIZE,
+    DEFAULT_CONTROL_FILTERS, DEFAULT_TARGET_SIZE, PREPROCESS_MODES, PREVIEW_FORMATS, SOFT_CONTROL_FILTERS,
+    DEFAULT_OUTPUT_MODE, EDGES_OUTPUT, OUTPUT_MODES,
+)
+from .lazy import LazyModule, preload, warm_up
 from . import replicate_client
-from . import composer
+from . import metrics
+from .job_store import AsyncJobStore, create_job_store
+from .events import JobEventBroker
+from .layers import create_layer_store
+from .storage import DEFAULT_STORAGE_SWEEP_SECONDS, EXPIRED_STATUS, create_storage_manager
+from .singleflight import FLIGHT_KIND, SingleFlight
+from .scheduler import DEFAULT_TIER, SchedulerSaturated, create_scheduler
+from .recovery import CLAIM_KIND, DEFAULT_HEARTBEAT_SECONDS, WORKER_KIND, create_worker_registry
+from .cache import create_result_cache, edge_cache_key, stylized_cache_key, place_file
+from .workers import ExecutorSaturated, create_executor
+from .uploads import (
+    MaxBodySizeMiddleware, MULTIPART_OVERHEAD_BYTES, ZIP_CONTENT_TYPE, extract_zip_images, read_upload_limited,
+)
+
+preprocess = LazyModule(f"{__package__}.preprocess")
+composer = LazyModule(f"{__package__}.composer")
+stylizers = LazyModule(f"{__package__}.stylizers")
+WARM_UP_MODULES = (preprocess, composer, stylizers)
 
-# Load environment variables from .env file
-load_dotenv()
 API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
 if not API_TOKEN:
     print("WARNING: REPLICATE_API_TOKEN is not set. Replicate integration will fail.")
 
+# Readiness (GET /ready): set by warm_up_app once the pipeline can run without import stalls
+READINESS = {"status": "warming_up", "detail": None}
+
+async def warm_up_app():
+    """Imports the imaging modules here and in the CPU pool's workers, then marks the app ready."""
+    started = time.perf_counter()
+    try:
+        timings = await asyncio.to_thread(warm_up, WARM_UP_MODULES)
+        # Spawned pool workers would otherwise import them on their first job
+        names = [module.name for module in WARM_UP_MODULES]
+        try:
+            await asyncio.gather(*(CPU_EXECUTOR.run(preload, names) for _ in range(CPU_EXECUTOR.max_workers)))
+        except ExecutorSaturated:
+            pass  # Already busy with real work; the remaining workers warm up on their first job
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        READINESS.update(status="failed", detail=str(e))
+        return
+    READINESS.update(status="ready", detail=None)
+    print(f"Warm-up done in {time.perf_counter() - started:.2f}s (imports: {timings})")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    TEMP_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    # Not awaited: the server starts answering (/health) while the heavy imports run
+    warming = asyncio.create_task(warm_up_app())
+    # Periodic garbage collection of job files and records; the first sweep runs right
+    # away and drops whatever expired while no worker was running
+    sweeper = asyncio.create_task(STORAGE.run_periodic(STORAGE_SWEEP_SECONDS))
+    # Heartbeat of this worker; its first scan resumes jobs a previous run (or a crashed peer) left behind
+    recovery = asyncio.create_task(WORKERS.run_periodic(
+        ACTIVE_STATUSES, recover_job, WORKER_HEARTBEAT_SECONDS, on_heartbeat=STYLIZE_FLIGHTS.renew_leases,
+    ))
+    yield
+    warming.cancel()
+    sweeper.cancel()
+    recovery.cancel()
+    # Unfinished jobs are handed to the next worker that starts (or to a running peer) right away
+    await asyncio.to_thread(WORKERS.retire)
+    CPU_EXECUTOR.shutdown(wait=False)
+    await replicate_client.close_async_client()
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Setup rate limiter
 limiter = Limiter(key_func=get_remote_address)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# CORS Configuration
+@app.exception_handler(ExecutorSaturated)
+@app.exception_handler(SchedulerSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    # Backpressure: the CPU pool or the stylization queue is full, tell the client when to come back
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# --- Configuration ---
+# File-type & size validation
+ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/heic"}
+MAX_FILE_SIZE_MB = 10
+MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+
+# Refuse oversized bodies on upload routes before the multipart parser buffers them
+app.add_middleware(
+    MaxBodySizeMiddleware,
+    max_body_size=MAX_FILE_SIZE_BYTES + MULTIPART_OVERHEAD_BYTES,
+    path_prefixes=("/stylize",),
+)
+
+# Batches: up to BATCH_MAX_IMAGES images (multipart files or one ZIP) per request
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "20"))
+BATCH_MAX_UPLOAD_BYTES = BATCH_MAX_IMAGES * MAX_FILE_SIZE_BYTES
+# Replicate predictions one batch may have running at once; all jobs also share
+# the client's REPLICATE_MAX_IN_FLIGHT cap
+BATCH_MAX_PARALLEL_PREDICTIONS = int(os.getenv("BATCH_MAX_PARALLEL_PREDICTIONS", "8"))
+
+app.add_middleware(
+    MaxBodySizeMiddleware,
+    max_body_size=BATCH_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+    path_prefixes=("/batch",),
+)
+
+# CORS Configuration: added last so it wraps every other middleware, and the body
+# limit's early 413 still carries Access-Control-Allow-Origin for the browser to read
 origins = [
     "http://localhost:3000",  # Local Next.js dev server
     "https://sketchsplit.vercel.app",  # Production frontend URL
@@ -47,18 +155,115 @@ app.add_middleware(
     allow_headers=["*"],     # Or specify necessary headers
 )
 
-# --- Configuration ---
-# File-type & size validation
-ALLOWED_CONTENT_TYPES = {"image/jpeg", "image/png", "image/heic"}
-MAX_FILE_SIZE_MB = 10
-MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
-
-# Temporary storage for uploaded/processed files
+# Temporary storage for uploaded/processed files (created at startup, see lifespan)
 TEMP_IMAGE_DIR = Path("temp_images")
-TEMP_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
 
-# In-memory store for job status and file paths
-JOBS_DATA = {} 
+# Job status and file paths, shared by all workers (see JOB_STORE_URL)
+JOB_STORE = create_job_store()
+# The same store for async code: SQLite calls run in a thread, off the event loop
+JOBS = AsyncJobStore(JOB_STORE)
+
+# Content-addressed cache of edge maps and stylized images (see RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+RESULT_CACHE = create_result_cache()
+
+# Edge maps and stylized images kept in memory between stages (see LAYER_MEMORY_MAX_BYTES)
+LAYERS = create_layer_store()
+
+# Jobs are stamped with the worker running them; a live worker resumes the jobs of a dead one
+WORKERS = create_worker_registry(JOB_STORE)
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", DEFAULT_HEARTBEAT_SECONDS))
+
+# Identical jobs stylized at the same time share one prediction, across workers via JOB_STORE.
+# A flight led by a dead worker is taken over at once; live leaders renew theirs with the heartbeat
+STYLIZE_FLIGHTS = SingleFlight(JOB_STORE, worker_id=WORKERS.worker_id, is_alive=WORKERS.is_alive)
+
+# Slots for the stylization stage, shared fairly between clients (see SCHEDULER_CONCURRENCY,
+# SCHEDULER_MAX_QUEUE). Clients listed in SCHEDULER_PRIORITY_CLIENTS go first; batches go last.
+SCHEDULER = create_scheduler()
+SCHEDULER_PRIORITY_CLIENTS = {
+    client.strip() for client in os.getenv("SCHEDULER_PRIORITY_CLIENTS", "").split(",") if client.strip()
+}
+
+# Quota and TTL for the per-job directories under TEMP_IMAGE_DIR (see STORAGE_MAX_BYTES,
+# STORAGE_TTL_SECONDS); evicted jobs report status "expired"
+STORAGE = create_storage_manager(TEMP_IMAGE_DIR, JOB_STORE, on_evict=LAYERS.drop)
+STORAGE_SWEEP_SECONDS = float(os.getenv("STORAGE_SWEEP_SECONDS", DEFAULT_STORAGE_SWEEP_SECONDS))
+
+# Process/thread pool for CPU-bound steps (see PREPROCESS_EXECUTOR, PREPROCESS_WORKERS, PREPROCESS_MAX_QUEUE)
+CPU_EXECUTOR = create_executor()
+
+# Edge map resolution: full (default), reduced (about PREPROCESS_TARGET_SIZE px) or tiled
+PREPROCESS_MODE = os.getenv("PREPROCESS_MODE", "full")
+if PREPROCESS_MODE not in PREPROCESS_MODES:
+    raise ValueError(f"PREPROCESS_MODE must be one of {', '.join(PREPROCESS_MODES)}, got {PREPROCESS_MODE!r}")
+PREPROCESS_TARGET_SIZE = int(os.getenv("PREPROCESS_TARGET_SIZE", DEFAULT_TARGET_SIZE))
+
+# Pushes job updates to /status/{job_id}/events subscribers (see _publish_job_update)
+JOB_EVENTS = JobEventBroker()
+# Idle SSE streams send a comment this often and re-read the job, which also picks up
+# updates made by other workers (the broker only sees this process's writes)
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+# Animated preview in the download bundle: gif, webp (smaller) or mp4 (needs ffmpeg)
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "gif")
+if PREVIEW_FORMAT not in PREVIEW_FORMATS:
+    raise ValueError(f"PREVIEW_FORMAT must be one of {', '.join(PREVIEW_FORMATS)}, got {PREVIEW_FORMAT!r}")
+
+# Statuses a job can still fail from
+ACTIVE_STATUSES = ("processing_upload", "processing_canny", "processing_replicate")
+
+# --- Metrics (GET /metrics); stage timings come from metrics.timed in the pipeline ---
+JOB_FAILURES = metrics.REGISTRY.register(metrics.Counter(
+    "sketchsplit_job_failures", "Jobs that failed, by pipeline step.", ("stage",)
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_jobs_in_flight", "Jobs still being processed, by status.",
+    lambda: {status: len(JOB_STORE.find_by_status(status)) for status in ACTIVE_STATUSES}, label_names=("status",),
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_job_records", "Job, batch, flight and worker records in the job store.", lambda: len(JOB_STORE),
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_cache_hits", "Result cache hits, by kind.",
+    lambda: RESULT_CACHE.stats()["hits"], type="counter", label_names=("kind",),
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_cache_misses", "Result cache misses, by kind.",
+    lambda: RESULT_CACHE.stats()["misses"], type="counter", label_names=("kind",),
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_coalesced_jobs", "Jobs that shared the stylization of an identical in-flight job.",
+    lambda: STYLIZE_FLIGHTS.followers, type="counter",
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_scheduler_queued", "Jobs waiting for a stylization slot, by priority tier.",
+    lambda: SCHEDULER.stats()["queued"], label_names=("tier",),
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_scheduler_running", "Jobs holding a stylization slot.", lambda: SCHEDULER.running,
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_scheduler_shed", "Jobs refused with 503 because the stylization queue was full.",
+    lambda: SCHEDULER.shed, type="counter",
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_recovered_jobs", "Jobs of a dead worker resumed by this one.",
+    lambda: WORKERS.recovered, type="counter",
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_cpu_pool_pending", "Tasks running or queued in the CPU pool.", lambda: CPU_EXECUTOR.pending,
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_storage_bytes", "Bytes of job files on disk (as of the last sweep or write).",
+    lambda: STORAGE.stats()["bytes"],
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_storage_evictions", "Jobs whose files were evicted (TTL or quota).",
+    lambda: STORAGE.stats()["evicted"], type="counter",
+))
+metrics.REGISTRY.register(metrics.CallbackMetric(
+    "sketchsplit_layer_memory_bytes", "Bytes of image layers held in memory.", lambda: LAYERS.stats()["bytes"],
+))
 
 # --- Models ---
 class StylizeResponse(BaseModel):
@@ -69,6 +274,9 @@ class StylizeResponse(BaseModel):
 class StylizeInitiateResponse(BaseModel):
     job_id: str
     edge_path: str  # Relative path for frontend to show optimistic preview
+    status: Optional[str] = None  # "complete" straight away on a cache hit
+    # Small WebP versions of the edge map to show first: longer side in px ("256", "1024") -> relative path
+    edge_previews: Optional[dict[str, str]] = None
 
 class HealthResponse(BaseModel):
     status: str
@@ -77,202 +285,845 @@ class JobStatusResponse(BaseModel):
     job_id: str
     status: str
     edge_map_path: Optional[str] = None  # Relative path
+    edge_previews: Optional[dict[str, str]] = None  # See StylizeInitiateResponse
     stylized_image_path: Optional[str] = None  # Relative path (once available)
     error_message: Optional[str] = None
+    artifacts_status: Optional[str] = None  # pending | building | ready | failed (download artifacts)
+    # While waiting for a stylization slot: jobs ahead of this one and the estimated wait.
+    # Only known to the worker that queued the job; None elsewhere and once it runs.
+    queue_position: Optional[int] = None
+    eta_seconds: Optional[float] = None
+    control_map_paths: Optional[dict[str, str]] = None  # Extra control maps (filter -> relative path)
+    edge_svg_path: Optional[str] = None  # Vectorized edge map, if requested (relative path)
     # Add other paths if frontend needs them before full download
 
+class BatchInitiateResponse(BaseModel):
+    batch_id: str
+    jobs: list[StylizeInitiateResponse]
+
+class BatchStatusResponse(BaseModel):
+    batch_id: str
+    status: str  # processing | complete | partial (some failed) | failed | expired (files removed)
+    total: int
+    counts: dict[str, int]  # Jobs per status
+    progress: float  # 0..1 over all jobs and their pipeline stages
+    jobs: list[JobStatusResponse]
+
+# Share of a job's pipeline that is done in each status, for batch progress
+STATUS_PROGRESS = {
+    "processing_upload": 0.0,
+    "processing_canny": 0.2,
+    "processing_replicate": 0.5,
+    "complete": 1.0,
+    "failed": 1.0,
+    EXPIRED_STATUS: 1.0,
+}
+
+def _relative_path(path) -> str:
+    """Path as served under the static mount, relative to the working directory."""
+    path = Path(path)
+    return str(path.relative_to(Path.cwd()) if path.is_absolute() else path)
+
+def _edge_previews(job_info: Optional[dict]) -> Optional[dict[str, str]]:
+    """The job's edge map thumbnails as relative paths, or None if it has none."""
+    paths = (job_info or {}).get("edge_preview_paths")
+    return {size: _relative_path(path) for size, path in paths.items()} if paths else None
+
 # --- Background Tasks ---
-async def process_stylization_in_background(job_id: str, edge_map_abs_path: str, prompt: str):
-    JOBS_DATA[job_id]["status"] = "processing_replicate"
+async def process_stylization_in_background(job_id: str, edge_map_abs_path: str, prompt: str,
+                                            stylized_key: Optional[str] = None, model_id: Optional[str] = None,
+                                            resume: bool = False):
+    """
+    Stylization stage of a job, checkpointed so a job whose worker died can be resumed
+    (`resume=True`, see recover_job) from what was already done: the Replicate prediction
+    id is recorded as soon as the prediction exists, and the stylized image is written
+    under a fixed name before the job is marked complete. On resume, an existing stylized
+    image is kept, then one in the result cache (a coalesced follower has no prediction of
+    its own, but its leader may have finished); a recorded prediction is reattached to, and
+    only otherwise does the job start over. Resumed jobs join the flight for their key
+    too, so an identical resubmission waits for them instead of paying again.
+    """
+    from_statuses = ("processing_canny", "processing_replicate") if resume else ("processing_canny",)
+    if not await JOBS.transition(job_id, "processing_replicate", from_statuses=from_statuses):
+        print(f"Job {job_id} is no longer waiting for stylization. Skipping.")
+        return
     try:
-        # 1. Call Replicate
-        stylized_url = replicate_client.stylize_image_with_replicate(
-            edge_map_path=str(edge_map_abs_path),  # replicate_client expects string path
-            prompt=prompt
-        )
-        if not stylized_url:
-            raise ValueError("Replicate did not return a URL.")
-
-        # 2. Download the stylized image from Replicate URL
         job_temp_dir = TEMP_IMAGE_DIR / job_id
         job_temp_dir.mkdir(parents=True, exist_ok=True)
-        stylized_image_filename = f"stylized_{Path(JOBS_DATA[job_id]['original_filename']).stem}.png"
+        job_info = await JOBS.get(job_id)
+        if not job_info:
+            raise ValueError("Job record expired during stylization.")
+
+        stylized_image_filename = f"stylized_{Path(job_info['original_filename']).stem}.png"
         stylized_image_path = job_temp_dir / stylized_image_filename
 
-        async with httpx.AsyncClient(timeout=60.0) as client:  # Increased timeout for download
-            response = await client.get(stylized_url)
-            response.raise_for_status()  # Raise an exception for bad status codes
-            with open(stylized_image_path, 'wb') as f:
-                f.write(response.content)
-        
-        JOBS_DATA[job_id]["stylized_image_path"] = stylized_image_path
-        JOBS_DATA[job_id]["status"] = "complete"  # Mark as complete for polling
+        async def stylize() -> str:
+            # Wait for a slot: clients take turns, so one client's burst does not hold up the rest
+            client = job_info.get("client_id") or "anonymous"
+            async with SCHEDULER.slot(job_id, client, job_info.get("priority") or DEFAULT_TIER):
+                # 1. Stylize: Replicate (async client, the loop keeps serving while the prediction
+                # runs) or a local OpenCV style, depending on the model id
+                stylizer = stylizers.get_stylizer(model_id, CPU_EXECUTOR)
+                if resume and stylizer.resumable and job_info.get("prediction_id"):
+                    stylized = await stylizer.resume(job_info["prediction_id"], destination=stylized_image_path)
+                else:
+                    source_image = None
+                    if stylizer.needs_source_image and job_info.get("source_image_path"):
+                        source_image = LAYERS.source(job_id, "source", job_info["source_image_path"])
+                        if resume and not isinstance(source_image, bytes) and not source_image.exists():
+                            # Never written to disk (see prepare_job), so it died with the worker
+                            raise ValueError("The uploaded photo was lost in a server restart. Please resubmit.")
+                    stylized = await stylizer.stylize(
+                        LAYERS.source(job_id, "edge", edge_map_abs_path),  # Skips reading the file back if still in memory
+                        prompt,
+                        source_image=source_image,
+                        # Checkpoint: a restarted worker reattaches instead of paying for a new prediction
+                        on_started=lambda handle: JOBS.update(job_id, prediction_id=handle),
+                        destination=stylized_image_path,
+                    )
+
+                # 2. Keep the stylized image: written once, where it is served
+                # (a streamed download is already there and is not held in memory)
+                if isinstance(stylized, bytes):
+                    LAYERS.put(job_id, "stylized", stylized, stylized_image_path)
+                if stylized_key:
+                    RESULT_CACHE.put("stylized", stylized_key, stylized_image_path)
+                return str(stylized_image_path)
+
+        if resume and not stylized_image_path.exists() and stylized_key:
+            # A coalesced follower has no prediction to reattach to, but its leader may have finished
+            cached_stylized = RESULT_CACHE.get("stylized", stylized_key)
+            if cached_stylized:
+                place_file(cached_stylized, stylized_image_path)
+        if resume and stylized_image_path.exists():
+            # Downloaded before the worker died, or just taken from the cache
+            print(f"Job {job_id} resumed with its stylized image already in place.")
+        elif stylized_key:
+            # Same image, params, model and prompt as a job still running (double click, client
+            # retry): wait for that job's prediction instead of starting another one. The flight
+            # of a dead worker is taken over right away (see STYLIZE_FLIGHTS)
+            leader_path, shared = await STYLIZE_FLIGHTS.do(stylized_key, stylize)
+            if shared:
+                place_file(Path(leader_path), stylized_image_path)
+                print(f"Job {job_id} shared the stylized image of an identical in-flight job.")
+        else:
+            await stylize()
+
+        # Mark as complete for polling
+        await JOBS.transition(
+            job_id, "complete", from_statuses=("processing_replicate",), stylized_image_path=str(stylized_image_path)
+        )
         print(f"Job {job_id} stylization complete. Image at {stylized_image_path}")
 
     except Exception as e:
         print(f"Error in background stylization for job {job_id}: {e}")
-        JOBS_DATA[job_id]["status"] = "failed"
-        JOBS_DATA[job_id]["error_message"] = str(e)
+        await JOBS.transition(job_id, "failed", from_statuses=ACTIVE_STATUSES, error_message=str(e))
+        JOB_FAILURES.inc(stage="stylize")
+        LAYERS.drop(job_id)
+        return
+
+    # Build the download artifacts now so /download only has to serve files
+    await build_job_artifacts(job_id)
+
+async def recover_job(job_info: dict):
+    """
+    Resumes a job whose worker died (claimed by WORKERS) from its last checkpoint: the
+    edge map on disk and the stylization stage's own (see process_stylization_in_background).
+    A job that had not got its edge map yet fails; its upload was never kept. Artifacts of
+    a complete job are built on demand by /download, as for any job whose build was skipped.
+    """
+    job_id = job_info["job_id"]
+    edge_map_path = job_info.get("edge_map_path")
+    if job_info.get("output") == EDGES_OUTPUT and edge_map_path and Path(edge_map_path).exists():
+        # Edges-only: the maps (recorded together with the edge map) were all there was to do
+        if await JOBS.transition(job_id, "complete", from_statuses=ACTIVE_STATUSES):
+            await build_job_artifacts(job_id)  # Settles artifacts_status, as finish_job would
+        return
+    if not edge_map_path or not Path(edge_map_path).exists() or not job_info.get("stylized_key"):
+        if await JOBS.transition(job_id, "failed", from_statuses=ACTIVE_STATUSES,
+                                 error_message="Interrupted by a server restart before preprocessing finished. Please resubmit."):
+            JOB_FAILURES.inc(stage="recovery")
+        LAYERS.drop(job_id)
+        return
+    print(f"Resuming job {job_id} ({job_info['status']}) left behind by worker {job_info.get('worker_id')}")
+    await process_stylization_in_background(
+        job_id, edge_map_path, job_info.get("prompt") or "a beautiful sketch", job_info["stylized_key"],
+        job_info.get("model_id"), resume=True,
+    )
+
+async def build_job_artifacts(job_id: str, raise_errors: bool = False) -> Optional[dict]:
+    """
+    Builds the composite and preview for a completed job in the CPU pool and
+    records their paths and `artifacts_status`. Safe to call more than once.
+    Layers still in memory are handed over as bytes instead of being read back;
+    they are released once the artifacts are built (or failed). Edges-only jobs have
+    nothing to compose: their artifacts are ready as soon as the edge map is.
+    """
+    job_info = await JOBS.get(job_id)
+    edge_map_path = job_info.get("edge_map_path") if job_info else None
+    if job_info and job_info.get("output") == EDGES_OUTPUT:
+        if not edge_map_path or not Path(edge_map_path).exists():
+            if raise_errors:
+                raise HTTPException(status_code=500, detail="Required image files for job are missing.")
+            return None
+        LAYERS.drop(job_id)
+        await JOBS.update(job_id, artifacts_status="ready")
+        STORAGE.record(job_id)
+        return {}
+    stylized_image_path = job_info.get("stylized_image_path") if job_info else None
+
+    if not edge_map_path or not Path(edge_map_path).exists() or \
+       not stylized_image_path or not Path(stylized_image_path).exists():
+        if raise_errors:
+            raise HTTPException(status_code=500, detail="Required image files for job are missing.")
+        return None
+
+    await JOBS.update(job_id, artifacts_status="building")
+    try:
+        artifacts = await CPU_EXECUTOR.run(
+            composer.build_download_artifacts,
+            job_id,
+            LAYERS.source(job_id, "edge", edge_map_path),
+            LAYERS.source(job_id, "stylized", stylized_image_path),
+            TEMP_IMAGE_DIR / job_id,  # Base directory for this job's files
+            Path(job_info["original_filename"]).stem,
+            PREVIEW_FORMAT,
+            (job_info.get("control_filters") or DEFAULT_CONTROL_FILTERS)[0] in SOFT_CONTROL_FILTERS,
+        )
+    except ExecutorSaturated:
+        # Leave it for /download to build on demand (layers stay in memory for it)
+        await JOBS.update(job_id, artifacts_status="pending")
+        if raise_errors:
+            raise
+        return None
+    except Exception as e:
+        print(f"Error building download artifacts for job {job_id}: {e}")
+        await JOBS.update(job_id, artifacts_status="failed")
+        JOB_FAILURES.inc(stage="artifacts")
+        LAYERS.drop(job_id)
+        if raise_errors:
+            raise HTTPException(status_code=500, detail=f"Error building download artifacts: {e}")
+        return None
+
+    LAYERS.drop(job_id)
+    await JOBS.update(job_id, artifacts_status="ready", **artifacts)
+    STORAGE.record(job_id)
+    return artifacts
+
+async def _discard_job(job_id: str):
+    """Forgets a job that was refused: its record, in-memory layers and files."""
+    # Layers first: spilling one later would write its file back into the removed directory
+    LAYERS.drop(job_id)
+    await JOBS.delete(job_id)
+    shutil.rmtree(TEMP_IMAGE_DIR / job_id, ignore_errors=True)
+
+def _bundle_files(job_info: dict) -> dict[str, Path]:
+    """Archive names -> files for a job's download bundle."""
+    stem = Path(job_info['original_filename']).stem
+    files_to_bundle = {f"01_edge_map_{stem}.png": Path(job_info["edge_map_path"])}
+    if job_info.get("edge_svg_path"):
+        files_to_bundle[f"01_edge_map_{stem}.svg"] = Path(job_info["edge_svg_path"])
+    for name, path in (job_info.get("control_map_paths") or {}).items():
+        files_to_bundle[f"04_control_{name}_{stem}.png"] = Path(path)
+    if job_info.get("output") == EDGES_OUTPUT:
+        return files_to_bundle
+    files_to_bundle[f"02_stylized_{stem}.png"] = Path(job_info["stylized_image_path"])
+    files_to_bundle[f"03_composite_{stem}.png"] = Path(job_info["composite_image_path"])
+    # gif_preview_path: records written before previews could be WebP/MP4
+    preview_path = job_info.get("preview_path") or job_info.get("gif_preview_path")
+    if preview_path and Path(preview_path).exists():  # Only add the preview if created successfully
+        files_to_bundle[f"preview_{stem}{Path(preview_path).suffix}"] = Path(preview_path)
+    return files_to_bundle
+
+def _artifacts_ready(job_info: dict) -> bool:
+    """Whether a complete job's download artifacts are built and still on disk."""
+    if job_info.get("artifacts_status") != "ready":
+        return False
+    if job_info.get("output") == EDGES_OUTPUT:
+        return True
+    composite_image_path = job_info.get("composite_image_path")
+    return bool(composite_image_path) and Path(composite_image_path).exists()
 
 # --- Routes ---
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
+    # Liveness: the process is up and serving. Whether it can take work is /ready
     return {"status": "ok"}
 
-@app.post("/stylize", response_model=StylizeInitiateResponse)
-@limiter.limit("60/minute")
-async def create_stylize_job(
-    request: Request,
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    prompt: Optional[str] = Form("pencil sketch")
-):
-    # File-type validation
-    if file.content_type not in ALLOWED_CONTENT_TYPES:
-        raise HTTPException(
-            status_code=415, detail=f"Unsupported file type: {file.content_type}. Allowed: {', '.join(ALLOWED_CONTENT_TYPES)}"
-        )
+@app.get("/ready", response_model=HealthResponse, responses={503: {"model": HealthResponse}})
+async def readiness_check():
+    """Readiness: 503 until the warm-up after startup is done (or if it failed)."""
+    if READINESS["status"] != "ready":
+        return JSONResponse(status_code=503, content={"status": READINESS["status"]})
+    return {"status": "ready"}
 
-    # Size validation
-    contents = await file.read()
-    actual_size = len(contents)  # Get size from read content
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus text format; counts are per process, so scrape every worker
+    body = await asyncio.to_thread(metrics.REGISTRY.render)  # Gauges may query the job store
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
 
-    if actual_size > MAX_FILE_SIZE_BYTES:
-        raise HTTPException(
-            status_code=413, detail=f"File too large: {actual_size / (1024*1024):.2f} MB. Maximum size is {MAX_FILE_SIZE_MB} MB."
-        )
+@app.post("/webhooks/replicate")
+async def replicate_webhook(request: Request):
+    """
+    Completion webhook for predictions started with REPLICATE_WEBHOOK_URL set. Only
+    served with REPLICATE_WEBHOOK_SECRET set too: unsigned deliveries are never accepted.
+    """
+    secret = os.getenv("REPLICATE_WEBHOOK_SECRET")
+    if not (secret and replicate_client.get_async_client().webhook_url):
+        raise HTTPException(status_code=404, detail="Not found")
+    body = await request.body()
+    if not replicate_client.verify_webhook_signature(request.headers, body, secret):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    try:
+        prediction = json.loads(body)
+    except json.JSONDecodeError:
+        # 400, not 500: Replicate would keep redelivering a body that never parses
+        raise HTTPException(status_code=400, detail="Webhook body is not valid JSON")
+    if not isinstance(prediction, dict):
+        raise HTTPException(status_code=400, detail="Webhook body is not a prediction")
+    # Only the worker that started the prediction is waiting on it; others rely on polling
+    delivered = replicate_client.get_async_client().notify_webhook(prediction)
+    return {"delivered": delivered}
+
+async def prepare_job(contents: bytes, filename: str, prompt: str, model_id: str,
+                      job_id: Optional[str] = None, control_filters: tuple = DEFAULT_CONTROL_FILTERS,
+                      output: str = DEFAULT_OUTPUT_MODE, svg: bool = False,
+                      **job_fields) -> tuple[str, Path, Optional[str]]:
+    """
+    Creates a job and its edge map (from the result cache, or Canny in the CPU pool).
+    If the stylized image is cached too, the job is marked complete right away.
 
-    job_id = str(uuid.uuid4())
-    JOBS_DATA[job_id] = {"status": "processing_upload", "original_filename": file.filename}
+    `control_filters` (see preprocess.CONTROL_FILTERS): the first one makes the edge map
+    the model is conditioned on; the others are extra layers for the download bundle.
+    Whatever is not cached is computed in one CPU pool call that decodes the image once.
+    The edge map's thumbnails (EDGE_PREVIEW_SIZES) are made in the same call and recorded
+    as `edge_preview_paths`; they are optional and skipped if only they are left to do
+    and the pool is full. With `svg`, the edge map is also vectorized (recorded as
+    `edge_svg_path`, cached like the map). With `output="edges"` the job is complete
+    once the maps are written; nothing is stylized.
+
+    Returns (job_id, edge map path, stylized cache key); the key is None when the job is
+    already complete. Raises ExecutorSaturated after deleting the job if the pool is full,
+    and HTTPException(500) after marking the job failed if preprocessing fails.
+    """
+    job_id = job_id or str(uuid.uuid4())
+    await JOBS.create(job_id, "processing_upload", original_filename=filename, worker_id=WORKERS.worker_id,
+                      prompt=prompt, model_id=model_id, output=output, svg=svg, **job_fields)
 
     job_temp_dir = TEMP_IMAGE_DIR / job_id
     job_temp_dir.mkdir(parents=True, exist_ok=True)
-    
+
+    stem = Path(filename).stem
+    final_edge_map_name = f"edge_{stem}.png"
+    final_edge_map_path = job_temp_dir / final_edge_map_name
+    control_map_paths = {name: job_temp_dir / f"control_{name}_{stem}.png" for name in control_filters[1:]}
+    svg_path = job_temp_dir / f"edge_{stem}.svg" if svg else None
+    map_paths = {control_filters[0]: final_edge_map_path, **control_map_paths}
+
     try:
-        JOBS_DATA[job_id]["status"] = "processing_canny"
-        edge_map_path_obj = canny_edge(contents, file.filename)  # This saves to global TEMP_IMAGE_DIR
-        
-        # Move edge_map to job-specific folder and update path
-        final_edge_map_name = f"edge_{Path(file.filename).stem}.png"
-        final_edge_map_path = job_temp_dir / final_edge_map_name
-        shutil.move(edge_map_path_obj, final_edge_map_path)  # Move from global temp to job specific temp
-        
-        JOBS_DATA[job_id]["edge_map_path"] = final_edge_map_path
+        await JOBS.transition(job_id, "processing_canny")
+        # Hashing a 10 MB upload takes a few ms; keep it off the loop as well
+        edge_keys = await asyncio.to_thread(lambda: {
+            name: edge_cache_key(contents, DEFAULT_LOW_THRESHOLD, DEFAULT_HIGH_THRESHOLD, DEFAULT_BLUR_KSIZE,
+                                 PREPROCESS_MODE, PREPROCESS_TARGET_SIZE, control_filter=name)
+            for name in control_filters
+        })
+        edge_key = edge_keys[control_filters[0]]
+        stylized_key = stylized_cache_key(edge_key, model_id, prompt)
+
+        missing = []
+        for name, path in map_paths.items():
+            cached_map = RESULT_CACHE.get("edge", edge_keys[name])
+            if cached_map:
+                place_file(cached_map, path)
+            else:
+                missing.append(name)
+        # Thumbnails are named after the edge map's content, so they can be cached forever
+        preview_paths = {size: job_temp_dir / f"edge_{size}px_{edge_key[:16]}.webp" for size in EDGE_PREVIEW_SIZES}
+        missing_previews = {}
+        for size, path in preview_paths.items():
+            cached_preview = RESULT_CACHE.get("edge_preview", f"{edge_key}_{size}", suffix=".webp")
+            if cached_preview:
+                place_file(cached_preview, path)
+            else:
+                missing_previews[size] = path
+        missing_svg = False
+        if svg_path:
+            cached_svg = RESULT_CACHE.get("edge_svg", edge_key, suffix=".svg")
+            if cached_svg:
+                place_file(cached_svg, svg_path)
+            else:
+                missing_svg = True
 
+        if missing:
+            # Runs in the CPU pool so other requests keep being served; the PNGs come back as bytes
+            map_pngs = await CPU_EXECUTOR.run(
+                preprocess.control_maps_png, contents, tuple(missing), mode=PREPROCESS_MODE, target_size=PREPROCESS_TARGET_SIZE,
+                preview_paths=missing_previews if control_filters[0] in missing else None,
+                svg_path=str(svg_path) if missing_svg and control_filters[0] in missing else None,
+            )
+            for name, png in map_pngs.items():
+                # Written once, where it is served; the edge map in memory feeds the model and the composer
+                layer = "edge" if name == control_filters[0] else f"control_{name}"
+                LAYERS.put(job_id, layer, png, map_paths[name])
+                RESULT_CACHE.put("edge", edge_keys[name], map_paths[name])
+        if missing_previews and control_filters[0] not in missing:
+            # Edge map from the cache but not its thumbnails: make them from the PNG
+            try:
+                await CPU_EXECUTOR.run(preprocess.write_edge_previews, str(final_edge_map_path), missing_previews)
+            except ExecutorSaturated:
+                preview_paths = {size: path for size, path in preview_paths.items() if size not in missing_previews}
+        for size in missing_previews.keys() & preview_paths.keys():
+            RESULT_CACHE.put("edge_preview", f"{edge_key}_{size}", preview_paths[size], suffix=".webp")
+        if missing_svg:
+            if control_filters[0] not in missing:
+                # Requested output, unlike the thumbnails: a full pool answers 503
+                await CPU_EXECUTOR.run(preprocess.write_edge_svg, str(final_edge_map_path), str(svg_path))
+            RESULT_CACHE.put("edge_svg", edge_key, svg_path, suffix=".svg")
+
+        await JOBS.update(
+            job_id,
+            edge_map_path=str(final_edge_map_path),
+            stylized_key=stylized_key,  # With the edge map on disk: enough to resume the job (recover_job)
+            edge_preview_paths={str(size): str(path) for size, path in preview_paths.items()},
+            control_filters=list(control_filters),
+            **({"control_map_paths": {name: str(path) for name, path in control_map_paths.items()}}
+               if control_map_paths else {}),
+            **({"edge_svg_path": str(svg_path)} if svg_path else {}),
+        )
+
+    except ExecutorSaturated:
+        # Not (fully) processed; forget the job and let the handler answer 503
+        await _discard_job(job_id)
+        raise
     except Exception as e:
-        JOBS_DATA[job_id]["status"] = "failed"
-        JOBS_DATA[job_id]["error_message"] = f"Preprocessing error: {e}"
-        raise HTTPException(status_code=500, detail=JOBS_DATA[job_id]["error_message"])
+        error_message = f"Preprocessing error: {e}"
+        await JOBS.transition(job_id, "failed", from_statuses=ACTIVE_STATUSES, error_message=error_message)
+        JOB_FAILURES.inc(stage="preprocess")
+        LAYERS.drop(job_id)
+        raise HTTPException(status_code=500, detail=error_message)
+
+    if output == EDGES_OUTPUT:
+        # Fast path: the edge map is the result
+        await JOBS.transition(job_id, "complete", from_statuses=("processing_canny",))
+        return job_id, final_edge_map_path, None
+
+    # Same image, Canny params, model and prompt as an earlier job: reuse its stylized image
+    cached_stylized = RESULT_CACHE.get("stylized", stylized_key)
+    if cached_stylized:
+        stylized_image_path = place_file(
+            cached_stylized, job_temp_dir / f"stylized_{stem}.png"
+        )
+        await JOBS.transition(
+            job_id, "complete", from_statuses=("processing_canny",), stylized_image_path=str(stylized_image_path)
+        )
+        return job_id, final_edge_map_path, None
+
+    if stylizers.is_local_model(model_id):
+        # Local styles filter the photo itself; keep it for the stylization stage
+        source_path = job_temp_dir / f".source_{Path(filename).name}"
+        LAYERS.put(job_id, "source", contents, source_path, persist=False)
+        await JOBS.update(job_id, source_image_path=str(source_path))
+    return job_id, final_edge_map_path, stylized_key
+
+async def finish_job(job_id: str, edge_map_path: Path, prompt: str, stylized_key: Optional[str],
+                     model_id: Optional[str] = None):
+    """Background part of a prepared job: stylize it, or only build artifacts if it is already complete."""
+    if stylized_key is None:
+        await build_job_artifacts(job_id)
+    else:
+        await process_stylization_in_background(job_id, str(edge_map_path.resolve()), prompt, stylized_key, model_id)
+
+def _resolve_request_model(model: Optional[str]) -> str:
+    """The model for a request: the configured one unless the client picked a local style."""
+    default_model = replicate_client.resolve_model_id()
+    if not model or model == default_model:
+        return default_model
+    if model in stylizers.LOCAL_MODEL_IDS:
+        return model
+    allowed = ", ".join((default_model,) + stylizers.LOCAL_MODEL_IDS)
+    raise HTTPException(status_code=400, detail=f"Unsupported model: {model}. Use one of {allowed}.")
+
+def _request_client(request: Request, default_tier: str = DEFAULT_TIER) -> tuple[str, str]:
+    """(client id, priority tier) for the scheduler; clients are told apart like the rate limiter does."""
+    client_id = get_remote_address(request)
+    return client_id, "high" if client_id in SCHEDULER_PRIORITY_CLIENTS else default_tier
+
+def _resolve_request_output(output: Optional[str]) -> str:
+    """What a request wants back: the stylized image (default) or only the edge map ("edges")."""
+    if not output:
+        return DEFAULT_OUTPUT_MODE
+    if output not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unsupported output: {output}. Use one of {', '.join(OUTPUT_MODES)}.")
+    return output
+
+def _resolve_request_filters(filters: Optional[str]) -> tuple[str, ...]:
+    """Control filters for a request ("canny,sobel"); the first conditions the model."""
+    try:
+        return parse_control_filters(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/stylize", response_model=StylizeInitiateResponse)
+@limiter.limit("60/minute")
+async def create_stylize_job(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    prompt: Optional[str] = Form("pencil sketch"),
+    model: Optional[str] = Form(None),
+    filters: Optional[str] = Form(None),
+    output: Optional[str] = Form(None),  # "edges": stop after the edge map, no stylization
+    svg: bool = Form(False)  # Also vectorize the edge map into an SVG layer
+):
+    model_id = _resolve_request_model(model)
+    control_filters = _resolve_request_filters(filters)
+    output = _resolve_request_output(output)
+    client_id, priority = _request_client(request)
+    if output != EDGES_OUTPUT:
+        SCHEDULER.admit(priority)  # Shed load before reading the upload
+    # Size and file-type validation while streaming the upload: stops at MAX_FILE_SIZE_BYTES
+    # and checks the magic bytes instead of trusting the client's content_type
+    contents, _ = await read_upload_limited(file, MAX_FILE_SIZE_BYTES, ALLOWED_CONTENT_TYPES)
 
-    # Kick off Replicate processing in the background
     final_prompt = prompt if prompt else "a beautiful sketch"
-    background_tasks.add_task(
-        process_stylization_in_background,
-        job_id,
-        str(final_edge_map_path.resolve()),  # Pass absolute path to background task
-        final_prompt
+    job_id, final_edge_map_path, stylized_key = await prepare_job(
+        contents, file.filename, final_prompt, model_id, control_filters=control_filters, output=output, svg=svg,
+        client_id=client_id, priority=priority,
     )
+
+    # Kick off stylization (or just the artifacts on a cache hit) in the background
+    background_tasks.add_task(finish_job, job_id, final_edge_map_path, final_prompt, stylized_key, model_id)
     
     # Return job_id and edge_map_path for optimistic UI
-    relative_edge_path = str(final_edge_map_path.relative_to(Path.cwd()))
+    relative_edge_path = _relative_path(final_edge_map_path)
     
     return StylizeInitiateResponse(
         job_id=job_id,
-        edge_path=relative_edge_path 
+        edge_path=relative_edge_path,
+        status="complete" if stylized_key is None else "processing_canny",
+        edge_previews=_edge_previews(await JOBS.get(job_id)),
     )
 
-@app.get("/status/{job_id}", response_model=JobStatusResponse)
-async def get_job_status(job_id: str):
-    job_info = JOBS_DATA.get(job_id)
+def _job_status_response(job_id: str, job_info: Optional[dict]) -> JobStatusResponse:
     if not job_info:
-        raise HTTPException(status_code=404, detail="Job not found")
-    
+        # Job record expired or was dropped (e.g. a batch member refused by a full CPU pool)
+        return JobStatusResponse(job_id=job_id, status="failed", error_message="Job not found")
+
+    if job_info["status"] == EXPIRED_STATUS:
+        # The files are gone; only the outcome is left
+        return JobStatusResponse(job_id=job_id, status=EXPIRED_STATUS, error_message=job_info.get("error_message"))
+
     # Make paths relative for the response
     edge_path_rel = None
     if job_info.get("edge_map_path"):
-        edge_path_rel = str(Path(job_info["edge_map_path"]).relative_to(Path.cwd()))
+        edge_path_rel = _relative_path(job_info["edge_map_path"])
     
     stylized_path_rel = None
     if job_info.get("stylized_image_path"):
-        stylized_path_rel = str(Path(job_info["stylized_image_path"]).relative_to(Path.cwd()))
+        stylized_path_rel = _relative_path(job_info["stylized_image_path"])
+
+    queue_position = eta_seconds = None
+    # The scheduler is only safe to read from the event loop (see _publish_job_update)
+    if job_info["status"] == "processing_replicate" and _on_event_loop():
+        queue_position, eta_seconds = SCHEDULER.position(job_id), SCHEDULER.eta_seconds(job_id)
+
+    control_map_paths = None
+    if job_info.get("control_map_paths"):
+        control_map_paths = {name: _relative_path(path) for name, path in job_info["control_map_paths"].items()}
 
     return JobStatusResponse(
         job_id=job_id,
         status=job_info["status"],
         edge_map_path=edge_path_rel,
+        edge_previews=_edge_previews(job_info),
         stylized_image_path=stylized_path_rel,
-        error_message=job_info.get("error_message")
+        error_message=job_info.get("error_message"),
+        artifacts_status=job_info.get("artifacts_status") or ("pending" if job_info["status"] == "complete" else None),
+        queue_position=queue_position,
+        eta_seconds=eta_seconds,
+        control_map_paths=control_map_paths,
+        edge_svg_path=_relative_path(job_info["edge_svg_path"]) if job_info.get("edge_svg_path") else None,
     )
 
-@app.get("/download/{job_id}")
-async def download_results(job_id: str):
-    job_info = JOBS_DATA.get(job_id)
-    if not job_info:
+async def _get_job(job_id: str) -> dict:
+    job_info = await JOBS.get(job_id)
+    if not job_info or job_info.get("kind") in ("batch", FLIGHT_KIND, WORKER_KIND, CLAIM_KIND):
         raise HTTPException(status_code=404, detail="Job not found")
+    return job_info
+
+@app.get("/status/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str):
+    job_info = await _get_job(job_id)
+    STORAGE.touch(job_id)  # Someone still cares about this job: keep its files
+    return _job_status_response(job_id, job_info)
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+def _publish_job_update(job_id: str, record: Optional[dict]):
+    """
+    Job store listener: builds the status payload once per change and fans it out.
+    Runs on whichever thread wrote the record (to_thread calls, CPU pool callbacks);
+    off the event loop the payload leaves out the queue position and ETA.
+    """
+    if not JOB_EVENTS.has_subscribers(job_id):
+        return  # Nobody is listening; skip building the payload
+    JOB_EVENTS.publish(job_id, _job_status_response(job_id, record).model_dump())
+
+JOB_STORE.add_listener(_publish_job_update)
+
+def _is_final(status: dict) -> bool:
+    # A complete job still has its download artifacts to build; stay open until they settle
+    return status["status"] in ("failed", EXPIRED_STATUS) or (
+        status["status"] == "complete" and status["artifacts_status"] in ("ready", "failed")
+    )
+
+def _sse_message(status: dict) -> str:
+    return f"event: status\ndata: {json.dumps(status)}\n\n"
+
+@app.get("/status/{job_id}/events")
+async def stream_job_status(job_id: str):
+    """
+    Server-Sent Events stream of a job's status: the current status right away, then
+    one `status` event per change (processing_canny -> processing_replicate ->
+    complete/failed, then artifacts_status). Closes once nothing more will change.
+    """
+    await _get_job(job_id)
+    # Subscribe before reading the current state so no transition falls in between
+    subscription = JOB_EVENTS.subscribe(job_id)
+
+    async def events():
+        try:
+            last = _job_status_response(job_id, await JOBS.get(job_id)).model_dump()
+            yield f"retry: 3000\n{_sse_message(last)}"
+            while not _is_final(last):
+                try:
+                    status = await subscription.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    status = _job_status_response(job_id, await JOBS.get(job_id)).model_dump()
+                    if status == last:
+                        yield ": keep-alive\n\n"
+                        continue
+                if status != last:
+                    yield _sse_message(status)
+                    last = status
+        finally:
+            JOB_EVENTS.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/download/{job_id}")
+async def download_results(job_id: str, request: Request):
+    job_info = await _get_job(job_id)
+    if job_info["status"] == EXPIRED_STATUS:
+        raise HTTPException(status_code=410, detail=job_info.get("error_message") or "Job files expired.")
     if job_info["status"] != "complete":
         raise HTTPException(status_code=400, detail=f"Job not yet complete. Status: {job_info['status']}")
+    STORAGE.touch(job_id)
 
-    edge_map_path = job_info.get("edge_map_path")
-    stylized_image_path = job_info.get("stylized_image_path")
+    # Normally built right after stylization; build now if that has not happened (yet)
+    if not _artifacts_ready(job_info):
+        await build_job_artifacts(job_id, raise_errors=True)
+        job_info = await JOBS.get(job_id)
 
-    if not edge_map_path or not Path(edge_map_path).exists() or \
-       not stylized_image_path or not Path(stylized_image_path).exists():
-        raise HTTPException(status_code=500, detail="Required image files for job are missing.")
+    files_to_bundle = _bundle_files(job_info)
 
-    job_temp_dir = TEMP_IMAGE_DIR / job_id  # Base directory for this job's files
+    # Layers never change once built, so their stats give a stable ETag for the bundle
+    etag_source = job_id + "".join(
+        f"|{name}:{p.stat().st_mtime_ns}:{p.stat().st_size}" for name, p in files_to_bundle.items()
+    )
+    etag = f'"{hashlib.sha1(etag_source.encode()).hexdigest()}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=cache_headers)
 
-    # Define paths for composed files
-    composite_image_path = job_temp_dir / f"composite_{Path(job_info['original_filename']).stem}.png"
-    gif_preview_path = job_temp_dir / f"preview_{Path(job_info['original_filename']).stem}.gif"
-    zip_bundle_path = job_temp_dir / f"sketchsplit_{job_id}.zip"
+    # The ZIP is generated while it is sent: no bundle on disk, first bytes go out right away
+    return StreamingResponse(
+        composer.stream_zip_bundle(job_id, files_to_bundle),
+        media_type='application/zip',
+        headers={
+            **cache_headers,
+            "Content-Disposition": f'attachment; filename="sketchsplit_results_{job_id}.zip"',
+        },
+    )
 
-    # 1. Merge PNG layers (stylized image as base, edge map as overlay)
-    try:
-        composer.merge_layers(stylized_image_path, edge_map_path, composite_image_path)
-        JOBS_DATA[job_id]["composite_image_path"] = composite_image_path
-    except Exception as e:
-        print(f"Error merging layers for job {job_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error merging image layers: {e}")
-
-    # 2. Generate GIF preview (e.g., from edge map, stylized, and composite)
-    # Ensure these paths are absolute if imageio needs them
-    frames_for_gif = [
-        Path(edge_map_path).resolve(), 
-        Path(stylized_image_path).resolve(),
-        Path(composite_image_path).resolve()
-    ]
-    try:
-        composer.create_gif_preview(frames_for_gif, gif_preview_path)
-        JOBS_DATA[job_id]["gif_preview_path"] = gif_preview_path
-    except Exception as e:
-        print(f"Error creating GIF for job {job_id}: {e}")
-        # Continue to ZIP creation, GIF is optional for download
-        pass  # Or raise HTTPException if GIF is critical
-
-    # 3. Create ZIP bundle
-    files_to_bundle = {
-        f"01_edge_map_{Path(job_info['original_filename']).stem}.png": Path(edge_map_path),
-        f"02_stylized_{Path(job_info['original_filename']).stem}.png": Path(stylized_image_path),
-        f"03_composite_{Path(job_info['original_filename']).stem}.png": Path(composite_image_path),
-    }
-    if Path(gif_preview_path).exists():  # Only add GIF if created successfully
-         files_to_bundle[f"preview_{Path(job_info['original_filename']).stem}.gif"] = Path(gif_preview_path)
-    
-    try:
-        composer.create_zip_bundle(job_id, files_to_bundle, zip_bundle_path)
-        JOBS_DATA[job_id]["zip_bundle_path"] = zip_bundle_path
-    except Exception as e:
-        print(f"Error creating ZIP for job {job_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error creating ZIP bundle: {e}")
-        
-    return FileResponse(
-        path=zip_bundle_path,
-        filename=f"sketchsplit_results_{job_id}.zip",
-        media_type='application/zip'
+# --- Batches ---
+async def process_batch_in_background(batch_id: str, prepared_jobs: list[tuple[str, Path, Optional[str]]], prompt: str,
+                                      model_id: Optional[str] = None):
+    """Stylizes a batch's jobs concurrently, at most BATCH_MAX_PARALLEL_PREDICTIONS at a time."""
+    semaphore = asyncio.Semaphore(BATCH_MAX_PARALLEL_PREDICTIONS)
+
+    async def finish(job_id: str, edge_map_path: Path, stylized_key: Optional[str]):
+        async with semaphore:
+            await finish_job(job_id, edge_map_path, prompt, stylized_key, model_id)
+
+    results = await asyncio.gather(*(finish(*prepared) for prepared in prepared_jobs), return_exceptions=True)
+    for (job_id, _, _), result in zip(prepared_jobs, results):
+        if isinstance(result, Exception):
+            print(f"Error in batch {batch_id}, job {job_id}: {result}")
+            if await JOBS.transition(job_id, "failed", from_statuses=ACTIVE_STATUSES, error_message=str(result)):
+                JOB_FAILURES.inc(stage="stylize")
+            LAYERS.drop(job_id)
+
+async def _get_batch(batch_id: str) -> dict:
+    batch_info = await JOBS.get(batch_id)
+    if not batch_info or batch_info.get("kind") != "batch":
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch_info
+
+def _batch_status(statuses: list[str]) -> str:
+    if any(status in ACTIVE_STATUSES for status in statuses):
+        return "processing"
+    completed = statuses.count("complete")
+    if completed == len(statuses):
+        return "complete"
+    if not completed and EXPIRED_STATUS in statuses:
+        return EXPIRED_STATUS
+    return "partial" if completed else "failed"
+
+@app.post("/batch/stylize", response_model=BatchInitiateResponse)
+@limiter.limit("10/minute")
+async def create_batch_job(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    files: Optional[list[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),  # A ZIP of images, instead of or next to `files`
+    prompt: Optional[str] = Form("pencil sketch"),
+    model: Optional[str] = Form(None),
+    output: Optional[str] = Form(None),  # As for /stylize
+    svg: bool = Form(False)
+):
+    model_id = _resolve_request_model(model)
+    output = _resolve_request_output(output)
+    images: list[tuple[str, bytes]] = []
+    for file in files or []:
+        contents, _ = await read_upload_limited(file, MAX_FILE_SIZE_BYTES, ALLOWED_CONTENT_TYPES)
+        images.append((file.filename, contents))
+    if archive is not None:
+        data, _ = await read_upload_limited(archive, BATCH_MAX_UPLOAD_BYTES, {ZIP_CONTENT_TYPE})
+        images += await asyncio.to_thread(
+            extract_zip_images, data, MAX_FILE_SIZE_BYTES, BATCH_MAX_IMAGES, ALLOWED_CONTENT_TYPES
+        )
+    if not images:
+        raise HTTPException(status_code=400, detail="No images uploaded.")
+    if len(images) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"Too many images: at most {BATCH_MAX_IMAGES} per batch.")
+    # Bulk work queues behind interactive uploads and is the first to be shed
+    client_id, priority = _request_client(request, default_tier="low")
+    if output != EDGES_OUTPUT:
+        SCHEDULER.admit(priority, count=len(images))
+
+    batch_id = str(uuid.uuid4())
+    job_ids = [str(uuid.uuid4()) for _ in images]
+    final_prompt = prompt if prompt else "a beautiful sketch"
+
+    # Canny for all images at once, but never more than the pool has workers, so a batch
+    # does not push its own uploads (or anyone else's) into ExecutorSaturated
+    semaphore = asyncio.Semaphore(max(1, CPU_EXECUTOR.max_workers))
+
+    async def prepare(job_id: str, filename: str, contents: bytes):
+        async with semaphore:
+            return await prepare_job(contents, filename, final_prompt, model_id, job_id=job_id, batch_id=batch_id,
+                                     output=output, svg=svg, client_id=client_id, priority=priority)
+
+    results = await asyncio.gather(
+        *(prepare(job_id, filename, contents) for job_id, (filename, contents) in zip(job_ids, images)),
+        return_exceptions=True,
     )
+    if any(isinstance(result, ExecutorSaturated) for result in results):
+        # All or nothing: drop what was prepared and answer 503 so the client retries the whole batch
+        for job_id in job_ids:
+            await _discard_job(job_id)
+        raise next(result for result in results if isinstance(result, ExecutorSaturated))
+
+    prepared_jobs, responses = [], []
+    for job_id, result in zip(job_ids, results):
+        if isinstance(result, HTTPException):
+            # Preprocessing failed for this image; the job is marked failed, the rest go on
+            responses.append(StylizeInitiateResponse(job_id=job_id, edge_path="", status="failed"))
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        _, edge_map_path, stylized_key = result
+        prepared_jobs.append(result)
+        responses.append(StylizeInitiateResponse(
+            job_id=job_id,
+            edge_path=_relative_path(edge_map_path),
+            status="complete" if stylized_key is None else "processing_canny",
+            edge_previews=_edge_previews(await JOBS.get(job_id)),
+        ))
+
+    await JOBS.create(batch_id, "batch", kind="batch", job_ids=job_ids, prompt=final_prompt)
+    background_tasks.add_task(process_batch_in_background, batch_id, prepared_jobs, final_prompt, model_id)
+    return BatchInitiateResponse(batch_id=batch_id, jobs=responses)
+
+@app.get("/batch/{batch_id}", response_model=BatchStatusResponse)
+async def get_batch_status(batch_id: str):
+    batch_info = await _get_batch(batch_id)
+    jobs = [_job_status_response(job_id, await JOBS.get(job_id)) for job_id in batch_info["job_ids"]]
+    statuses = [job.status for job in jobs]
+    return BatchStatusResponse(
+        batch_id=batch_id,
+        status=_batch_status(statuses),
+        total=len(jobs),
+        counts={status: statuses.count(status) for status in dict.fromkeys(statuses)},
+        progress=round(sum(STATUS_PROGRESS.get(status, 0.0) for status in statuses) / len(jobs), 3),
+        jobs=jobs,
+    )
+
+@app.get("/batch/{batch_id}/download")
+async def download_batch_results(batch_id: str):
+    batch_info = await _get_batch(batch_id)
+    job_infos = [await JOBS.get(job_id) for job_id in batch_info["job_ids"]]
+    status = _batch_status([info["status"] if info else "failed" for info in job_infos])
+    if status == "processing":
+        raise HTTPException(status_code=400, detail="Batch not yet complete. Status: processing")
+
+    # One folder per image, numbered in upload order; failed images are left out
+    files_to_bundle = {}
+    for index, job_info in enumerate(job_infos, start=1):
+        if not job_info or job_info["status"] != "complete":
+            continue
+        if not _artifacts_ready(job_info):
+            if await build_job_artifacts(job_info["job_id"]) is None:
+                continue
+            job_info = await JOBS.get(job_info["job_id"])
+        folder = f"{index:02d}_{Path(job_info['original_filename']).stem}"
+        files_to_bundle.update({f"{folder}/{name}": path for name, path in _bundle_files(job_info).items()})
+
+    if not files_to_bundle:
+        raise HTTPException(status_code=400, detail=f"No completed images to download. Status: {status}")
+
+    return StreamingResponse(
+        composer.stream_zip_bundle(batch_id, files_to_bundle),
+        media_type='application/zip',
+        headers={"Content-Disposition": f'attachment; filename="sketchsplit_batch_{batch_id}.zip"'},
+    )
+
+# Edge map thumbnails: named after the edge map's content (see prepare_job), so they never change
+EDGE_PREVIEW_NAME = re.compile(r"edge_\d+px_[0-9a-f]{16}\.webp")
+
+class JobFiles(StaticFiles):
+    """Job files; thumbnails may be cached for a year, the rest are revalidated (ETag/Last-Modified)."""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if EDGE_PREVIEW_NAME.fullmatch(Path(full_path).name):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
 
 # Add a static route to serve processed images for optimistic UI
 if not Path(TEMP_IMAGE_DIR).is_absolute():  # Ensure it's discoverable
-    app.mount(f"/{TEMP_IMAGE_DIR.name}", StaticFiles(directory=TEMP_IMAGE_DIR), name="temp_images_static")
+    app.mount(f"/{TEMP_IMAGE_DIR.name}", JobFiles(directory=TEMP_IMAGE_DIR, check_dir=False), name="temp_images_static")
 else:
     print(f"Warning: TEMP_IMAGE_DIR {TEMP_IMAGE_DIR} is absolute. Static file serving needs review.")
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""
+Atomic file writes, used by every writer of files that are served or shared: job layers,
+previews, cache entries and output downloads.
+"""
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+def temp_path(path: Union[str, Path]) -> Path:
+    """
+    A fresh, hidden name next to `path` for writing it. Unique per call, so concurrent
+    writers (another request, another worker) never share one, and a write never goes
+    through an existing file that may be hard-linked elsewhere (see cache.place_file).
+    The real suffix stays last: Pillow and ffmpeg pick the format from it.
+    """
+    path = Path(path)
+    return path.with_name(f".tmp_{uuid.uuid4().hex}_{path.name}")
+
+@contextmanager
+def atomic_path(path: Union[str, Path]) -> Iterator[Path]:
+    """
+    Yields a temp path to write `path` to; on a clean exit it is renamed over `path`,
+    so readers (the static mount, a ZIP being streamed) never see a partial file.
+    On any error the temp file is removed and `path` is left as it was.
+    """
+    path = Path(path)
+    tmp = temp_path(path)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+def write_atomically(path: Union[str, Path], data: bytes) -> Path:
+    """Writes `data` to `path` through atomic_path. Returns the path."""
+    path = Path(path)
+    with atomic_path(path) as tmp:
+        tmp.write_bytes(data)
+    return path
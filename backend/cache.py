@@ -0,0 +1,139 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from .atomic import atomic_path
+
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GiB
+
+def edge_cache_key(image_bytes: bytes, low_threshold: int, high_threshold: int, blur_ksize: int,
+                   mode: str = "full", target_size: Optional[int] = None, control_filter: str = "canny") -> str:
+    """
+    Key for an edge map: the uploaded bytes plus every Canny parameter, the preprocessing
+    mode and the control filter that produced it.
+    """
+    h = hashlib.sha256(image_bytes)
+    h.update(f"|canny:{low_threshold}:{high_threshold}:blur:{blur_ksize}".encode())
+    if mode != "full":
+        # Full-mode keys stay as they were, so existing cache entries remain valid
+        h.update(f"|mode:{mode}:{target_size if mode == 'reduced' else ''}".encode())
+    if control_filter != "canny":
+        h.update(f"|filter:{control_filter}".encode())
+    return h.hexdigest()
+
+def stylized_cache_key(edge_key: str, model_id: str, prompt: str) -> str:
+    """Key for a stylized image: the edge map it came from, the model and the prompt."""
+    return hashlib.sha256(f"{edge_key}|model:{model_id}|prompt:{prompt}".encode()).hexdigest()
+
+def place_file(src: Path, dest: Path) -> Path:
+    """Hard-links src to dest (falls back to a copy), replacing dest if it exists."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_path(dest) as tmp:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+    return dest
+
+class ResultCache:
+    """
+    Content-addressed disk cache for edge maps and stylized images.
+
+    Entries are files named `<kind>_<key><suffix>` under `cache_dir`. The total size is
+    kept under `max_bytes` by evicting least recently used entries (recency is the file
+    mtime, refreshed on every hit, so the order survives restarts). Workers sharing the
+    directory each keep their own index; a file another worker evicted is just a miss.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        self._entries: OrderedDict[str, int] = OrderedDict()  # file name -> size, oldest first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _load(self):
+        # Index existing entries lazily, oldest first
+        if self._loaded:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        files = [p for p in self.cache_dir.iterdir() if p.is_file() and not p.name.startswith(".")]
+        for path in sorted(files, key=lambda p: p.stat().st_mtime):
+            size = path.stat().st_size
+            self._entries[path.name] = size
+            self._total_bytes += size
+        self._loaded = True
+
+    def _record(self, counter: dict, kind: str):
+        counter[kind] = counter.get(kind, 0) + 1
+
+    def get(self, kind: str, key: str, suffix: str = ".png") -> Optional[Path]:
+        """Returns the cached file for (kind, key), or None. Counts a hit or a miss."""
+        if not self.enabled:
+            return None
+        name = f"{kind}_{key}{suffix}"
+        path = self.cache_dir / name
+        with self._lock:
+            self._load()
+            if name in self._entries and path.exists():
+                os.utime(path)
+                self._entries.move_to_end(name)
+                self._record(self.hits, kind)
+                return path
+            if name in self._entries:
+                # Evicted by another worker
+                self._total_bytes -= self._entries.pop(name)
+            self._record(self.misses, kind)
+            return None
+
+    def put(self, kind: str, key: str, src_path: Path, suffix: str = ".png") -> Optional[Path]:
+        """Stores a copy (or hard link) of src_path, then evicts down to max_bytes."""
+        if not self.enabled:
+            return None
+        name = f"{kind}_{key}{suffix}"
+        path = self.cache_dir / name
+        with self._lock:
+            self._load()
+            place_file(Path(src_path), path)
+            size = path.stat().st_size
+            self._total_bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict()
+        return path
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                (self.cache_dir / name).unlink()
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+            }
+
+def create_result_cache() -> ResultCache:
+    """Builds the cache from RESULT_CACHE_DIR and RESULT_CACHE_MAX_BYTES (0 disables it)."""
+    return ResultCache(
+        Path(os.getenv("RESULT_CACHE_DIR", "result_cache")),
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+    )
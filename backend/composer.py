@@ -1,52 +1,183 @@
 from PIL import Image, ImageDraw, ImageFont
-import imageio
+import numpy as np
 from pathlib import Path
+from typing import BinaryIO, Optional
 import zipfile
+import io
 import json
 import os
+import shutil
+import subprocess
+import time
+
+from .atomic import atomic_path
+from .metrics import timed, timed_iter
+from .options import PREVIEW_FORMATS  # noqa: F401  (re-exported; the API checks PREVIEW_FORMAT without PIL)
 
 TEMP_STORAGE_BASE = Path("temp_images") # Should match app.py
 
-def ensure_rgba_and_transparent_background(image_path: Path, primary_color=(0,0,0), background_color_value=255) -> Image.Image:
-    """Converts image (e.g. Canny edge map) to RGBA with transparent background."""
-    img = Image.open(image_path).convert("L") # Grayscale
-    rgba_img = Image.new("RGBA", img.size)
-    
-    pixels = img.load()
-    rgba_pixels = rgba_img.load()
+def ensure_rgba_and_transparent_background(
+    image_path,
+    primary_color=(0, 0, 0),
+    background_color_value=255,
+    threshold: int = 0,
+    antialias: bool = False,
+) -> Image.Image:
+    """
+    Converts image (e.g. Canny edge map) to RGBA with transparent background.
+
+    Built in one NumPy pass instead of walking pixels. A pixel counts as background
+    when it is within `threshold` of `background_color_value`; everything else is drawn
+    in `primary_color`. With `antialias`, alpha ramps with the distance from the
+    background instead of being all-or-nothing, which keeps soft/blurred lines smooth.
+    `image_path` may also be an already loaded PIL image.
+    """
+    img = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+    gray = np.asarray(img.convert("L"))  # Grayscale, uint8
+
+    # |pixel - background| without leaving uint8
+    distance = np.maximum(gray, background_color_value) - np.minimum(gray, background_color_value)
 
-    for y in range(img.height):
-        for x in range(img.width):
-            if pixels[x, y] == background_color_value: # e.g., white for Canny
-                rgba_pixels[x, y] = (0, 0, 0, 0)  # Transparent
-            else: # Lines or other features
-                rgba_pixels[x, y] = primary_color + (255,) # Opaque primary color (e.g., black)
-    return rgba_img
+    if antialias:
+        max_distance = max(background_color_value, 255 - background_color_value)
+        span = max(max_distance - threshold, 1)
+        ramp = (distance.astype(np.float32) - threshold) * (255.0 / span)
+        alpha = np.clip(ramp, 0, 255).astype(np.uint8)
+    else:
+        alpha = np.where(distance > threshold, np.uint8(255), np.uint8(0))
+
+    # Assemble per band; fully transparent pixels stay (0, 0, 0, 0)
+    visible = alpha > 0
+    color_bands = [
+        Image.new("L", (gray.shape[1], gray.shape[0]), 0) if channel == 0
+        else Image.fromarray(np.where(visible, np.uint8(channel), np.uint8(0)), "L")
+        for channel in primary_color[:3]
+    ]
+    return Image.merge("RGBA", color_bands + [Image.fromarray(alpha, "L")])
+
+@timed("merge")
+def compose_layers(stylized_img: Image.Image, edge_map, soft_edges: bool = False) -> Image.Image:
+    """
+    Draws the Canny edge map (path or PIL image) in black over the stylized image,
+    scaled to the stylized image's size. Returns the RGBA composite.
+    With `soft_edges` (grayscale control maps such as Sobel), line strength becomes opacity.
+    """
+    stylized_img = stylized_img.convert("RGBA")
+
+    # Make Canny edge map (overlay) have transparent background and black lines.
+    # Canny draws white (255) edges on black (0), so black is the background here.
+    edge_map_rgba = ensure_rgba_and_transparent_background(
+        edge_map, primary_color=(0,0,0), background_color_value=0, antialias=soft_edges
+    )
+    # Replicate usually returns a smaller image than the full-resolution edge map
+    if edge_map_rgba.size != stylized_img.size:
+        edge_map_rgba = edge_map_rgba.resize(stylized_img.size, Image.BILINEAR)
+
+    # Composite: overlay edge map on top of stylized image
+    return Image.alpha_composite(stylized_img, edge_map_rgba)
 
 def merge_layers(base_image_path: Path, overlay_image_path: Path, output_path: Path):
     """
     Merges two images. Assumes base_image_path is the stylized image from Replicate
     and overlay_image_path is the Canny edge map (which will be made transparent).
     """
-    stylized_img = Image.open(base_image_path).convert("RGBA")
-    
-    # Make Canny edge map (overlay) have transparent background and black lines
-    edge_map_rgba = ensure_rgba_and_transparent_background(overlay_image_path, primary_color=(0,0,0))
-
-    # Composite: overlay edge map on top of stylized image
-    composite_img = Image.alpha_composite(stylized_img, edge_map_rgba)
+    composite_img = compose_layers(Image.open(base_image_path), overlay_image_path)
     composite_img.save(output_path)
     return output_path
 
+# Previews are for a quick look: frames are scaled down to this many pixels on the longer side
+PREVIEW_MAX_SIDE = 768
+
+def _to_image(frame) -> Image.Image:
+    return Image.fromarray(frame) if isinstance(frame, np.ndarray) else frame
+
+def normalize_frames(frames: list, max_side: Optional[int] = PREVIEW_MAX_SIDE, even: bool = False) -> list[Image.Image]:
+    """
+    Brings preview frames (PIL images or NumPy arrays, any mode and size) to one RGB size:
+    the largest frame's, scaled down to `max_side`. Frames are resized before the mode
+    conversion, so full-resolution layers are never converted at full size. Transparent
+    areas become white. `even` rounds the size down to even numbers (yuv420p video).
+    """
+    images = [_to_image(frame) for frame in frames]
+    width, height = max((image.size for image in images), key=lambda size: size[0] * size[1])
+    scale = min(1.0, max_side / max(width, height)) if max_side else 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if even:
+        size = (max(2, size[0] - size[0] % 2), max(2, size[1] - size[1] % 2))
+
+    normalized = []
+    for image in images:
+        if image.mode not in ("1", "L", "LA", "RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode == "P" and "transparency" in image.info else "RGB")
+        if image.size != size:
+            # reducing_gap: shrink by whole factors first, then filter; much faster on big layers
+            image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        if image.mode in ("LA", "RGBA"):
+            background = Image.new("RGBA", size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image.convert("RGBA"))
+        normalized.append(image.convert("RGB"))
+    return normalized
+
+def _shared_palette(frames: list[Image.Image], colors: int = 256) -> Image.Image:
+    """One palette for all frames, quantized from a strip of small copies of every frame."""
+    thumbs = []
+    for frame in frames:
+        thumb = frame.copy()
+        thumb.thumbnail((256, 256))
+        thumbs.append(thumb)
+    strip = Image.new("RGB", (max(t.width for t in thumbs), sum(t.height for t in thumbs)))
+    y = 0
+    for thumb in thumbs:
+        strip.paste(thumb, (0, y))
+        y += thumb.height
+    return strip.quantize(colors, method=Image.Quantize.MEDIANCUT)
+
+def build_preview(frames: list, output_path: Path, format: Optional[str] = None, duration_ms: int = 400,
+                  max_side: Optional[int] = PREVIEW_MAX_SIDE) -> Optional[Path]:
+    """
+    Builds an animated preview from in-memory frames (PIL images or NumPy arrays).
+
+    Frames are normalized once (normalize_frames). GIFs use a single palette shared by
+    all frames instead of one per frame; WebP is lossy and animated; MP4 is encoded by
+    ffmpeg from frames piped over stdin. `format` defaults to the output's suffix.
+    Returns the output path, or None if an MP4 could not be made (no ffmpeg).
+    """
+    output_path = Path(output_path)
+    format = (format or output_path.suffix.lstrip(".")).lower()
+    if format not in PREVIEW_FORMATS:
+        raise ValueError(f"Unsupported preview format: {format}. Use one of {', '.join(PREVIEW_FORMATS)}.")
+    if not frames:
+        raise ValueError("No frames for preview.")
+
+    with timed(format):  # Stage per format: gif, webp, mp4
+        return _encode_preview(frames, output_path, format, duration_ms, max_side)
+
+def _encode_preview(frames: list, output_path: Path, format: str, duration_ms: int,
+                    max_side: Optional[int]) -> Optional[Path]:
+    normalized = normalize_frames(frames, max_side, even=format == "mp4")
+    if format == "mp4":
+        return create_mp4_preview(None, output_path, fps=1000 / duration_ms, frames=normalized)
+
+    if format == "gif":
+        palette = _shared_palette(normalized)
+        normalized = [frame.quantize(palette=palette, dither=Image.Dither.NONE) for frame in normalized]
+        # Passing the palette makes it the global color table; frames then carry no local ones
+        save_options = {"optimize": False, "palette": palette.getpalette()}
+    else:
+        save_options = {"quality": 80, "method": 4}
+    normalized[0].save(
+        output_path, format=format.upper(), save_all=True, append_images=normalized[1:],
+        duration=duration_ms, loop=0, **save_options,  # loop=0 for infinite loop
+    )
+    return output_path
+
 def create_gif_preview(layer_paths: list[Path], output_gif_path: Path, duration_ms: int = 400):
     """Creates a GIF from a list of layer image paths."""
-    # Ensure imageio-ffmpeg is available if not using standard GIF features or for better compatibility
-    # pip install imageio[ffmpeg] or imageio-ffmpeg
     frames = []
     for p_str in layer_paths:
         p = Path(p_str) # Ensure it's a Path object
         if p.exists():
-            frames.append(imageio.v3.imread(p)) # imageio.v3.imread is preferred
+            frames.append(Image.open(p))
         else:
             print(f"Warning: Frame not found at {p} for GIF creation.")
     
@@ -61,61 +192,192 @@ def create_gif_preview(layer_paths: list[Path], output_gif_path: Path, duration_
         except IOError:
             font = ImageFont.load_default()
         draw.text((10,10), "No Frames", font=font, fill="red")
-        frames.append(imageio.v3.imread(dummy_frame))
+        frames.append(dummy_frame)
+
+    return build_preview(frames, output_gif_path, format="gif", duration_ms=duration_ms)
+
+# Formats that are already compressed gain nothing from DEFLATE, only CPU time
+STORED_SUFFIXES = {".png", ".gif", ".jpg", ".jpeg", ".webp", ".mp4", ".zip"}
+ZIP_STREAM_CHUNK_SIZE = 256 * 1024
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Write-only sink for ZipFile that hands out what was written so far. Not seekable,
+    so zipfile writes data descriptors instead of seeking back to patch headers."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._offset += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._offset
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_zip_bundle(job_id: str, files_to_zip: dict[str, Path], chunk_size: int = ZIP_STREAM_CHUNK_SIZE):
+    """
+    Yields a ZIP archive of the given layers and previews chunk by chunk, without
+    building it on disk or in memory. PNG/GIF/WebP/MP4 entries are STORED (they are
+    already compressed); text such as steps.json is DEFLATED.
+    files_to_zip is a dictionary like {"edges.png": Path(...), "stylized.png": Path(...), "preview.gif": Path(...)}
+    Every file is opened before this returns: a storage sweep (in any worker) may
+    delete the job's files while the archive streams, and open files stay readable.
+    The "zip" stage time excludes time spent waiting on the consumer.
+    """
+    sources = {}
+    for arcname, file_path in files_to_zip.items():
+        try:
+            sources[arcname] = (Path(file_path), open(file_path, "rb"))
+        except FileNotFoundError:
+            print(f"Warning: File {file_path} not found for zipping. Skipping.")
+    return timed_iter("zip", _zip_chunks(job_id, sources, list(files_to_zip), chunk_size))
 
+def _zip_chunks(job_id: str, sources: dict[str, tuple[Path, BinaryIO]], files_included: list[str], chunk_size: int):
+    sink = _ZipStreamBuffer()
+    try:
+        with zipfile.ZipFile(sink, 'w') as zf:
+            for arcname, (file_path, src) in sources.items():
+                # From the open file, not the path: the path may be gone by now
+                st = os.fstat(src.fileno())
+                zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+                zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+                zinfo.file_size = st.st_size
+                zinfo.compress_type = zipfile.ZIP_STORED if file_path.suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+                with zf.open(zinfo, "w") as dest:
+                    while chunk := src.read(chunk_size):
+                        dest.write(chunk)
+                        yield sink.drain()
 
-    imageio.v3.mimsave(output_gif_path, frames, duration=duration_ms, loop=0) # loop=0 for infinite loop
-    return output_gif_path
+            # Add steps.json
+            steps_data = {
+                "job_id": job_id,
+                "message": "SketchSplit layers and preview.",
+                "files_included": files_included
+            }
+            zf.writestr("steps.json", json.dumps(steps_data, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+        # Closing the archive writes the central directory
+        yield sink.drain()
+    finally:
+        for _, src in sources.values():
+            src.close()
 
 def create_zip_bundle(job_id: str, files_to_zip: dict[str, Path], output_zip_path: Path) -> Path:
     """
     Creates a ZIP file containing specified layers and previews.
     files_to_zip is a dictionary like {"edges.png": Path(...), "stylized.png": Path(...), "preview.gif": Path(...)}
+    Same archive as stream_zip_bundle, written to disk.
     """
-    with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for arcname, file_path in files_to_zip.items():
-            if file_path.exists():
-                zf.write(file_path, arcname=arcname)
-            else:
-                print(f"Warning: File {file_path} not found for zipping. Skipping.")
-        
-        # Add steps.json
-        steps_data = {
-            "job_id": job_id,
-            "message": "SketchSplit layers and preview.",
-            "files_included": list(files_to_zip.keys())
-        }
-        zf.writestr("steps.json", json.dumps(steps_data, indent=2))
-        
+    with open(output_zip_path, "wb") as f:
+        for chunk in stream_zip_bundle(job_id, files_to_zip):
+            f.write(chunk)
     return output_zip_path
 
+def _ffmpeg_executable() -> str:
+    """ffmpeg from PATH, else the binary bundled with imageio-ffmpeg (if installed)."""
+    if shutil.which("ffmpeg"):
+        return "ffmpeg"
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"  # Fails below with the usual "not found" message
+
 # Optional MP4 generation (2.5.3)
-def create_mp4_preview(frame_pattern: str, output_mp4_path: Path, fps: int = 5):
+def create_mp4_preview(frame_pattern: Optional[str], output_mp4_path: Path, fps: float = 5, frames: Optional[list] = None):
     """
     Creates an MP4 from frames using ffmpeg.
     frame_pattern: e.g., "temp_images/job_xyz_frame-%d.png"
-    Requires ffmpeg to be installed and in PATH.
+    frames: alternatively, in-memory frames (see normalize_frames; same size, even
+        dimensions), piped to ffmpeg as raw RGB over stdin so no frame files are written.
+    Requires ffmpeg in PATH or the imageio-ffmpeg package.
     """
     # This is a system call. Ensure security if paths/args are from user input.
     # For controlled frame_pattern, it's safer.
+    if frames is not None:
+        frames = [_to_image(frame).convert("RGB") for frame in frames]
+        width, height = frames[0].size
+        source = ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-"]
+        stdin_data = b"".join(frame.tobytes() for frame in frames)
+    else:
+        source = ["-r", str(fps), "-i", frame_pattern]
+        stdin_data = None
     command = [
-        "ffmpeg",
+        _ffmpeg_executable(),
         "-y", # Overwrite output files without asking
-        "-r", str(fps),
-        "-i", frame_pattern,
+        *source,
         "-c:v", "libx264",
         "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",  # Index up front so it plays while downloading
         str(output_mp4_path)
     ]
     try:
-        import subprocess
-        process = subprocess.run(command, check=True, capture_output=True, text=True)
-        print("FFmpeg output:", process.stdout)
+        process = subprocess.run(command, check=True, capture_output=True, input=stdin_data)
+        print("FFmpeg output:", process.stdout.decode(errors="replace"))
         return output_mp4_path
     except FileNotFoundError:
         print("Error: ffmpeg command not found. Please ensure ffmpeg is installed and in your PATH.")
         return None
     except subprocess.CalledProcessError as e:
         print("Error during ffmpeg execution:")
-        print("FFmpeg stderr:", e.stderr)
-        return None
\ No newline at end of file
+        print("FFmpeg stderr:", e.stderr.decode(errors="replace"))
+        return None
+
+def _open_layer(layer) -> Image.Image:
+    """Decodes a layer given as encoded bytes (see layers.LayerStore) or as a path."""
+    image = Image.open(io.BytesIO(layer) if isinstance(layer, (bytes, bytearray)) else layer)
+    image.load()
+    return image
+
+def build_download_artifacts(job_id: str, edge_map_path, stylized_image_path,
+                             output_dir: Path, stem: str, preview_format: str = "gif",
+                             soft_edges: bool = False) -> dict:
+    """
+    Builds the layers /download bundles (composite PNG, animated preview) in one go. The
+    ZIP itself is streamed per request by stream_zip_bundle.
+
+    The edge map and stylized image may be paths or their encoded bytes (already in
+    memory). Each layer is decoded once and the preview is built from those images.
+    Idempotent: artifacts already on disk are kept, and each file is written to a temp
+    name and renamed, so a rerun (or a concurrent run) never serves a half-written file.
+    Returns the artifact paths as strings; the preview is optional and None if it failed.
+    `soft_edges` is passed on to compose_layers.
+    """
+    output_dir = Path(output_dir)
+    composite_path = output_dir / f"composite_{stem}.png"
+    preview_path = output_dir / f"preview_{stem}.{preview_format}"
+
+    composite_img = None
+    if not composite_path.exists() or not preview_path.exists():
+        edge_img = _open_layer(edge_map_path)
+        stylized_img = _open_layer(stylized_image_path)
+
+    if not composite_path.exists():
+        composite_img = compose_layers(stylized_img, edge_img, soft_edges)
+        with atomic_path(composite_path) as tmp:
+            composite_img.save(tmp, format="PNG")
+
+    if not preview_path.exists():
+        if composite_img is None:
+            composite_img = Image.open(composite_path)
+        frames = [edge_img, stylized_img, composite_img]
+        try:
+            with atomic_path(preview_path) as tmp:
+                build_preview(frames, tmp, format=preview_format)
+        except Exception as e:
+            # Preview is optional for download
+            print(f"Error creating {preview_format} preview for job {job_id}: {e}")
+
+    return {
+        "composite_image_path": str(composite_path),
+        "preview_path": str(preview_path) if preview_path.exists() else None,
+    }
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from typing import Optional
+
+# Only the latest status matters to a client, so a slow subscriber keeps the newest few events
+DEFAULT_SUBSCRIBER_QUEUE = 16
+
+class Subscription:
+    """One subscriber's queue of events for a job, bound to the event loop it was created on."""
+
+    def __init__(self, job_id: str, max_queue: int = DEFAULT_SUBSCRIBER_QUEUE):
+        self.job_id = job_id
+        self.dropped = 0
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+
+    def _put(self, event: dict):
+        if self._queue.full():
+            # Drop the oldest event rather than block the publisher
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+
+    def deliver(self, event: dict):
+        """Queues an event; safe to call from any thread."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._put(event)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._put, event)
+
+    async def get(self, timeout: Optional[float] = None) -> dict:
+        """Next event; raises TimeoutError if none arrives within `timeout` seconds."""
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+class JobEventBroker:
+    """
+    In-process pub/sub for job updates: any number of subscribers per job, each with
+    its own bounded queue. Publishing never blocks and works from any thread.
+
+    Only updates made by this process are seen; subscribers that need updates from
+    other workers should also re-read the job store now and then.
+    """
+
+    def __init__(self, max_queue: int = DEFAULT_SUBSCRIBER_QUEUE):
+        self.max_queue = max_queue
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, job_id: str) -> Subscription:
+        """Must be called from the event loop that will consume the events."""
+        subscription = Subscription(job_id, self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.job_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.job_id]
+
+    def has_subscribers(self, job_id: str) -> bool:
+        return job_id in self._subscribers
+
+    def subscriber_count(self, job_id: Optional[str] = None) -> int:
+        with self._lock:
+            if job_id is not None:
+                return len(self._subscribers.get(job_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, job_id: str, event: dict) -> int:
+        """Fans `event` out to the job's subscribers. Returns how many there were."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(job_id, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return len(subscribers)
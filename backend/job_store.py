@@ -0,0 +1,347 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+# Job records live for a day after their last update unless configured otherwise
+DEFAULT_JOB_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_JOB_STORE_URL = "sqlite:///sketchsplit_jobs.db"
+
+# Keys managed by the store itself; callers cannot overwrite them through update()
+_RESERVED_KEYS = {"job_id", "status", "created_at", "updated_at", "expires_at"}
+
+def _encode(fields: dict) -> str:
+    # Paths and other simple objects are stored as strings so both backends agree
+    return json.dumps(fields, default=str)
+
+class JobStore:
+    """
+    Interface for job state shared between routes and background tasks.
+
+    Records are plain dicts with `job_id`, `status`, `created_at`, `updated_at`,
+    `expires_at` plus any JSON-serializable fields. Every write pushes `expires_at`
+    out by the store's TTL; expired records are invisible to reads and removed by
+    `purge_expired()`.
+
+    Listeners added with `add_listener` are called as `listener(job_id, record)` after
+    every create, update/transition and delete made through this instance (record is
+    None on delete). They run on the writer's thread, outside any store lock.
+
+    `blocking` stores do I/O that can wait (on disk, on another process's lock); async
+    code reaches them through AsyncJobStore so the wait happens off the event loop.
+    """
+    blocking = False
+
+    def __init__(self, ttl_seconds: float = DEFAULT_JOB_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, job_id: str, record: Optional[dict]):
+        for listener in list(self._listeners):
+            try:
+                listener(job_id, record)
+            except Exception as e:
+                # A broken listener must not turn a committed write into an error
+                print(f"Job store listener failed for job {job_id}: {e}")
+
+    def create(self, job_id: str, status: str, **fields) -> dict:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields) -> bool:
+        """Merges fields into the record. Returns False if the job does not exist."""
+        raise NotImplementedError
+
+    def transition(self, job_id: str, to_status: Optional[str], from_statuses: Optional[Iterable[str]] = None, **fields) -> bool:
+        """
+        Atomically moves a job to `to_status` (None keeps the current status) and merges
+        `fields`, but only if its current status is one of `from_statuses` (any status
+        when None).
+        Returns True if the transition happened.
+        """
+        raise NotImplementedError
+
+    def find_by_status(self, status: str) -> list[dict]:
+        raise NotImplementedError
+
+    def delete(self, job_id: str) -> bool:
+        raise NotImplementedError
+
+    def purge_expired(self, now: Optional[float] = None) -> list[str]:
+        """Deletes expired records and returns their job ids."""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _check_fields(self, fields: dict):
+        reserved = _RESERVED_KEYS.intersection(fields)
+        if reserved:
+            raise ValueError(f"Reserved job fields cannot be set directly: {', '.join(sorted(reserved))}")
+
+class InMemoryJobStore(JobStore):
+    """Process-local store. Fine for tests and single-worker development."""
+
+    def __init__(self, ttl_seconds: float = DEFAULT_JOB_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self._jobs: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, job_id: str, now: float) -> Optional[dict]:
+        record = self._jobs.get(job_id)
+        if record is None or record["expires_at"] <= now:
+            return None
+        return record
+
+    def create(self, job_id: str, status: str, **fields) -> dict:
+        self._check_fields(fields)
+        now = time.time()
+        record = json.loads(_encode(fields))
+        record.update(job_id=job_id, status=status, created_at=now, updated_at=now, expires_at=now + self.ttl_seconds)
+        with self._lock:
+            if self._live(job_id, now) is not None:
+                raise KeyError(f"Job {job_id} already exists")
+            self._jobs[job_id] = record
+        if self._listeners:
+            self._notify(job_id, dict(record))
+        return dict(record)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            record = self._live(job_id, time.time())
+            return dict(record) if record is not None else None
+
+    def update(self, job_id: str, **fields) -> bool:
+        return self.transition(job_id, None, None, **fields)
+
+    def transition(self, job_id: str, to_status: Optional[str], from_statuses: Optional[Iterable[str]] = None, **fields) -> bool:
+        self._check_fields(fields)
+        allowed = set(from_statuses) if from_statuses is not None else None
+        now = time.time()
+        with self._lock:
+            record = self._live(job_id, now)
+            if record is None or (allowed is not None and record["status"] not in allowed):
+                return False
+            record.update(json.loads(_encode(fields)))
+            if to_status is not None:
+                record["status"] = to_status
+            record["updated_at"] = now
+            record["expires_at"] = now + self.ttl_seconds
+            snapshot = dict(record) if self._listeners else None
+        if snapshot is not None:
+            self._notify(job_id, snapshot)
+        return True
+
+    def find_by_status(self, status: str) -> list[dict]:
+        now = time.time()
+        with self._lock:
+            return [dict(r) for r in self._jobs.values() if r["status"] == status and r["expires_at"] > now]
+
+    def delete(self, job_id: str) -> bool:
+        with self._lock:
+            deleted = self._jobs.pop(job_id, None) is not None
+        if deleted and self._listeners:
+            self._notify(job_id, None)
+        return deleted
+
+    def purge_expired(self, now: Optional[float] = None) -> list[str]:
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = [job_id for job_id, r in self._jobs.items() if r["expires_at"] <= now]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return expired
+
+    def __len__(self) -> int:
+        now = time.time()
+        with self._lock:
+            return sum(1 for r in self._jobs.values() if r["expires_at"] > now)
+
+class SQLiteJobStore(JobStore):
+    """
+    SQLite-backed store in WAL mode, shared by every worker process on the host.
+
+    Each thread gets its own connection. Read-modify-write operations run inside
+    `BEGIN IMMEDIATE` so status transitions are atomic across processes. A write may
+    wait up to the busy timeout for another worker's, hence `blocking`.
+    """
+    blocking = True
+
+    def __init__(self, db_path: Path, ttl_seconds: float = DEFAULT_JOB_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+            CREATE INDEX IF NOT EXISTS idx_jobs_expires_at ON jobs(expires_at);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: autocommit, transactions are opened explicitly
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_record(row) -> dict:
+        job_id, status, data, created_at, updated_at, expires_at = row
+        record = json.loads(data)
+        record.update(job_id=job_id, status=status, created_at=created_at, updated_at=updated_at, expires_at=expires_at)
+        return record
+
+    def create(self, job_id: str, status: str, **fields) -> dict:
+        self._check_fields(fields)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # An expired record with the same id is dead; replace it
+            conn.execute("DELETE FROM jobs WHERE job_id = ? AND expires_at <= ?", (job_id, now))
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, data, created_at, updated_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, status, _encode(fields), now, now, now + self.ttl_seconds),
+            )
+            conn.execute("COMMIT")
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+            raise KeyError(f"Job {job_id} already exists")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        record = self.get(job_id)
+        if self._listeners:
+            self._notify(job_id, record)
+        return record
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT job_id, status, data, created_at, updated_at, expires_at FROM jobs WHERE job_id = ? AND expires_at > ?",
+            (job_id, time.time()),
+        ).fetchone()
+        return self._to_record(row) if row else None
+
+    def update(self, job_id: str, **fields) -> bool:
+        return self.transition(job_id, None, None, **fields)
+
+    def transition(self, job_id: str, to_status: Optional[str], from_statuses: Optional[Iterable[str]] = None, **fields) -> bool:
+        self._check_fields(fields)
+        allowed = set(from_statuses) if from_statuses is not None else None
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT status, data, created_at FROM jobs WHERE job_id = ? AND expires_at > ?", (job_id, now)
+            ).fetchone()
+            if row is None or (allowed is not None and row[0] not in allowed):
+                conn.execute("ROLLBACK")
+                return False
+            data = json.loads(row[1])
+            data.update(json.loads(_encode(fields)))
+            encoded = _encode(data)
+            conn.execute(
+                "UPDATE jobs SET status = ?, data = ?, updated_at = ?, expires_at = ? WHERE job_id = ?",
+                (to_status or row[0], encoded, now, now + self.ttl_seconds, job_id),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if self._listeners:
+            self._notify(job_id, self._to_record((job_id, to_status or row[0], encoded, row[2], now, now + self.ttl_seconds)))
+        return True
+
+    def find_by_status(self, status: str) -> list[dict]:
+        rows = self._conn().execute(
+            "SELECT job_id, status, data, created_at, updated_at, expires_at FROM jobs WHERE status = ? AND expires_at > ?",
+            (status, time.time()),
+        ).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def delete(self, job_id: str) -> bool:
+        deleted = self._conn().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,)).rowcount > 0
+        if deleted and self._listeners:
+            self._notify(job_id, None)
+        return deleted
+
+    def purge_expired(self, now: Optional[float] = None) -> list[str]:
+        now = time.time() if now is None else now
+        rows = self._conn().execute("DELETE FROM jobs WHERE expires_at <= ? RETURNING job_id", (now,)).fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+class AsyncJobStore:
+    """
+    The same store for async code: awaitable create/get/update/transition/delete. Calls
+    to a `blocking` store run in a thread, so a worker stuck behind another's write lock
+    does not stall every request on its event loop; the others are called in place.
+    """
+
+    def __init__(self, store: JobStore):
+        self.store = store
+
+    async def _call(self, fn, *args, **kwargs):
+        if self.store.blocking:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def create(self, job_id: str, status: str, **fields) -> dict:
+        return await self._call(self.store.create, job_id, status, **fields)
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self._call(self.store.get, job_id)
+
+    async def update(self, job_id: str, **fields) -> bool:
+        return await self._call(self.store.update, job_id, **fields)
+
+    async def transition(self, job_id: str, to_status: Optional[str], from_statuses: Optional[Iterable[str]] = None,
+                         **fields) -> bool:
+        return await self._call(self.store.transition, job_id, to_status, from_statuses, **fields)
+
+    async def delete(self, job_id: str) -> bool:
+        return await self._call(self.store.delete, job_id)
+
+def create_job_store(url: Optional[str] = None, ttl_seconds: Optional[float] = None) -> JobStore:
+    """
+    Builds a job store from a URL: "memory://" or "sqlite:///path/to/jobs.db".
+    Defaults come from JOB_STORE_URL and JOB_TTL_SECONDS.
+    """
+    url = url or os.getenv("JOB_STORE_URL", DEFAULT_JOB_STORE_URL)
+    ttl = ttl_seconds if ttl_seconds is not None else float(os.getenv("JOB_TTL_SECONDS", DEFAULT_JOB_TTL_SECONDS))
+
+    if url.startswith("memory://"):
+        return InMemoryJobStore(ttl_seconds=ttl)
+    if url.startswith("sqlite:///"):
+        return SQLiteJobStore(Path(url[len("sqlite:///"):]), ttl_seconds=ttl)
+    raise ValueError(f"Unsupported JOB_STORE_URL: {url}. Use memory:// or sqlite:///<path>.")
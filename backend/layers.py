@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+from .atomic import write_atomically
+
+DEFAULT_LAYER_MEMORY_BYTES = 256 * 1024 * 1024  # 256 MiB
+
+class LayerStore:
+    """
+    Job-scoped image layers kept in memory between pipeline stages.
+
+    A layer is an encoded image (PNG bytes) plus the path it is served from. `put`
+    writes the file once, since every layer is served (static mount, download bundle);
+    the in-memory copy only saves the next stage (Replicate upload, composer) from
+    reading it back. Copies are held until `drop(job_id)`, and the total is capped at
+    `max_bytes`: past that, the least recently added layers are spilled, i.e. dropped
+    from memory and read from their file instead. With `persist=False` a layer is only
+    written when it is spilled.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_LAYER_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self._layers: OrderedDict[tuple[str, str], tuple[bytes, Path]] = OrderedDict()
+        self._bytes = 0
+        self._spilled = 0
+        self._lock = threading.Lock()
+
+    def put(self, job_id: str, name: str, data: bytes, path: Path, persist: bool = True) -> Path:
+        path = Path(path)
+        data = bytes(data)
+        if persist:
+            _write_file(path, data)
+
+        spill = []
+        with self._lock:
+            self._discard((job_id, name))
+            if len(data) <= self.max_bytes:
+                self._layers[(job_id, name)] = (data, path)
+                self._bytes += len(data)
+            else:
+                spill.append((data, path))
+            while self._bytes > self.max_bytes:
+                _, (old_data, old_path) = self._layers.popitem(last=False)
+                self._bytes -= len(old_data)
+                spill.append((old_data, old_path))
+            self._spilled += len(spill)
+
+        for old_data, old_path in spill:
+            if not old_path.exists():
+                _write_file(old_path, old_data)
+        return path
+
+    def get(self, job_id: str, name: str) -> Optional[bytes]:
+        """The layer's bytes if still in memory, else None."""
+        with self._lock:
+            entry = self._layers.get((job_id, name))
+            return entry[0] if entry else None
+
+    def source(self, job_id: str, name: str, path: Union[str, Path]) -> Union[bytes, Path]:
+        """The layer's bytes if in memory, otherwise `path` to read it from."""
+        data = self.get(job_id, name)
+        return data if data is not None else Path(path)
+
+    def drop(self, job_id: str):
+        """Releases every in-memory layer of the job (files stay)."""
+        with self._lock:
+            for key in [key for key in self._layers if key[0] == job_id]:
+                self._discard(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"layers": len(self._layers), "bytes": self._bytes, "max_bytes": self.max_bytes, "spilled": self._spilled}
+
+    def _discard(self, key):
+        entry = self._layers.pop(key, None)
+        if entry:
+            self._bytes -= len(entry[0])
+
+def _write_file(path: Path, data: bytes):
+    """Writes atomically, so the static mount never serves half a file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomically(path, data)
+
+def create_layer_store() -> LayerStore:
+    """Builds the layer store from LAYER_MEMORY_MAX_BYTES (0 keeps nothing in memory)."""
+    return LayerStore(int(os.getenv("LAYER_MEMORY_MAX_BYTES", DEFAULT_LAYER_MEMORY_BYTES)))
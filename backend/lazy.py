@@ -0,0 +1,43 @@
+import importlib
+import time
+from typing import Iterable
+
+class LazyModule:
+    """
+    Stands in for a module that is slow to import (cv2, numpy, PIL behind it): the import
+    happens on first attribute access, or earlier through `load` (see warm_up). Attributes
+    are the real module's, so functions handed to a process pool still pickle by name.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self.name!r}{' (loaded)' if self.loaded else ''}>"
+
+def preload(names: Iterable[str]):
+    """Imports modules by name. Picklable, to warm up process pool workers (see app warm-up)."""
+    for name in names:
+        importlib.import_module(name)
+
+def warm_up(modules: Iterable[LazyModule]) -> dict[str, float]:
+    """Imports the modules now (blocking; run it off the event loop). Returns seconds per module."""
+    timings = {}
+    for module in modules:
+        started = time.perf_counter()
+        module.load()
+        timings[module.name] = round(time.perf_counter() - started, 4)
+    return timings
@@ -0,0 +1,267 @@
+import functools
+import inspect
+import math
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+# Pipeline stages span milliseconds (Canny on a thumbnail) to minutes (a queued prediction)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+class Metric:
+    """A named metric in the Prometheus text format; subclasses yield its samples."""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[tuple[str, dict, float]]:
+        """(name suffix, labels, value) for every series."""
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield "_total", dict(zip(self.label_names, key)), value
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts, sum, count); the +Inf bucket is the count
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series[2] if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield "_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield "_bucket", {**labels, "le": "+Inf"}, count
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+class CallbackMetric(Metric):
+    """
+    A gauge or counter read at scrape time from `fn`, for values something else already
+    tracks (job store size, cache hit counts). `fn` returns a number, or a dict mapping
+    label values (a tuple, or a plain value for one label) to numbers.
+    """
+
+    def __init__(self, name: str, documentation: str, fn: Callable, type: str = "gauge", label_names: tuple = ()):
+        super().__init__(name, documentation, label_names)
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        suffix = "_total" if self.type == "counter" else ""
+        value = self.fn()
+        if not isinstance(value, dict):
+            yield suffix, {}, value
+            return
+        for key, item in sorted(value.items()):
+            key = key if isinstance(key, tuple) else (key,)
+            yield suffix, dict(zip(self.label_names, key)), item
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Adds a metric; registering the same name again replaces it (app reloads in tests)."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines += metric.render()
+            except Exception as e:
+                # One broken callback must not take the whole scrape down
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "sketchsplit_stage_seconds", "Time spent in each pipeline stage.", ("stage",)
+))
+
+# --- Timing hook ---
+_enabled = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+_local = threading.local()
+
+def enabled() -> bool:
+    return _enabled
+
+def set_enabled(value: bool):
+    global _enabled
+    _enabled = bool(value)
+
+def observe_stage(stage: str, seconds: float):
+    """Records a stage duration, or buffers it while call_collecting runs on this thread."""
+    buffer = getattr(_local, "buffer", None)
+    if buffer is not None:
+        buffer.append((stage, seconds))
+    else:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+class timed:
+    """
+    Times a pipeline stage into sketchsplit_stage_seconds, as a context manager
+    (`with timed("canny"):`) or a decorator on sync or async functions (`@timed("merge")`).
+    With metrics disabled (METRICS_ENABLED=0) it only checks a flag.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._starts: list[float] = []
+
+    def __enter__(self):
+        if _enabled:
+            self._starts.append(time.perf_counter())
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._starts:
+            observe_stage(self.stage, time.perf_counter() - self._starts.pop())
+        return False
+
+    def __call__(self, fn):
+        stage = self.stage
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    observe_stage(stage, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe_stage(stage, time.perf_counter() - start)
+        return wrapper
+
+def timed_iter(stage: str, chunks: Iterable) -> Iterator:
+    """
+    Yields from `chunks`, timing only the work of producing them (not the time the
+    consumer spends between chunks, e.g. a slow client of a streamed download).
+    """
+    if not _enabled:
+        yield from chunks
+        return
+    iterator = iter(chunks)
+    spent = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                spent += time.perf_counter() - start
+                break
+            spent += time.perf_counter() - start
+            yield chunk
+    finally:
+        observe_stage(stage, spent)
+
+def call_collecting(fn, *args, **kwargs) -> tuple[object, list]:
+    """
+    Runs fn and returns (result, stage observations made while it ran). Used by the CPU
+    pool: timings made in a worker process are sent back with the result and recorded
+    in the API process with record_observations.
+    """
+    previous = getattr(_local, "buffer", None)
+    _local.buffer = []
+    try:
+        result = fn(*args, **kwargs)
+        return result, _local.buffer
+    finally:
+        _local.buffer = previous
+
+def record_observations(observations: Optional[list]):
+    for stage, seconds in observations or ():
+        observe_stage(stage, seconds)
@@ -0,0 +1,46 @@
+"""
+Processing options the API checks requests and settings against. Kept apart from the
+imaging modules (preprocess, composer) so the API process can validate input without
+importing cv2, numpy or PIL; those modules re-export what is defined here.
+"""
+from typing import Optional
+
+# 100/200 are doc-recommended defaults as per plan section 3.1, with a 5x5 blur
+DEFAULT_LOW_THRESHOLD = 100
+DEFAULT_HIGH_THRESHOLD = 200
+DEFAULT_BLUR_KSIZE = 5
+
+# Preprocessing modes:
+#   full     decode at full resolution (original behaviour)
+#   reduced  decode with IMREAD_REDUCED_* and downscale to the model's working size
+#   tiled    full-resolution edge map, computed tile by tile from a grayscale decode
+PREPROCESS_MODES = ("full", "reduced", "tiled")
+DEFAULT_TARGET_SIZE = 768  # ControlNet works at roughly 512-768 px
+
+# Names of preprocess.CONTROL_FILTERS, in the same order
+CONTROL_FILTER_NAMES = ("canny", "auto_canny", "silhouette", "sobel", "scharr", "soft_edges")
+DEFAULT_CONTROL_FILTERS = ("canny",)
+# Grayscale maps (the rest are binary); the composer keeps their intensity as alpha
+SOFT_CONTROL_FILTERS = ("sobel", "scharr", "soft_edges")
+
+# Thumbnails of the edge map for the optimistic preview (longer side in px)
+EDGE_PREVIEW_SIZES = (256, 1024)
+EDGE_PREVIEW_QUALITY = 80
+
+# What a job delivers: the stylized image with its layers, or only the edge map (fast path)
+OUTPUT_MODES = ("stylized", "edges")
+DEFAULT_OUTPUT_MODE = "stylized"
+EDGES_OUTPUT = "edges"
+
+# Animated preview in the download bundle
+PREVIEW_FORMATS = ("gif", "webp", "mp4")
+
+def parse_control_filters(value: Optional[str]) -> tuple[str, ...]:
+    """"canny, sobel" -> ("canny", "sobel"); empty means the default. Raises ValueError."""
+    names = tuple(dict.fromkeys(name.strip() for name in (value or "").split(",") if name.strip()))
+    if not names:
+        return DEFAULT_CONTROL_FILTERS
+    unknown = [name for name in names if name not in CONTROL_FILTER_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown control filter(s): {', '.join(unknown)}. Use any of {', '.join(CONTROL_FILTER_NAMES)}.")
+    return names
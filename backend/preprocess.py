@@ -1,74 +1,434 @@
 import cv2
+import io
 import numpy as np
+from PIL import Image
 from pathlib import Path
 import uuid
 import os # For saving to a temporary directory
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
-# Ensure a temporary directory for processed images exists
+from .atomic import write_atomically
+from .metrics import call_collecting, record_observations, timed
+# Defaults and option names live in .options so the API can check requests without cv2
+from .options import (  # noqa: F401  (re-exported)
+    DEFAULT_BLUR_KSIZE, DEFAULT_CONTROL_FILTERS, DEFAULT_HIGH_THRESHOLD, DEFAULT_LOW_THRESHOLD, DEFAULT_TARGET_SIZE,
+    EDGE_PREVIEW_QUALITY, EDGE_PREVIEW_SIZES, PREPROCESS_MODES, SOFT_CONTROL_FILTERS, parse_control_filters,
+)
+
+# Where canny_edge and adaptive_threshold_silhouette save their output (created on first use)
 TEMP_IMAGE_DIR = Path("temp_images")
-TEMP_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
 
-def canny_edge(image_bytes: bytes, filename: str) -> Path:
-    """
-    Applies Gaussian blur and Canny edge detection to an image.
-    Saves the processed image to a temporary file and returns its path.
+DEFAULT_TILE_SIZE = 1024
+DEFAULT_TILE_OVERLAP = 32
 
-    Args:
-        image_bytes: Raw bytes of the image.
-        filename: Original filename, used to derive a unique name for the processed image.
+# Largest IMREAD_REDUCED_* factor first
+_REDUCED_FLAGS = {
+    True: ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2)),
+    False: ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)),
+}
 
-    Returns:
-        Path to the saved edge map image.
+def _image_size(image_bytes: bytes) -> tuple[int, int]:
+    """(width, height) from the image header, without decoding pixels."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        return img.size
+
+def decode_reduced(image_bytes: bytes, target_size: int, grayscale: bool = False) -> np.ndarray:
+    """
+    Decodes an image so that its longer side is about target_size.
+
+    Picks the largest IMREAD_REDUCED_* factor (2/4/8) that stays at or above target_size,
+    which lets libjpeg skip most of the work (DCT scaling), then finishes with an INTER_AREA
+    resize. Small images are decoded as they are.
     """
-    # Decode image bytes
     nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    try:
+        longest = max(_image_size(image_bytes))
+    except Exception:
+        longest = 0  # Unknown header: decode at full size and resize below
+
+    flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    for factor, reduced_flag in _REDUCED_FLAGS[grayscale]:
+        if longest and longest // factor >= target_size:
+            flag = reduced_flag
+            break
 
+    img = cv2.imdecode(nparr, flag)
     if img is None:
         raise ValueError("Could not decode image from bytes.")
 
-    # 1.3.1 Noise reduction first (Gaussian Blur)
-    # OpenCV tutorial suggests blurring before edge detection for better results.
-    # Parameters: (image, kernel_size, sigmaX)
-    # 5x5 kernel as specified in plan section 3.1
-    blur = cv2.GaussianBlur(img, (5, 5), 0)
+    height, width = img.shape[:2]
+    scale = target_size / max(height, width)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return img
+
+def tiled_canny(gray: np.ndarray, low_threshold: int, high_threshold: int, blur_ksize: int,
+                tile_size: int = DEFAULT_TILE_SIZE, overlap: int = DEFAULT_TILE_OVERLAP) -> np.ndarray:
+    """
+    Blur + Canny over a grayscale image one tile at a time.
+
+    Each tile is processed with `overlap` extra pixels on every side and only its centre is
+    kept, so the blur and Canny's gradients see the same neighbourhood as on the whole image.
+    Temporary buffers are tile-sized instead of image-sized.
+    """
+    height, width = gray.shape
+    edges = np.empty_like(gray)
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            y0, x0 = max(0, y - overlap), max(0, x - overlap)
+            y1, x1 = min(height, y + tile_size + overlap), min(width, x + tile_size + overlap)
+            tile = gray[y0:y1, x0:x1]
+            if blur_ksize > 1:
+                tile = cv2.GaussianBlur(tile, (blur_ksize, blur_ksize), 0)
+            tile_edges = cv2.Canny(tile, low_threshold, high_threshold)
+            h, w = min(tile_size, height - y), min(tile_size, width - x)
+            edges[y:y + h, x:x + w] = tile_edges[y - y0:y - y0 + h, x - x0:x - x0 + w]
+    return edges
+
+class ControlInputs:
+    """
+    An image decoded once, plus the buffers the control filters share, each computed on
+    first use: `gray` and `blurred_gray` (Gaussian blur, then grayscale, exactly what
+    detect_edges has always fed Canny).
+
+    In "tiled" mode only a grayscale image is decoded; Canny then runs tile by tile,
+    while other filters work on the whole grayscale image.
+    """
+
+    def __init__(self, image_bytes: bytes, mode: str = "full", target_size: int = DEFAULT_TARGET_SIZE,
+                 blur_ksize: int = DEFAULT_BLUR_KSIZE):
+        if mode not in PREPROCESS_MODES:
+            raise ValueError(f"Unknown preprocessing mode: {mode}. Use one of {', '.join(PREPROCESS_MODES)}.")
+        self.mode = mode
+        self.blur_ksize = blur_ksize
+        self._gray = self._blurred_gray = None
+
+        with timed("decode"):
+            if mode == "tiled":
+                # Grayscale decode: one byte per pixel instead of three, and no full-size blur copy
+                self.image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+                self._gray = self.image
+            elif mode == "reduced":
+                self.image = decode_reduced(image_bytes, target_size)
+            else:
+                # Decode image bytes
+                nparr = np.frombuffer(image_bytes, np.uint8)
+                self.image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if self.image is None:
+            raise ValueError("Could not decode image from bytes.")
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def blurred_gray(self) -> np.ndarray:
+        if self._blurred_gray is None:
+            # 1.3.1 Noise reduction first (Gaussian Blur)
+            # OpenCV tutorial suggests blurring before edge detection for better results.
+            # Parameters: (image, kernel_size, sigmaX)
+            # 5x5 kernel as specified in plan section 3.1
+            with timed("blur"):
+                ksize = (self.blur_ksize, self.blur_ksize)
+                if self.blur_ksize <= 1:
+                    self._blurred_gray = self.gray
+                elif self.image.ndim == 2:
+                    self._blurred_gray = cv2.GaussianBlur(self.image, ksize, 0)
+                else:
+                    # Convert to grayscale for Canny
+                    self._blurred_gray = cv2.cvtColor(cv2.GaussianBlur(self.image, ksize, 0), cv2.COLOR_BGR2GRAY)
+        return self._blurred_gray
+
+def detect_edges(image_bytes: bytes, low_threshold: int = DEFAULT_LOW_THRESHOLD,
+                 high_threshold: int = DEFAULT_HIGH_THRESHOLD, blur_ksize: int = DEFAULT_BLUR_KSIZE,
+                 mode: str = "full", target_size: int = DEFAULT_TARGET_SIZE) -> np.ndarray:
+    """
+    Applies Gaussian blur and Canny edge detection to an image and returns the edge map
+    (uint8, white edges on black).
 
-    # Convert to grayscale for Canny
-    gray = cv2.cvtColor(blur, cv2.COLOR_BGR2GRAY)
+    Args:
+        image_bytes: Raw bytes of the image.
+        low_threshold, high_threshold: Canny hysteresis thresholds.
+        blur_ksize: Gaussian kernel size (odd); 0 or 1 skips the blur.
+        mode: "full", "reduced" (edge map at about target_size px) or "tiled"
+            (full resolution, bounded working memory). See PREPROCESS_MODES.
+        target_size: Longer side of the edge map in "reduced" mode.
+    """
+    inputs = ControlInputs(image_bytes, mode, target_size, blur_ksize)
+    return _canny(inputs, low_threshold, high_threshold)
 
+# --- Control filters: each turns the shared ControlInputs into one uint8 control map ---
+def _canny(inputs: ControlInputs, low_threshold: int = DEFAULT_LOW_THRESHOLD,
+           high_threshold: int = DEFAULT_HIGH_THRESHOLD) -> np.ndarray:
+    if inputs.mode == "tiled":
+        with timed("canny"):  # Blur and Canny alternate per tile, so this includes the blur
+            return tiled_canny(inputs.gray, low_threshold, high_threshold, inputs.blur_ksize)
     # 1.3.1 Canny edge detection
     # Parameters: (image, threshold1, threshold2)
     # 100/200 are doc-recommended defaults as per plan section 3.1
-    edges = cv2.Canny(gray, 100, 200)
+    gray = inputs.blurred_gray
+    with timed("canny"):
+        return cv2.Canny(gray, low_threshold, high_threshold)
+
+def _auto_canny(inputs: ControlInputs, sigma: float = 0.33, **_) -> np.ndarray:
+    """Canny with thresholds at (1 -/+ sigma) x the median intensity, for any exposure."""
+    gray = inputs.blurred_gray
+    with timed("auto_canny"):
+        # Median from the histogram: one pass, no sorted copy of the image
+        cumulative = np.cumsum(cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel())
+        median = int(np.searchsorted(cumulative, cumulative[-1] / 2))
+        lower = int(max(0, (1.0 - sigma) * median))
+        upper = int(min(255, (1.0 + sigma) * median))
+        return cv2.Canny(gray, lower, max(upper, lower + 1))
+
+def _silhouette(inputs: ControlInputs, **_) -> np.ndarray:
+    """Adaptive (local Gaussian) threshold: dark shapes come out white on black."""
+    gray = inputs.blurred_gray
+    with timed("silhouette"):
+        # Neighbourhood scales with the image so large photos do not turn into texture
+        block = max(11, max(gray.shape) // 64) | 1
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, block, 2)
+
+def _gradient_magnitude(gray: np.ndarray, operator) -> np.ndarray:
+    gx = cv2.convertScaleAbs(operator(gray, cv2.CV_16S, 1, 0))
+    gy = cv2.convertScaleAbs(operator(gray, cv2.CV_16S, 0, 1))
+    return cv2.addWeighted(gx, 0.5, gy, 0.5, 0)
+
+def _sobel(inputs: ControlInputs, **_) -> np.ndarray:
+    gray = inputs.blurred_gray
+    with timed("sobel"):
+        return _gradient_magnitude(gray, lambda img, depth, dx, dy: cv2.Sobel(img, depth, dx, dy, ksize=3))
+
+def _scharr(inputs: ControlInputs, **_) -> np.ndarray:
+    gray = inputs.blurred_gray
+    with timed("scharr"):
+        return _gradient_magnitude(gray, cv2.Scharr)
+
+def _soft_edges(inputs: ControlInputs, **_) -> np.ndarray:
+    """
+    HED-style soft edges without the network: gradient magnitude at three scales, each
+    normalized and averaged, so strong outlines are bold and fine texture stays faint.
+    """
+    gray = inputs.gray
+    with timed("soft_edges"):
+        acc = np.zeros(gray.shape, np.float32)
+        for sigma in (1.0, 2.0, 4.0):
+            smooth = cv2.GaussianBlur(gray, (0, 0), sigma)
+            magnitude = cv2.magnitude(cv2.Sobel(smooth, cv2.CV_32F, 1, 0), cv2.Sobel(smooth, cv2.CV_32F, 0, 1))
+            peak = float(magnitude.max())
+            if peak > 0:
+                cv2.scaleAdd(magnitude, 1.0 / (3 * peak), acc, dst=acc)
+        # Gamma < 1 lifts mid-strength edges, like HED's side outputs fused together
+        return cv2.convertScaleAbs(cv2.pow(acc, 0.6), alpha=255.0)
+
+CONTROL_FILTERS = {
+    "canny": _canny,
+    "auto_canny": _auto_canny,
+    "silhouette": _silhouette,
+    "sobel": _sobel,
+    "scharr": _scharr,
+    "soft_edges": _soft_edges,
+}  # Keys must match options.CONTROL_FILTER_NAMES
+
+def compute_control_maps(image_bytes: bytes, filters=DEFAULT_CONTROL_FILTERS,
+                         low_threshold: int = DEFAULT_LOW_THRESHOLD, high_threshold: int = DEFAULT_HIGH_THRESHOLD,
+                         blur_ksize: int = DEFAULT_BLUR_KSIZE, mode: str = "full",
+                         target_size: int = DEFAULT_TARGET_SIZE, max_threads: Optional[int] = None) -> dict[str, np.ndarray]:
+    """
+    Decodes the image once and computes every requested control map from the shared
+    buffers (see ControlInputs). Returns {filter name: uint8 map} in request order.
+
+    With several filters they run in parallel threads (OpenCV releases the GIL), up to
+    `max_threads` (default: cv2.getNumThreads()). On a single core they run in turn.
+    """
+    unknown = [name for name in filters if name not in CONTROL_FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown control filter(s): {', '.join(unknown)}. Use any of {', '.join(CONTROL_FILTERS)}.")
+    inputs = ControlInputs(image_bytes, mode, target_size, blur_ksize)
+    params = {"low_threshold": low_threshold, "high_threshold": high_threshold}
+
+    def run(name: str) -> np.ndarray:
+        fn = CONTROL_FILTERS[name]
+        return fn(inputs, **params) if fn is _canny else fn(inputs)
+
+    threads = min(len(filters), max_threads or cv2.getNumThreads() or 1)
+    if threads <= 1:
+        return {name: run(name) for name in filters}
+
+    # Shared buffers first, so the threads do not race to compute them
+    if any(name != "soft_edges" for name in filters) and not (mode == "tiled" and tuple(filters) == ("canny",)):
+        inputs.blurred_gray
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        # Timings taken on pool threads are handed back to this thread (see metrics.call_collecting)
+        futures = {name: pool.submit(call_collecting, run, name) for name in filters}
+        maps = {}
+        for name, future in futures.items():
+            maps[name], observations = future.result()
+            record_observations(observations)
+    return maps
+
+def control_maps_png(image_bytes: bytes, filters=DEFAULT_CONTROL_FILTERS, preview_paths: Optional[dict] = None,
+                     svg_path: Optional[str] = None, **params) -> dict[str, bytes]:
+    """
+    compute_control_maps, each map encoded as PNG bytes (for the CPU pool, like canny_edge_png).
+    With `preview_paths` ({size: path}), also writes the first map's thumbnails there
+    (see write_edge_previews) while its array is still at hand; likewise its SVG with
+    `svg_path` (see write_edge_svg).
+    """
+    maps = compute_control_maps(image_bytes, filters, **params)
+    with timed("imwrite"):
+        pngs = {name: encode_png(control_map) for name, control_map in maps.items()}
+    if preview_paths:
+        write_edge_previews(maps[filters[0]], preview_paths)
+    if svg_path:
+        write_edge_svg(maps[filters[0]], svg_path)
+    return pngs
+
+def _load_edge_map(edge_map) -> np.ndarray:
+    """An edge map given as the array, or as a PNG (path or bytes)."""
+    if isinstance(edge_map, np.ndarray):
+        return edge_map
+    data = edge_map if isinstance(edge_map, (bytes, bytearray)) else Path(edge_map).read_bytes()
+    decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if decoded is None:
+        raise ValueError("Could not decode edge map.")
+    return decoded
+
+# --- Thumbnails of the edge map for the optimistic preview (sizes: options.EDGE_PREVIEW_SIZES) ---
+def edge_map_previews(edge_map: np.ndarray, sizes=EDGE_PREVIEW_SIZES,
+                      quality: int = EDGE_PREVIEW_QUALITY) -> dict[int, bytes]:
+    """
+    WebP thumbnails of an edge map, {size: bytes}, each at most `size` px on the longer
+    side (never upscaled). Built as a pyramid, largest first, each level from the one
+    above it. Lines are thickened before each reduction so one-pixel edges stay visible.
+    """
+    previews = {}
+    level = edge_map
+    with timed("edge_preview"):
+        for size in sorted(sizes, reverse=True):
+            height, width = level.shape[:2]
+            scale = size / max(height, width)
+            if scale < 1:
+                kernel = min(9, int(round(1 / scale)) | 1)
+                if kernel > 1:
+                    level = cv2.dilate(level, np.ones((kernel, kernel), np.uint8))
+                new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+                level = cv2.resize(level, new_size, interpolation=cv2.INTER_AREA)
+            ok, webp = cv2.imencode(".webp", level, [cv2.IMWRITE_WEBP_QUALITY, quality])
+            if not ok:
+                raise ValueError("Could not encode preview as WebP.")
+            previews[size] = webp.tobytes()
+    return previews
+
+def write_edge_previews(edge_map, paths: dict) -> dict[int, str]:
+    """
+    Writes edge_map_previews to `paths` ({size: path}) and returns {size: path as str}.
+    `edge_map` may be the array or an edge map PNG (path or bytes).
+    """
+    written = {}
+    for size, data in edge_map_previews(_load_edge_map(edge_map), tuple(paths)).items():
+        path = Path(paths[size])
+        write_atomically(path, data)
+        written[size] = str(path)
+    return written
+
+# --- Vector export of the edge map ---
+# approxPolyDP tolerance: a vertex may move this many px off the traced line
+SVG_EPSILON = 1.0
+# Contours shorter than this (px of outline) are specks and left out
+SVG_MIN_LENGTH = 8.0
+
+def edge_map_svg(edge_map: np.ndarray, epsilon: float = SVG_EPSILON, min_length: float = SVG_MIN_LENGTH) -> bytes:
+    """
+    The edge map's lines as an SVG of one stroked path, at the map's size.
+
+    Lines are traced with cv2.findContours, keeping outer boundaries only (the hole
+    inside a one-pixel loop would draw it twice), then simplified with approxPolyDP.
+    Vertices are written as small relative moves, which is what keeps the file a
+    fraction of the size of the PNG. Soft (grayscale) maps are cut at half intensity.
+    """
+    with timed("vectorize"):
+        _, binary = cv2.threshold(edge_map, 127, 255, cv2.THRESH_BINARY)
+        contours, hierarchy = cv2.findContours(binary, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        subpaths = []
+        for contour, (_, _, _, parent) in zip(contours, hierarchy[0] if hierarchy is not None else ()):
+            if parent != -1 or cv2.arcLength(contour, True) < min_length:
+                continue
+            points = cv2.approxPolyDP(contour, epsilon, True).reshape(-1, 2)
+            if len(points) < 2:
+                continue
+            x, y = points[0]
+            moves = " ".join(f"{dx} {dy}" for dx, dy in np.diff(points, axis=0).tolist())
+            subpaths.append(f"M{x} {y}l{moves}z")
+        height, width = edge_map.shape[:2]
+        # Half-pixel offset: a 1 px stroke through pixel centres stays crisp
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+            f'<path transform="translate(.5 .5)" fill="none" stroke="#000" stroke-width="1" stroke-linejoin="round" '
+            f'd="{"".join(subpaths)}"/></svg>\n'
+        ).encode("ascii")
+
+def write_edge_svg(edge_map, path) -> str:
+    """Writes edge_map_svg to `path` and returns it as str. `edge_map` as for write_edge_previews."""
+    path = Path(path)
+    write_atomically(path, edge_map_svg(_load_edge_map(edge_map)))
+    return str(path)
+
+def encode_png(image: np.ndarray) -> bytes:
+    ok, png = cv2.imencode(".png", image)
+    if not ok:
+        raise ValueError("Could not encode image as PNG.")
+    return png.tobytes()
+
+def canny_edge_png(image_bytes: bytes, **params) -> bytes:
+    """
+    detect_edges, returned as PNG bytes. Meant for the CPU pool: a few hundred KB of PNG
+    cross the process boundary instead of the decoded array, and nothing touches disk.
+    """
+    edges = detect_edges(image_bytes, **params)
+    with timed("imwrite"):
+        return encode_png(edges)
+
+def canny_edge(image_bytes: bytes, filename: str, low_threshold: int = DEFAULT_LOW_THRESHOLD,
+               high_threshold: int = DEFAULT_HIGH_THRESHOLD, blur_ksize: int = DEFAULT_BLUR_KSIZE,
+               mode: str = "full", target_size: int = DEFAULT_TARGET_SIZE) -> Path:
+    """
+    Applies Gaussian blur and Canny edge detection to an image (see detect_edges).
+    Saves the processed image to a temporary file and returns its path.
+
+    Args:
+        image_bytes: Raw bytes of the image.
+        filename: Original filename, used to derive a unique name for the processed image.
+
+    Returns:
+        Path to the saved edge map image.
+    """
+    edges = detect_edges(image_bytes, low_threshold, high_threshold, blur_ksize, mode, target_size)
 
     # Save the processed image
     # Create a unique filename for the edge map
     unique_id = uuid.uuid4()
     edge_map_filename = f"edge_{unique_id}_{Path(filename).stem}.png"
     edge_map_path = TEMP_IMAGE_DIR / edge_map_filename
+    TEMP_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
     
-    cv2.imwrite(str(edge_map_path), edges)
+    with timed("imwrite"):
+        cv2.imwrite(str(edge_map_path), edges)
     
     return edge_map_path
 
-# 1.3.2 Extra filters (stretch goal) - Placeholder
+# 1.3.2 Extra filters
 def adaptive_threshold_silhouette(image_bytes: bytes, filename: str) -> Path:
     """
-    Applies adaptive thresholding to create a silhouette.
-    (Placeholder for stretch goal)
+    Applies adaptive thresholding to create a silhouette (the "silhouette" control filter).
+    Saves it to a temporary file and returns its path, like canny_edge.
     """
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    if img is None:
-        raise ValueError("Could not decode image from bytes.")
-        
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    # Example: cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-    # This is a placeholder; actual implementation would require tuning and saving.
-    print("Adaptive thresholding not yet implemented.")
-    
-    # For now, returning a dummy path or raising NotImplementedError would be appropriate
-    # For demonstration, let's assume it saves similarly if implemented
-    dummy_path = TEMP_IMAGE_DIR / f"silhouette_{uuid.uuid4()}_{Path(filename).stem}.png"
-    # cv2.imwrite(str(dummy_path), some_processed_image) 
-    return dummy_path
\ No newline at end of file
+    silhouette = compute_control_maps(image_bytes, ("silhouette",))["silhouette"]
+    silhouette_path = TEMP_IMAGE_DIR / f"silhouette_{uuid.uuid4()}_{Path(filename).stem}.png"
+    TEMP_IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    with timed("imwrite"):
+        cv2.imwrite(str(silhouette_path), silhouette)
+    return silhouette_path
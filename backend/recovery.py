@@ -0,0 +1,117 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Iterable, Optional
+
+from .job_store import JobStore
+
+DEFAULT_HEARTBEAT_SECONDS = 10
+# A worker that has not sent a heartbeat for this long is presumed dead and its jobs are resumed
+DEFAULT_WORKER_LEASE_SECONDS = 60
+WORKER_KIND = "worker"
+CLAIM_KIND = "recovery"
+
+def new_worker_id() -> str:
+    """host:pid:random, unique across restarts (a restarted worker may get the same pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class WorkerRegistry:
+    """
+    Liveness of the API workers sharing a job store, so jobs left behind by a dead worker
+    can be picked up by a live one.
+
+    Each worker keeps a `worker:<id>` record alive with `heartbeat` and stamps the jobs
+    it runs with its `worker_id`. A job in one of the resumable statuses whose worker has
+    no live record is orphaned (its background task died with the process). `claim` hands
+    an orphan to exactly one worker: the first to create the `recovery:<job>:<old worker>`
+    record wins, every other worker scanning at the same time gets False.
+    """
+
+    def __init__(self, job_store: JobStore, worker_id: Optional[str] = None,
+                 lease_seconds: float = DEFAULT_WORKER_LEASE_SECONDS):
+        self.job_store = job_store
+        self.worker_id = worker_id or new_worker_id()
+        self.lease_seconds = lease_seconds
+        self.recovered = 0
+
+    def _record_id(self, worker_id: str) -> str:
+        return f"{WORKER_KIND}:{worker_id}"
+
+    def heartbeat(self):
+        fields = {"kind": WORKER_KIND, "alive_until": time.time() + self.lease_seconds}
+        if not self.job_store.update(self._record_id(self.worker_id), **fields):
+            try:
+                self.job_store.create(self._record_id(self.worker_id), "alive", **fields)
+            except KeyError:
+                self.job_store.update(self._record_id(self.worker_id), **fields)  # Created in between
+
+    def retire(self):
+        """Clean shutdown: this worker's unfinished jobs become orphans right away."""
+        self.job_store.delete(self._record_id(self.worker_id))
+
+    def is_alive(self, worker_id: Optional[str]) -> bool:
+        if not worker_id:
+            return False
+        record = self.job_store.get(self._record_id(worker_id))
+        return record is not None and record.get("alive_until", 0) >= time.time()
+
+    def orphaned(self, statuses: Iterable[str]) -> list[dict]:
+        """Job records in `statuses` whose worker is gone (this worker's own jobs never are)."""
+        alive: dict[str, bool] = {}
+        orphans = []
+        for status in statuses:
+            for record in self.job_store.find_by_status(status):
+                worker_id = record.get("worker_id")
+                if record.get("kind") is not None or worker_id == self.worker_id:
+                    continue
+                if worker_id not in alive:
+                    alive[worker_id] = self.is_alive(worker_id)
+                if not alive[worker_id]:
+                    orphans.append(record)
+        return orphans
+
+    def claim(self, job: dict) -> bool:
+        """Takes over an orphaned job. Returns False if another worker got it first."""
+        claim_id = f"{CLAIM_KIND}:{job['job_id']}:{job.get('worker_id') or '-'}"
+        try:
+            self.job_store.create(claim_id, "claimed", kind=CLAIM_KIND, worker_id=self.worker_id)
+        except KeyError:
+            return False
+        self.job_store.update(job["job_id"], worker_id=self.worker_id)
+        self.recovered += 1
+        return True
+
+    async def run_periodic(self, statuses: Iterable[str], recover: Callable[[dict], Awaitable[None]],
+                           interval: float = DEFAULT_HEARTBEAT_SECONDS,
+                           on_heartbeat: Optional[Callable[[], None]] = None):
+        """
+        Until cancelled: heartbeats every `interval` seconds and starts `recover(job)`
+        as a task for each orphan this worker claims. The first pass runs right away,
+        so a restarted worker resumes what it (or a crashed peer) left behind.
+        `on_heartbeat` (blocking, run in a thread) renews whatever else this worker holds.
+        """
+        statuses = tuple(statuses)
+        tasks: set[asyncio.Task] = set()
+        while True:
+            try:
+                await asyncio.to_thread(self.heartbeat)
+                if on_heartbeat is not None:
+                    await asyncio.to_thread(on_heartbeat)
+                orphans = await asyncio.to_thread(self.orphaned, statuses)
+                for job in orphans:
+                    if await asyncio.to_thread(self.claim, job):
+                        task = asyncio.create_task(recover(job))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+            except Exception as e:
+                print(f"Worker heartbeat or recovery scan failed: {e}")
+            await asyncio.sleep(interval)
+
+def create_worker_registry(job_store: JobStore) -> WorkerRegistry:
+    """Builds the registry from WORKER_LEASE_SECONDS."""
+    return WorkerRegistry(
+        job_store,
+        lease_seconds=float(os.getenv("WORKER_LEASE_SECONDS", DEFAULT_WORKER_LEASE_SECONDS)),
+    )
@@ -1,23 +1,28 @@
-import replicate
 import os
-from dotenv import load_dotenv # Good practice to load here too if run independently or for clarity
+import asyncio
+import base64
+import hashlib
+import hmac
+import inspect
+import random
+import time
+import httpx
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+from . import metrics
+from .atomic import atomic_path
+from .uploads import sniff_image_type
 
-# Load environment variables specifically for this client if needed,
-# though app.py loading should make them available globally if this is imported.
-load_dotenv()
-
-REPLICATE_API_TOKEN = os.getenv("REPLICATE_API_TOKEN")
-if not REPLICATE_API_TOKEN:
-    print("WARNING: REPLICATE_API_TOKEN not found in environment for replicate_client.py. Calls will fail.")
-    # For a library, it's often better to let the calling code handle the missing token
-    # or for Replicate client to raise its own error if token is not configured.
-    # replicate.Client() will typically raise an error if the token isn't found.
-
-# The Replicate client will automatically use REPLICATE_API_TOKEN from the environment.
-# client = replicate.Client(api_token=REPLICATE_API_TOKEN) # Or explicitly pass if preferred
+# Environment (.env) is loaded by app.py before this module is imported. The replicate
+# SDK is only needed by the sync stylize_image_with_replicate and is imported there:
+# it takes longer to import than the rest of this module.
 
 DEFAULT_MODEL_ID = "jagilley/controlnet-canny" # As per plan
 
+def resolve_model_id(model_id: str = None) -> str:
+    """Explicit model_id, else MODEL_ID from .env, else DEFAULT_MODEL_ID."""
+    return model_id or os.getenv("MODEL_ID", DEFAULT_MODEL_ID)
+
 def stylize_image_with_replicate(edge_map_path: str, prompt: str = "pencil sketch", model_id: str = None) -> str:
     """
     Sends an edge map image to Replicate for stylization using ControlNet.
@@ -34,10 +39,12 @@ def stylize_image_with_replicate(edge_map_path: str, prompt: str = "pencil sketc
         replicate.exceptions.ReplicateError: If the API call fails.
         FileNotFoundError: If the edge_map_path does not exist.
     """
+    import replicate
+
     if not os.path.exists(edge_map_path):
         raise FileNotFoundError(f"Edge map file not found at: {edge_map_path}")
 
-    resolved_model_id = model_id or os.getenv("MODEL_ID", DEFAULT_MODEL_ID)
+    resolved_model_id = resolve_model_id(model_id)
     
     print(f"Using Replicate model: {resolved_model_id}")
     print(f"Prompt: {prompt}")
@@ -72,12 +79,388 @@ def stylize_image_with_replicate(edge_map_path: str, prompt: str = "pencil sketc
         print(f"An unexpected error occurred in stylize_image_with_replicate: {e}")
         raise
 
+# --- Async client ---
+# replicate.run() blocks until the prediction finishes, which freezes the event loop for
+# the whole inference. The async client below talks to the HTTP API directly: it creates
+# the prediction, then polls it (or is woken up by a webhook) over one pooled connection.
+
+REPLICATE_API_BASE_URL = os.getenv("REPLICATE_API_BASE_URL", "https://api.replicate.com/v1")
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+TERMINAL_PREDICTION_STATUSES = {"succeeded", "failed", "canceled"}
+
+# Prediction outputs larger than this are refused (header or streamed byte count)
+DEFAULT_OUTPUT_MAX_BYTES = 50 * 1024 * 1024
+OUTPUT_CHUNK_SIZE = 256 * 1024
+OUTPUT_IMAGE_TYPES = ("image/png", "image/jpeg", "image/webp")
+
+try:
+    import h2  # noqa: F401  (httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class ReplicatePredictionError(Exception):
+    """A prediction finished without output (failed, canceled or timed out)."""
+
+class ReplicateOutputError(Exception):
+    """A prediction's output could not be used: too large, or not an image."""
+
+class AsyncReplicateClient:
+    """
+    Non-blocking Replicate client shared by all jobs in a worker process.
+
+    - one httpx.AsyncClient with a bounded keep-alive pool
+    - a second pooled client for output files (no API token: they live on a CDN), over
+      HTTP/2 when h2 is installed; outputs are streamed to disk (`download_output`)
+    - a semaphore capping predictions in flight (REPLICATE_MAX_IN_FLIGHT)
+    - retries with full-jitter exponential backoff on 429/5xx, honouring Retry-After
+    - polling, or webhook delivery when REPLICATE_WEBHOOK_URL is set (polling then
+      only runs as a slow fallback); a delivery only wakes the waiter, which reads the
+      outcome back from the API
+    """
+
+    def __init__(
+        self,
+        api_token: Optional[str] = None,
+        base_url: Optional[str] = None,
+        max_in_flight: Optional[int] = None,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 20.0,
+        poll_interval: Optional[float] = None,
+        prediction_timeout: Optional[float] = None,
+        webhook_url: Optional[str] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.api_token = api_token if api_token is not None else os.getenv("REPLICATE_API_TOKEN", "")
+        self.base_url = (base_url or REPLICATE_API_BASE_URL).rstrip("/")
+        self.max_in_flight = max_in_flight or int(os.getenv("REPLICATE_MAX_IN_FLIGHT", "64"))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.poll_interval = poll_interval or float(os.getenv("REPLICATE_POLL_INTERVAL", "1.0"))
+        self.prediction_timeout = prediction_timeout or float(os.getenv("REPLICATE_PREDICTION_TIMEOUT", "600"))
+        self.webhook_url = webhook_url if webhook_url is not None else os.getenv("REPLICATE_WEBHOOK_URL")
+        self._transport = transport
+        self.output_max_bytes = int(os.getenv("REPLICATE_OUTPUT_MAX_BYTES", DEFAULT_OUTPUT_MAX_BYTES))
+        self._http: Optional[httpx.AsyncClient] = None
+        self._downloads: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._waiters: dict[str, asyncio.Future] = {}
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_token}"},
+                timeout=httpx.Timeout(30.0, connect=10.0),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+                transport=self._transport,
+            )
+        return self._http
+
+    @property
+    def downloads(self) -> httpx.AsyncClient:
+        if self._downloads is None:
+            self._downloads = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0),
+                follow_redirects=True,
+                transport=self._transport,
+            )
+        return self._downloads
+
+    def _backoff_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_cap)
+            except ValueError:
+                pass
+        # Full jitter: spread retries out so a burst of 429s does not come back in lockstep
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _should_retry(method: str, response: httpx.Response) -> bool:
+        if response.status_code not in RETRY_STATUS_CODES:
+            return False
+        if method == "GET":
+            return True
+        # A 500/502/504 may come after Replicate created (and bills) the prediction; resend a
+        # POST only when it was refused outright: 429, or 503 with Retry-After
+        return response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers)
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Sends a request, retrying 429/5xx and connection errors with backoff (see _should_retry for POSTs)."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self.http.request(method, url, **kwargs)
+            except httpx.TransportError:
+                # A POST may have reached Replicate; only idempotent reads are safe to resend
+                if method != "GET" or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(self._backoff_delay(attempt))
+                continue
+            if self._should_retry(method, response) and attempt < self.max_retries:
+                await asyncio.sleep(self._backoff_delay(attempt, response))
+                continue
+            response.raise_for_status()
+            return response
+        raise AssertionError("unreachable")
+
+    async def create_prediction(self, model_id: str, input: dict) -> dict:
+        """Starts a prediction. model_id is "owner/name" or "owner/name:version"."""
+        body = {"input": input}
+        if self.webhook_url:
+            body["webhook"] = self.webhook_url
+            body["webhook_events_filter"] = ["completed"]
+
+        if ":" in model_id:
+            body["version"] = model_id.split(":", 1)[1]
+            response = await self._request("POST", "/predictions", json=body)
+        else:
+            response = await self._request("POST", f"/models/{model_id}/predictions", json=body)
+        return response.json()
+
+    async def get_prediction(self, prediction_id: str) -> dict:
+        return (await self._request("GET", f"/predictions/{prediction_id}")).json()
+
+    async def cancel_prediction(self, prediction_id: str):
+        try:
+            await self._request("POST", f"/predictions/{prediction_id}/cancel")
+        except httpx.HTTPError as e:
+            print(f"Could not cancel Replicate prediction {prediction_id}: {e}")
+
+    def notify_webhook(self, prediction: dict) -> bool:
+        """
+        Wakes the task waiting on a prediction named in a webhook payload, if it runs here.
+        Nothing else in the payload is used: the waiter fetches the prediction itself.
+        """
+        waiter = self._waiters.get(prediction.get("id"))
+        if waiter is None or waiter.done():
+            return False
+        if prediction.get("status") in TERMINAL_PREDICTION_STATUSES:
+            waiter.set_result(None)
+        return True
+
+    async def wait_for_prediction(self, prediction: dict, queued_since: Optional[float] = None) -> dict:
+        """
+        Polls (or waits for the webhook) until the prediction reaches a terminal status.
+        With `queued_since` (a time.perf_counter() value), records how long it queued
+        (until it left "starting") and ran as the replicate_queue/replicate_inference stages.
+        """
+        prediction_id = prediction["id"]
+        running_since = None if prediction.get("status") == "starting" else time.perf_counter()
+        # With a webhook configured, polling is only a safety net
+        interval = max(self.poll_interval, 10.0) if self.webhook_url else self.poll_interval
+        deadline = time.monotonic() + self.prediction_timeout
+        loop = asyncio.get_running_loop()
+        # Only predictions created with a webhook can be woken by one
+        waiter = loop.create_future() if self.webhook_url else None
+        if waiter is not None:
+            self._waiters[prediction_id] = waiter
+        try:
+            while prediction.get("status") not in TERMINAL_PREDICTION_STATUSES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    await self.cancel_prediction(prediction_id)
+                    raise ReplicatePredictionError(f"Prediction {prediction_id} timed out after {self.prediction_timeout}s")
+                if waiter is None:
+                    await asyncio.sleep(min(interval, remaining))
+                else:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(waiter), timeout=min(interval, remaining))
+                    except asyncio.TimeoutError:
+                        pass
+                    if waiter.done():
+                        # Woken up: the delivery's claims are checked against the API below
+                        waiter = self._waiters[prediction_id] = loop.create_future()
+                prediction = await self.get_prediction(prediction_id)
+                if running_since is None and prediction.get("status") != "starting":
+                    running_since = time.perf_counter()
+            if queued_since is not None:
+                finished = time.perf_counter()
+                running_since = running_since or finished
+                metrics.observe_stage("replicate_queue", running_since - queued_since)
+                metrics.observe_stage("replicate_inference", finished - running_since)
+            return prediction
+        finally:
+            self._waiters.pop(prediction_id, None)
+
+    async def run(self, model_id: str, input: dict,
+                  on_created: Optional[Callable[[dict], Union[None, Awaitable[None]]]] = None) -> object:
+        """
+        Creates a prediction and waits for its output, within the in-flight limit.
+        `on_created(prediction)` is called (and awaited, if it returns an awaitable) as soon
+        as the prediction exists, e.g. to record its id so a restarted worker can reattach
+        to it (see `attach`).
+        """
+        # Queue time includes waiting for a slot under the in-flight limit
+        queued_since = time.perf_counter() if metrics.enabled() else None
+        async with self._semaphore:
+            prediction = await self.create_prediction(model_id, input)
+            if on_created is not None:
+                recorded = on_created(prediction)
+                if inspect.isawaitable(recorded):
+                    await recorded
+            prediction = await self.wait_for_prediction(prediction, queued_since)
+        return self._output(prediction)
+
+    async def attach(self, prediction_id: str) -> object:
+        """Waits for the output of a prediction created earlier (possibly by another process)."""
+        async with self._semaphore:
+            prediction = await self.wait_for_prediction(await self.get_prediction(prediction_id))
+        return self._output(prediction)
+
+    @staticmethod
+    def _output(prediction: dict) -> object:
+        if prediction["status"] != "succeeded":
+            raise ReplicatePredictionError(
+                f"Prediction {prediction['id']} {prediction['status']}: {prediction.get('error')}"
+            )
+        return prediction.get("output")
+
+    async def download_output(self, url: str, destination: Path, max_bytes: Optional[int] = None) -> int:
+        """
+        Streams a prediction output to `destination` (written to a temp name, then renamed)
+        and returns its size. Memory stays at one chunk per download and file writes run in
+        a thread. Raises ReplicateOutputError, before anything is kept, if Content-Length or
+        the bytes received pass `max_bytes` or the first bytes are not an OUTPUT_IMAGE_TYPES
+        image; httpx.HTTPStatusError for error responses.
+        """
+        max_bytes = max_bytes or self.output_max_bytes
+        destination = Path(destination)
+        async with self.downloads.stream("GET", url) as response:
+            response.raise_for_status()
+            declared = response.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > max_bytes:
+                raise ReplicateOutputError(f"Output is {int(declared)} bytes, more than the {max_bytes} allowed.")
+
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            # Own temp file: a resumed job and its original worker may stream to the same destination
+            with atomic_path(destination) as tmp:
+                f = await asyncio.to_thread(open, tmp, "wb")
+                try:
+                    head, size = b"", 0
+                    async for chunk in response.aiter_bytes(OUTPUT_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise ReplicateOutputError(f"Output is larger than the {max_bytes} bytes allowed.")
+                        if len(head) < 12:
+                            head += chunk[:12 - len(head)]
+                            if len(head) >= 12 and sniff_image_type(head) not in OUTPUT_IMAGE_TYPES:
+                                raise ReplicateOutputError("Output is not a PNG, JPEG or WebP image.")
+                        await asyncio.to_thread(f.write, chunk)
+                    if sniff_image_type(head) not in OUTPUT_IMAGE_TYPES:
+                        raise ReplicateOutputError("Output is not a PNG, JPEG or WebP image.")  # Under 12 bytes
+                finally:
+                    await asyncio.to_thread(f.close)
+            return size
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        if self._downloads is not None:
+            await self._downloads.aclose()
+            self._downloads = None
+
+def verify_webhook_signature(headers, body: bytes, secret: str, tolerance: int = 300) -> bool:
+    """
+    Checks Replicate's webhook signature (webhook-id/-timestamp/-signature headers,
+    HMAC-SHA256 keyed with the "whsec_..." signing secret).
+    """
+    webhook_id = headers.get("webhook-id")
+    timestamp = headers.get("webhook-timestamp")
+    signatures = headers.get("webhook-signature")
+    if not (webhook_id and timestamp and signatures):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+        key = base64.b64decode(secret.split("_", 1)[-1])
+    except ValueError:
+        return False
+    signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(key, signed_content, hashlib.sha256).digest()).decode()
+    return any(
+        hmac.compare_digest(candidate.split(",", 1)[-1], expected) for candidate in signatures.split()
+    )
+
+_async_client: Optional[AsyncReplicateClient] = None
+
+def get_async_client() -> AsyncReplicateClient:
+    """The process-wide async client, created on first use."""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncReplicateClient()
+    return _async_client
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+def _edge_map_data_uri(edge_map) -> str:
+    """Data URI of an edge map PNG, given as bytes or as a path."""
+    if isinstance(edge_map, (bytes, bytearray, memoryview)):
+        data = bytes(edge_map)
+    else:
+        with open(edge_map, "rb") as f:
+            data = f.read()
+    return "data:image/png;base64," + base64.b64encode(data).decode("ascii")
+
+async def stylize_image_async(edge_map_path: str, prompt: str = "pencil sketch", model_id: str = None,
+                              edge_map_bytes: Optional[bytes] = None,
+                              on_prediction: Optional[Callable[[str], Union[None, Awaitable[None]]]] = None) -> str:
+    """
+    Async counterpart of stylize_image_with_replicate: same arguments and return value,
+    but waits for the prediction without blocking the event loop.
+    With `edge_map_bytes` (the PNG already in memory) the file is not read.
+    `on_prediction(prediction_id)` is called (and awaited, see AsyncReplicateClient.run)
+    once the prediction has been created.
+    """
+    if edge_map_bytes is None and not os.path.exists(edge_map_path):
+        raise FileNotFoundError(f"Edge map file not found at: {edge_map_path}")
+
+    resolved_model_id = resolve_model_id(model_id)
+    print(f"Using Replicate model (async): {resolved_model_id}")
+
+    image_uri = await asyncio.to_thread(
+        _edge_map_data_uri, edge_map_bytes if edge_map_bytes is not None else edge_map_path
+    )
+    output = await get_async_client().run(
+        resolved_model_id, {"image": image_uri, "prompt": prompt},
+        on_created=(lambda prediction: on_prediction(prediction["id"])) if on_prediction else None,
+    )
+    return _output_url(output)
+
+async def resume_stylization_async(prediction_id: str) -> str:
+    """Reattaches to a prediction started by stylize_image_async and returns its output URL."""
+    return _output_url(await get_async_client().attach(prediction_id))
+
+def _output_url(output) -> str:
+    # Same output handling as the sync client: a list of URLs, we take the first
+    if isinstance(output, list) and len(output) > 0:
+        return output[0]
+    if isinstance(output, str):
+        return output
+    print(f"Unexpected output format from Replicate: {output}")
+    raise ValueError("Unexpected output format from Replicate model. Expected a list of URLs.")
+
 # Example usage (for testing this module directly):
 if __name__ == "__main__":
     # This requires a REPLICATE_API_TOKEN in your .env or environment
     # and a dummy edge map file.
+    from dotenv import load_dotenv
+    import replicate
+
+    load_dotenv()
     print("Running replicate_client.py example...")
-    if not REPLICATE_API_TOKEN:
+    if not os.getenv("REPLICATE_API_TOKEN"):
         print("REPLICATE_API_TOKEN not set. Cannot run example.")
     else:
         # Create a dummy edge map for testing
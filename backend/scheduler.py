@@ -0,0 +1,211 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+# Highest first. A tier is only served while every tier above it has nothing queued.
+PRIORITY_TIERS = ("high", "normal", "low")
+DEFAULT_TIER = "normal"
+DEFAULT_SCHEDULER_CONCURRENCY = 16
+DEFAULT_SCHEDULER_MAX_QUEUE = 200
+# Share of the queue the lowest tier may fill; beyond it low-priority work is shed first
+DEFAULT_LOW_TIER_SHARE = 0.5
+# Weight of the newest slot duration in the moving average behind ETAs
+SERVICE_TIME_SMOOTHING = 0.2
+
+class SchedulerSaturated(Exception):
+    """Raised when the stylization queue is too deep to accept more work (answered with 503)."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Stylization queue is full. Retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+class Ticket:
+    """A job's place in the scheduler: queued until `granted` is set, then holding a slot."""
+    __slots__ = ("job_id", "client", "tier", "weight", "enqueued_at", "started_at", "granted")
+
+    def __init__(self, job_id: str, client: str, tier: str, weight: float = 1.0):
+        self.job_id = job_id
+        self.client = client
+        self.tier = tier
+        self.weight = weight
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.granted = asyncio.Event()
+
+class FairScheduler:
+    """
+    Admission and ordering for the stylization stage (one per API worker).
+
+    At most `max_concurrency` jobs hold a slot at once; the rest wait in per-tier queues.
+    Tiers are served in PRIORITY_TIERS order. Within a tier, clients take turns by deficit
+    round robin: each turn adds the client's weight to its credit and every job costs
+    one, so a client with weight 2 gets two jobs per round and one with hundreds queued
+    cannot starve a client with one.
+
+    `admit` sheds load before any work is done: it raises SchedulerSaturated once
+    `max_queue` jobs wait (the low tier already at `low_tier_share` of that).
+    Not thread-safe: use it from the event loop only.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_SCHEDULER_CONCURRENCY,
+                 max_queue: int = DEFAULT_SCHEDULER_MAX_QUEUE, low_tier_share: float = DEFAULT_LOW_TIER_SHARE,
+                 default_service_seconds: float = 10.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.low_tier_share = low_tier_share
+        # tier -> client -> that client's queued tickets; dict order is the round-robin order
+        self._queues: dict[str, OrderedDict[str, deque[Ticket]]] = {tier: OrderedDict() for tier in PRIORITY_TIERS}
+        self._deficit: dict[tuple[str, str], float] = {}  # (tier, client) -> credit this round
+        self._tickets: dict[str, Ticket] = {}  # job_id -> queued or running ticket
+        self._queued = 0
+        self.running = 0
+        self.shed = 0
+        self.service_seconds = default_service_seconds  # Moving average of slot durations
+
+    # --- Admission ---
+    def tier_limit(self, tier: str) -> int:
+        if tier == PRIORITY_TIERS[-1]:
+            return max(1, int(self.max_queue * self.low_tier_share))
+        return self.max_queue
+
+    def admit(self, tier: str = DEFAULT_TIER, count: int = 1):
+        """Raises SchedulerSaturated if `count` more jobs in `tier` would pass the queue limit."""
+        self._check_tier(tier)
+        if self._queued + count > self.tier_limit(tier):
+            self.shed += count
+            raise SchedulerSaturated(self.retry_after())
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has roughly drained, 1 to 60."""
+        drain = self._queued * self.service_seconds / self.max_concurrency
+        return int(min(60, max(1, math.ceil(drain))))
+
+    # --- Queueing ---
+    def enqueue(self, job_id: str, client: str, tier: str = DEFAULT_TIER, weight: float = 1.0) -> Ticket:
+        """Queues a job (admission is checked separately by `admit`) and grants slots that are free."""
+        self._check_tier(tier)
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        ticket = Ticket(job_id, client, tier, weight)
+        self._tickets[job_id] = ticket
+        self._queues[tier].setdefault(client, deque()).append(ticket)
+        self._queued += 1
+        self._dispatch()
+        return ticket
+
+    async def acquire(self, ticket: Ticket):
+        """Waits until the ticket holds a slot. If cancelled, the ticket leaves the queue."""
+        try:
+            await ticket.granted.wait()
+        except BaseException:
+            self.release(ticket)
+            raise
+
+    def release(self, ticket: Ticket):
+        """Frees the ticket's slot (or drops it from the queue) and grants the next ones."""
+        if self._tickets.get(ticket.job_id) is ticket:
+            del self._tickets[ticket.job_id]
+        if ticket.granted.is_set():
+            self.running -= 1
+            elapsed = time.monotonic() - ticket.started_at
+            self.service_seconds += SERVICE_TIME_SMOOTHING * (elapsed - self.service_seconds)
+        else:
+            clients = self._queues[ticket.tier]
+            queue = clients.get(ticket.client)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del clients[ticket.client]
+                    self._deficit.pop((ticket.tier, ticket.client), None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, job_id: str, client: str, tier: str = DEFAULT_TIER, weight: float = 1.0):
+        """`async with scheduler.slot(...)`: queue, wait for a slot, hold it for the block."""
+        ticket = self.enqueue(job_id, client, tier, weight)
+        await self.acquire(ticket)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _dispatch(self):
+        while self.running < self.max_concurrency:
+            ticket = self._next_ticket(self._queues, self._deficit)
+            if ticket is None:
+                return
+            self._queued -= 1
+            self.running += 1
+            ticket.started_at = time.monotonic()
+            ticket.granted.set()
+
+    def _next_ticket(self, queues: dict, deficit: dict) -> Optional[Ticket]:
+        """Pops the next ticket in deficit round robin order from `queues` (updating `deficit`)."""
+        for tier in PRIORITY_TIERS:
+            clients = queues[tier]
+            while clients:
+                client, queue = next(iter(clients.items()))
+                key = (tier, client)
+                if deficit.get(key, 0.0) < 1:
+                    deficit[key] = deficit.get(key, 0.0) + queue[0].weight
+                    if deficit[key] < 1:
+                        clients.move_to_end(client)  # Weight below 1: not every round
+                        continue
+                ticket = queue.popleft()
+                deficit[key] -= 1
+                if not queue:
+                    del clients[client]
+                    deficit.pop(key, None)
+                elif deficit[key] < 1:
+                    clients.move_to_end(client)
+                return ticket
+        return None
+
+    # --- Reporting ---
+    def position(self, job_id: str) -> Optional[int]:
+        """Jobs that will get a slot before this one (0: next), or None if it is not queued here."""
+        ticket = self._tickets.get(job_id)
+        if ticket is None or ticket.granted.is_set():
+            return None
+        # Replay the dispatch order on copies of the queues
+        queues = {tier: OrderedDict((client, deque(queue)) for client, queue in clients.items())
+                  for tier, clients in self._queues.items()}
+        deficit = dict(self._deficit)
+        position = 0
+        while True:
+            upcoming = self._next_ticket(queues, deficit)
+            if upcoming is None or upcoming is ticket:
+                return position
+            position += 1
+
+    def eta_seconds(self, job_id: str) -> Optional[float]:
+        """Estimated wait until the job gets a slot, from the average slot duration."""
+        position = self.position(job_id)
+        if position is None:
+            return None
+        return round(math.floor(position / self.max_concurrency + 1) * self.service_seconds, 1)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": {tier: sum(len(queue) for queue in clients.values()) for tier, clients in self._queues.items()},
+            "clients": len({client for clients in self._queues.values() for client in clients}),
+            "shed": self.shed,
+            "service_seconds": self.service_seconds,
+        }
+
+    def _check_tier(self, tier: str):
+        if tier not in PRIORITY_TIERS:
+            raise ValueError(f"Unknown priority tier: {tier}. Use one of {', '.join(PRIORITY_TIERS)}.")
+
+def create_scheduler() -> FairScheduler:
+    """Builds the scheduler from SCHEDULER_CONCURRENCY and SCHEDULER_MAX_QUEUE."""
+    return FairScheduler(
+        max_concurrency=int(os.getenv("SCHEDULER_CONCURRENCY", DEFAULT_SCHEDULER_CONCURRENCY)),
+        max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", DEFAULT_SCHEDULER_MAX_QUEUE)),
+    )
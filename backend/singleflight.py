@@ -0,0 +1,169 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional
+
+from .job_store import JobStore
+
+# A flight whose leader has not finished (or renewed it) in this long is presumed dead (worker crashed)
+DEFAULT_FLIGHT_LEASE_SECONDS = 900
+DEFAULT_FLIGHT_POLL_SECONDS = 0.5
+FLIGHT_KIND = "flight"
+# Statuses of a flight record that has ended (abandoned: its leader died or its lease ran out)
+FINISHED_STATUSES = ("done", "failed", "abandoned")
+
+class FlightFailed(Exception):
+    """The leader of a flight failed; followers fail with the same message."""
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one: the first caller (the leader)
+    runs the work and every caller that arrives while it runs gets the leader's result
+    (or its error) instead of starting its own.
+
+    Callers in this process wait on the leader's future. With a `job_store` shared by
+    all workers, a flight is also claimed as a `flight:<key>` record, so callers in
+    other workers follow it by polling that record. Results must then be JSON-
+    serializable (the record carries them). A flight left running for `lease_seconds`
+    is presumed dead and taken over; leaders keep theirs with `renew_leases`. Given the
+    leader's `worker_id` and an `is_alive` check (see recovery.WorkerRegistry), a flight
+    whose worker has died is taken over right away. Finished records stay until the job store TTL and
+    are reclaimed by the next call with the key, so later calls never reuse a result
+    (that is the result cache's job).
+    """
+
+    def __init__(self, job_store: Optional[JobStore] = None, lease_seconds: float = DEFAULT_FLIGHT_LEASE_SECONDS,
+                 poll_interval: float = DEFAULT_FLIGHT_POLL_SECONDS, worker_id: Optional[str] = None,
+                 is_alive: Optional[Callable[[str], bool]] = None):
+        self.job_store = job_store
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id
+        self.is_alive = is_alive
+        self._flights: dict[str, asyncio.Future] = {}
+        self._flight_ids: dict[str, str] = {}  # key -> flight_id of the flights led here
+        self.leaders = 0
+        self.followers = 0
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """
+        Runs `fn` unless a call with `key` is already running, in which case its outcome
+        is shared. Returns (result, shared); shared is True when another caller did the work.
+        """
+        while True:
+            future = self._flights.get(key)
+            if future is not None:
+                self.followers += 1
+                # shield: a cancelled follower must not cancel the leader's work
+                return await asyncio.shield(future), True
+
+            flight_id = str(uuid.uuid4())
+            if await self._off_loop(self._claim, key, flight_id):
+                return await self._lead(key, flight_id, fn), False
+
+            # Another worker is leading; None means its flight went away without a result
+            found, result = await self._follow_remote(key)
+            if found:
+                self.followers += 1
+                return result, True
+
+    async def _off_loop(self, fn, *args, **kwargs):
+        # A blocking job store (SQLite) may wait on another worker's lock; not on the event loop
+        if self.job_store is not None and self.job_store.blocking:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    def _record_id(self, key: str) -> str:
+        return f"{FLIGHT_KIND}:{key}"
+
+    def _claim(self, key: str, flight_id: str) -> bool:
+        if self.job_store is None:
+            return True
+        fields = {"kind": FLIGHT_KIND, "flight_id": flight_id, "worker_id": self.worker_id,
+                  "lease_until": time.time() + self.lease_seconds}
+        try:
+            self.job_store.create(self._record_id(key), "running", **fields)
+            return True
+        except KeyError:
+            # A finished flight is over; the next caller starts a new one
+            return self.job_store.transition(self._record_id(key), "running", from_statuses=FINISHED_STATUSES, **fields)
+
+    async def _lead(self, key: str, flight_id: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        # Followers may all have gone; do not warn about an exception nobody retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._flights[key] = future
+        self._flight_ids[key] = flight_id
+        self.leaders += 1
+        try:
+            result = await fn()
+        except BaseException as e:
+            # Followers here first: they must not wait on a record write that may itself be cancelled
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            await self._off_loop(self._finish, key, flight_id, "failed", error_message=str(e) or type(e).__name__)
+            raise
+        else:
+            future.set_result(result)
+            await self._off_loop(self._finish, key, flight_id, "done", result=result)
+            return result
+        finally:
+            self._flights.pop(key, None)
+            self._flight_ids.pop(key, None)
+
+    def renew_leases(self):
+        """Extends the lease of every flight led here (blocking; call it with the worker heartbeat)."""
+        if self.job_store is None:
+            return
+        for key, flight_id in list(self._flight_ids.items()):
+            record = self.job_store.get(self._record_id(key))
+            if record and record.get("flight_id") == flight_id:
+                self.job_store.transition(self._record_id(key), None, from_statuses=("running",),
+                                          lease_until=time.time() + self.lease_seconds)
+
+    def _leader_gone(self, record: dict) -> bool:
+        if record.get("lease_until", 0) < time.time():
+            return True
+        worker_id = record.get("worker_id")
+        return bool(worker_id) and self.is_alive is not None and not self.is_alive(worker_id)
+
+    def _finish(self, key: str, flight_id: str, status: str, **fields):
+        if self.job_store is None:
+            return
+        try:
+            # Only our own flight: after a lease takeover the record belongs to someone else
+            record = self.job_store.get(self._record_id(key))
+            if record and record.get("flight_id") == flight_id:
+                self.job_store.transition(self._record_id(key), status, from_statuses=("running",), **fields)
+        except Exception as e:
+            # Remote followers then wait for the lease to run out; the result still counts here
+            print(f"Could not record the end of flight {key}: {e}")
+
+    async def _follow_remote(self, key: str) -> tuple[bool, Any]:
+        """Waits for another worker's flight. Returns (True, result), or (False, None) to retry."""
+        record_id = self._record_id(key)
+        flight_id = None
+        while True:
+            record = await asyncio.to_thread(self.job_store.get, record_id)
+            if record is None:
+                return False, None
+            if flight_id is None:
+                flight_id = record.get("flight_id")
+            if record.get("flight_id") != flight_id:
+                return False, None  # Superseded by a new flight; join that one instead
+            if record["status"] == "done":
+                return True, record.get("result")
+            if record["status"] == "failed":
+                raise FlightFailed(record.get("error_message") or "Coalesced job failed")
+            if record["status"] == "abandoned":
+                return False, None
+            if await asyncio.to_thread(self._leader_gone, record):
+                # The leader died; the next claim takes over (followers retry rather than fail)
+                await asyncio.to_thread(self.job_store.transition, record_id, "abandoned", ("running",))
+                return False, None
+            await asyncio.sleep(self.poll_interval)
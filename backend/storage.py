@@ -0,0 +1,206 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from .job_store import JobStore
+
+DEFAULT_STORAGE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2 GiB
+DEFAULT_STORAGE_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_STORAGE_SWEEP_SECONDS = 300
+# A job directory without a record is left alone this long (its record may still be on its way)
+DEFAULT_ORPHAN_GRACE_SECONDS = 600
+
+# Only settled jobs lose their files; running ones are never evicted
+EVICTABLE_STATUSES = ("complete", "failed")
+EXPIRED_STATUS = "expired"
+
+def _dir_usage(path: Path) -> tuple[int, float]:
+    """(bytes of all files under path, mtime of path itself)."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.stat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                continue  # Removed while walking (temp file renamed, concurrent sweep)
+    return total, path.stat().st_mtime
+
+class StorageManager:
+    """
+    Lifecycle of the per-job directories under `root` (TEMP_IMAGE_DIR/<job_id>/).
+
+    A job's last use is its directory's mtime: writing a file into it updates it, and
+    `touch` (on /status and /download) bumps it, so every worker sharing the directory
+    sees the same recency without a shared index. `sweep` rescans the tree and:
+
+    - deletes job records past their TTL (JobStore.purge_expired), and directories
+      whose record is gone (after DEFAULT_ORPHAN_GRACE_SECONDS)
+    - evicts settled jobs unused for `ttl_seconds`
+    - evicts the least recently used settled jobs until the total is under `max_bytes`
+
+    An evicted job is moved to the `expired` status before its files are deleted, so
+    /status reports it and /download refuses it instead of serving missing files. Its
+    record then lives out the job store TTL as a tombstone. Running jobs (and jobs whose
+    artifacts are being built) are never evicted, so the quota can be exceeded while
+    they finish. A download already streaming is not cut short: composer.stream_zip_bundle
+    opens its files before the response starts.
+    """
+
+    def __init__(self, root: Path, job_store: JobStore, max_bytes: int = DEFAULT_STORAGE_MAX_BYTES,
+                 ttl_seconds: float = DEFAULT_STORAGE_TTL_SECONDS,
+                 orphan_grace_seconds: float = DEFAULT_ORPHAN_GRACE_SECONDS,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.root = Path(root)
+        self.job_store = job_store
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.orphan_grace_seconds = orphan_grace_seconds
+        self.on_evict = on_evict
+        self._usage: dict[str, int] = {}  # job_id -> bytes on disk, as of the last scan or record()
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._wake: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.evicted = 0
+        self.reclaimed_bytes = 0
+
+    def job_dir(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    def touch(self, job_id: str):
+        """Marks the job as used now (delays its TTL eviction and moves it up the LRU order)."""
+        try:
+            os.utime(self.job_dir(job_id))
+        except FileNotFoundError:
+            pass
+
+    def record(self, job_id: str) -> int:
+        """
+        Re-measures one job's directory after its files changed. Wakes the sweeper early
+        if this pushes the total over the quota. Returns the job's bytes.
+        """
+        path = self.job_dir(job_id)
+        size = _dir_usage(path)[0] if path.is_dir() else 0
+        with self._lock:
+            self._usage[job_id] = size
+            over_quota = sum(self._usage.values()) > self.max_bytes
+        if over_quota:
+            self.request_sweep()
+        return size
+
+    def usage(self, job_id: str) -> Optional[int]:
+        with self._lock:
+            return self._usage.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "jobs": len(self._usage),
+                "bytes": sum(self._usage.values()),
+                "max_bytes": self.max_bytes,
+                "evicted": self.evicted,
+                "reclaimed_bytes": self.reclaimed_bytes,
+            }
+
+    def scan(self) -> dict[str, tuple[int, float]]:
+        """job_id -> (bytes, last used) for every job directory; refreshes the usage index."""
+        usage = {}
+        for entry in os.scandir(self.root):
+            if entry.is_dir(follow_symlinks=False):
+                try:
+                    usage[entry.name] = _dir_usage(Path(entry.path))
+                except FileNotFoundError:
+                    continue  # Deleted by another worker's sweep
+        with self._lock:
+            self._usage = {job_id: size for job_id, (size, _) in usage.items()}
+        return usage
+
+    def sweep(self, now: Optional[float] = None) -> dict:
+        """One garbage-collection pass (blocking; run it off the event loop). Returns what it did."""
+        with self._sweep_lock:
+            return self._sweep(time.time() if now is None else now)
+
+    def _sweep(self, now: float) -> dict:
+        purged = self.job_store.purge_expired(now)
+        usage = self.scan()
+        removed: list[str] = []  # Directories without a live record (or of expired jobs)
+        evicted: list[str] = []
+        candidates = []  # (last used, job_id, bytes) of settled jobs
+
+        for job_id, (size, last_used) in usage.items():
+            record = self.job_store.get(job_id)
+            if record is None:
+                if now - last_used >= self.orphan_grace_seconds and self._delete(job_id, size):
+                    removed.append(job_id)
+            elif record["status"] == EXPIRED_STATUS:
+                self._delete(job_id, size)  # Left over from an interrupted eviction
+                removed.append(job_id)
+            elif record["status"] in EVICTABLE_STATUSES and record.get("artifacts_status") != "building":
+                candidates.append((last_used, job_id, size))
+
+        total = sum(size for size, _ in usage.values()) - sum(usage[job_id][0] for job_id in removed)
+        for last_used, job_id, size in sorted(candidates):
+            if now - last_used < self.ttl_seconds and total <= self.max_bytes:
+                break  # Oldest remaining job is fresh and we are under quota
+            reason = "ttl" if now - last_used >= self.ttl_seconds else "quota"
+            if self._expire(job_id, size, reason):
+                evicted.append(job_id)
+                total -= size
+
+        return {"purged_records": len(purged), "removed_dirs": len(removed), "evicted": len(evicted), "bytes": total}
+
+    def _expire(self, job_id: str, size: int, reason: str) -> bool:
+        # Status first: from here on nothing hands out this job's files
+        message = ("Job files expired and were removed." if reason == "ttl"
+                   else "Job files were removed to free disk space.")
+        if not self.job_store.transition(job_id, EXPIRED_STATUS, from_statuses=EVICTABLE_STATUSES,
+                                         error_message=message, expired_reason=reason):
+            return False  # Changed (e.g. being rebuilt) since the scan
+        with self._lock:
+            self.evicted += 1
+        return self._delete(job_id, size)
+
+    def _delete(self, job_id: str, size: int) -> bool:
+        shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        if self.on_evict is not None:
+            self.on_evict(job_id)
+        with self._lock:
+            self._usage.pop(job_id, None)
+            self.reclaimed_bytes += size
+        return True
+
+    def request_sweep(self):
+        """Runs the next periodic sweep now instead of at the end of the interval."""
+        if self._wake is not None and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def run_periodic(self, interval: float = DEFAULT_STORAGE_SWEEP_SECONDS):
+        """Sweeps every `interval` seconds (or when woken by request_sweep) until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                result = await asyncio.to_thread(self.sweep)
+                if result["purged_records"] or result["removed_dirs"] or result["evicted"]:
+                    print(f"Storage sweep: {result}")
+            except Exception as e:
+                print(f"Storage sweep failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+def create_storage_manager(root: Path, job_store: JobStore, on_evict: Optional[Callable[[str], None]] = None) -> StorageManager:
+    """Builds the manager from STORAGE_MAX_BYTES and STORAGE_TTL_SECONDS."""
+    return StorageManager(
+        root,
+        job_store,
+        max_bytes=int(os.getenv("STORAGE_MAX_BYTES", DEFAULT_STORAGE_MAX_BYTES)),
+        ttl_seconds=float(os.getenv("STORAGE_TTL_SECONDS", DEFAULT_STORAGE_TTL_SECONDS)),
+        on_evict=on_evict,
+    )
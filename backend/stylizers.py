@@ -0,0 +1,190 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+import cv2
+import numpy as np
+
+from . import replicate_client
+from .metrics import timed
+from .preprocess import decode_reduced, encode_png
+from .workers import ExecutorSaturated
+
+# MODEL_ID values like "local/pencil" select the local backend with that style
+LOCAL_MODEL_PREFIX = "local/"
+# Local styles work at roughly the model's output size; stylization is O(pixels)
+DEFAULT_LOCAL_MAX_SIDE = 768
+
+Layer = Union[bytes, Path]  # Encoded image in memory, or its file (see layers.LayerStore)
+OnStarted = Callable[[str], Union[None, Awaitable[None]]]  # Awaited if it returns an awaitable
+
+def _read_layer(layer: Layer) -> bytes:
+    return bytes(layer) if isinstance(layer, (bytes, bytearray)) else Path(layer).read_bytes()
+
+def _edges_like(edge_map: bytes, shape) -> np.ndarray:
+    """Edge map decoded and scaled to `shape`, still binary."""
+    edges = cv2.imdecode(np.frombuffer(edge_map, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if edges is None:
+        raise ValueError("Could not decode edge map.")
+    if edges.shape[:2] != shape[:2]:
+        edges = cv2.resize(edges, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+        edges = np.where(edges > 48, np.uint8(255), np.uint8(0))
+    return edges
+
+def _watercolor(img, edges):
+    return cv2.stylization(img, sigma_s=60, sigma_r=0.45)
+
+def _pencil(img, edges):
+    gray, _ = cv2.pencilSketch(img, sigma_s=60, sigma_r=0.07, shade_factor=0.05)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+def _color_pencil(img, edges):
+    return cv2.pencilSketch(img, sigma_s=60, sigma_r=0.07, shade_factor=0.05)[1]
+
+def _detail(img, edges):
+    return cv2.detailEnhance(img, sigma_s=10, sigma_r=0.15)
+
+def _cartoon(img, edges):
+    smooth = cv2.edgePreservingFilter(img, flags=cv2.RECURS_FILTER, sigma_s=60, sigma_r=0.4)
+    posterized = (smooth // 48) * 48 + 24  # Flat colour areas
+    lines = cv2.dilate(edges, np.ones((2, 2), np.uint8)) > 0
+    posterized[lines] = 0
+    return posterized
+
+def _ink(img, edges):
+    # Only the edge map: black lines on paper
+    return cv2.cvtColor(cv2.GaussianBlur(255 - edges, (3, 3), 0), cv2.COLOR_GRAY2BGR)
+
+# style -> (render(source BGR, edges) -> BGR, needs the source photo)
+LOCAL_STYLES = {
+    "watercolor": (_watercolor, True),
+    "pencil": (_pencil, True),
+    "color_pencil": (_color_pencil, True),
+    "detail": (_detail, True),
+    "cartoon": (_cartoon, True),
+    "ink": (_ink, False),
+}
+LOCAL_MODEL_IDS = tuple(LOCAL_MODEL_PREFIX + style for style in LOCAL_STYLES)
+
+def is_local_model(model_id: Optional[str]) -> bool:
+    return bool(model_id) and model_id.startswith(LOCAL_MODEL_PREFIX)
+
+def render_local_style(style: str, edge_map: Layer, source_image: Optional[Layer] = None,
+                       max_side: int = DEFAULT_LOCAL_MAX_SIDE) -> bytes:
+    """
+    Renders one of LOCAL_STYLES with OpenCV's non-photorealistic filters and returns PNG
+    bytes. Deterministic, CPU-only and picklable, so it can run in the process pool.
+    Photo-based styles fall back to the edge map when there is no source image.
+    """
+    if style not in LOCAL_STYLES:
+        raise ValueError(f"Unknown local style: {style}. Use one of {', '.join(LOCAL_STYLES)}.")
+    render, needs_source = LOCAL_STYLES[style]
+
+    with timed("local_stylize"):
+        return _render(render, needs_source, edge_map, source_image, max_side)
+
+def _render(render, needs_source: bool, edge_map: Layer, source_image: Optional[Layer], max_side: int) -> bytes:
+    edge_bytes = _read_layer(edge_map)
+    if needs_source and source_image is not None:
+        img = decode_reduced(_read_layer(source_image), max_side)
+    else:
+        # The edge map stands in for the photo: dark lines on white
+        img = cv2.cvtColor(255 - decode_reduced(edge_bytes, max_side, grayscale=True), cv2.COLOR_GRAY2BGR)
+    edges = _edges_like(edge_bytes, img.shape)
+    return encode_png(render(img, edges))
+
+class Stylizer:
+    """
+    A stylization backend: turns a job's edge map (and, for some backends, the source
+    photo) into the stylized image. `stylize` returns encoded image bytes, or, for a
+    backend that streams its output to disk, `destination` once the image is there.
+
+    Backends whose work outlives the process (a Replicate prediction) are `resumable`:
+    `stylize` reports a handle through `on_started` as soon as the work exists, and
+    `resume(handle)` finishes it after a restart. Other backends simply run again.
+    """
+    needs_source_image = False
+    resumable = False
+
+    async def stylize(self, edge_map: Layer, prompt: str, source_image: Optional[Layer] = None,
+                      on_started: Optional[OnStarted] = None, destination: Optional[Path] = None) -> Layer:
+        raise NotImplementedError
+
+    async def resume(self, handle: str, destination: Optional[Path] = None) -> Layer:
+        raise NotImplementedError(f"{type(self).__name__} cannot resume interrupted work")
+
+class ReplicateStylizer(Stylizer):
+    """
+    ControlNet on Replicate through the async client, then streams the output to
+    `destination` (required; the image is never held in memory) and returns that path.
+    Resumable: the handle is the prediction id.
+    """
+    resumable = True
+
+    def __init__(self, model_id: Optional[str] = None):
+        self.model_id = replicate_client.resolve_model_id(model_id)
+
+    async def stylize(self, edge_map: Layer, prompt: str, source_image: Optional[Layer] = None,
+                      on_started: Optional[OnStarted] = None, destination: Optional[Path] = None) -> Layer:
+        _check_destination(destination)  # Before paying for a prediction
+        in_memory = isinstance(edge_map, (bytes, bytearray))
+        stylized_url = await replicate_client.stylize_image_async(
+            edge_map_path=None if in_memory else str(edge_map),
+            prompt=prompt,
+            model_id=self.model_id,
+            edge_map_bytes=bytes(edge_map) if in_memory else None,
+            on_prediction=on_started,
+        )
+        return await self._download(stylized_url, destination)
+
+    async def resume(self, handle: str, destination: Optional[Path] = None) -> Layer:
+        _check_destination(destination)
+        return await self._download(await replicate_client.resume_stylization_async(handle), destination)
+
+    async def _download(self, stylized_url: str, destination: Optional[Path]) -> Layer:
+        if not stylized_url:
+            raise ValueError("Replicate did not return a URL.")
+
+        with timed("replicate_download"):
+            await replicate_client.get_async_client().download_output(stylized_url, destination)
+        return Path(destination)
+
+def _check_destination(destination: Optional[Path]):
+    if destination is None:
+        raise ValueError("ReplicateStylizer streams its output to a file: pass a destination.")
+
+class LocalStylizer(Stylizer):
+    """
+    Classical NPR filters from OpenCV, run in the CPU pool. Sub-second at the default
+    size, free, and deterministic, which also makes it the offline backend for load tests.
+    """
+
+    def __init__(self, style: str, executor, max_side: int = DEFAULT_LOCAL_MAX_SIDE, max_attempts: int = 30):
+        if style not in LOCAL_STYLES:
+            raise ValueError(f"Unknown local style: {style}. Use one of {', '.join(LOCAL_STYLES)}.")
+        self.style = style
+        self.executor = executor
+        self.max_side = max_side
+        self.max_attempts = max_attempts
+        self.needs_source_image = LOCAL_STYLES[style][1]
+
+    async def stylize(self, edge_map: Layer, prompt: str, source_image: Optional[Layer] = None,
+                      on_started: Optional[OnStarted] = None, destination: Optional[Path] = None) -> Layer:
+        # Unlike an upload, a running job cannot be answered with 503: wait for room in the pool
+        for attempt in range(self.max_attempts):
+            try:
+                return await self.executor.run(render_local_style, self.style, edge_map, source_image, self.max_side)
+            except ExecutorSaturated as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+def get_stylizer(model_id: Optional[str], executor) -> Stylizer:
+    """The backend for a model id: "local/<style>" runs locally, anything else on Replicate."""
+    model_id = replicate_client.resolve_model_id(model_id)
+    if is_local_model(model_id):
+        return LocalStylizer(
+            model_id[len(LOCAL_MODEL_PREFIX):], executor,
+            max_side=int(os.getenv("LOCAL_STYLIZE_MAX_SIDE", DEFAULT_LOCAL_MAX_SIDE)),
+        )
+    return ReplicateStylizer(model_id)
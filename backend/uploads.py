@@ -0,0 +1,174 @@
+import io
+import json
+import zipfile
+from pathlib import PurePosixPath
+from typing import Optional
+from fastapi import HTTPException, UploadFile
+
+# Read uploads in 256 KB chunks so an oversized file is refused after at most one extra chunk
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# Room for multipart boundaries, headers and the small form fields next to the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Identifies an image from its first bytes. Returns a MIME type, or None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    # ISO-BMFF: box size, then "ftyp" and the major brand
+    if len(head) >= 12 and head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"heim", b"heis", b"mif1", b"msf1"):
+        return "image/heic"
+    if len(head) >= 12 and head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+ZIP_CONTENT_TYPE = "application/zip"
+
+def sniff_upload_type(head: bytes) -> Optional[str]:
+    """Like sniff_image_type, but also recognizes ZIP archives (batch uploads)."""
+    if head.startswith(b"PK\x03\x04"):
+        return ZIP_CONTENT_TYPE
+    return sniff_image_type(head)
+
+async def read_upload_limited(file: UploadFile, max_bytes: int, allowed_types: set[str]) -> tuple[bytearray, str]:
+    """
+    Reads an upload chunk by chunk into one preallocated buffer.
+
+    Raises 413 as soon as the data passes `max_bytes`, and 415 unless the magic bytes
+    match one of `allowed_types` (the client's content_type is not trusted). Returns the
+    bytes and the sniffed MIME type. The buffer is a bytearray so np.frombuffer /
+    cv2.imdecode can use it without another copy.
+    """
+    expected = file.size if file.size is not None and file.size <= max_bytes else 0
+    buffer = bytearray(expected)
+    view = memoryview(buffer)
+    received = 0
+    sniffed = None
+
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if received + len(chunk) > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large: more than {max_bytes / (1024*1024):.0f} MB. Maximum size is {max_bytes / (1024*1024):.0f} MB.",
+            )
+        if received + len(chunk) <= len(buffer):
+            view[received:received + len(chunk)] = chunk
+        else:
+            view.release()
+            del buffer[received:]
+            buffer += chunk
+            view = memoryview(buffer)
+        received += len(chunk)
+
+        if sniffed is None and received >= 12:
+            sniffed = sniff_upload_type(bytes(view[:12]))
+            if sniffed not in allowed_types:
+                raise HTTPException(
+                    status_code=415,
+                    detail=f"Unsupported file type: {sniffed or file.content_type}. Allowed: {', '.join(sorted(allowed_types))}",
+                )
+
+    view.release()
+    if sniffed is None:
+        raise HTTPException(status_code=415, detail="Unsupported file type: not a recognizable image.")
+    del buffer[received:]  # Only matters if the declared size was larger than the data
+    return buffer, sniffed
+
+def extract_zip_images(data: bytes, max_member_bytes: int, max_images: int,
+                       allowed_types: set[str]) -> list[tuple[str, bytes]]:
+    """
+    Reads the images out of an uploaded ZIP archive, in archive order.
+
+    Directories, hidden files, macOS resource forks and entries whose magic bytes are not
+    one of `allowed_types` are skipped. Raises 413 if an image is larger than
+    `max_member_bytes` (enforced while decompressing, since headers can lie) or there are
+    more than `max_images` of them, and 400 if the archive is unreadable or has no images.
+    Returns (filename, bytes) pairs; filenames are the entries' base names.
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid ZIP archive.")
+
+    images = []
+    with archive:
+        for info in archive.infolist():
+            name = PurePosixPath(info.filename)
+            if info.is_dir() or name.name.startswith(".") or "__MACOSX" in name.parts:
+                continue
+            if info.file_size > max_member_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"{name.name} is larger than {max_member_bytes / (1024*1024):.0f} MB.",
+                )
+            try:
+                with archive.open(info) as member:
+                    content = member.read(max_member_bytes + 1)
+            except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:  # Corrupt, encrypted or unsupported
+                raise HTTPException(status_code=400, detail=f"Cannot read {name.name} from ZIP archive: {e}")
+            if len(content) > max_member_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"{name.name} is larger than {max_member_bytes / (1024*1024):.0f} MB.",
+                )
+            if sniff_image_type(content[:12]) not in allowed_types:
+                continue
+            if len(images) == max_images:
+                raise HTTPException(status_code=413, detail=f"Too many images: at most {max_images} per batch.")
+            images.append((name.name, content))
+
+    if not images:
+        raise HTTPException(status_code=400, detail="ZIP archive contains no supported images.")
+    return images
+
+class MaxBodySizeMiddleware:
+    """
+    Pure ASGI middleware that caps request bodies on upload routes.
+
+    A declared Content-Length above the limit is refused before anything is read.
+    Chunked or lying clients are cut off with 413 as soon as the streamed body
+    passes the limit, so the multipart parser never buffers more than that.
+    """
+
+    def __init__(self, app, max_body_size: int, path_prefixes: tuple[str, ...]):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.path_prefixes = path_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # FastAPI re-raises HTTPException from body parsing, so this becomes a 413
+                    raise HTTPException(status_code=413, detail="Request body too large.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Request body too large."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
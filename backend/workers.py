@@ -0,0 +1,97 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+from . import metrics
+
+class ExecutorSaturated(Exception):
+    """Raised when the CPU pool already has as much work queued as it may hold."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"CPU worker pool is saturated. Retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+class BoundedExecutor:
+    """
+    Runs CPU-bound pipeline steps (Canny, layer merging, GIF/ZIP) off the event loop.
+
+    Wraps a process or thread pool and caps the work it accepts: at most
+    `max_workers` tasks run and `max_queue` wait. Anything beyond that is rejected
+    with ExecutorSaturated so the API can answer 503 instead of piling up requests.
+    """
+
+    def __init__(self, kind: str = "process", max_workers: Optional[int] = None,
+                 max_queue: Optional[int] = None, retry_after: int = 2):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown executor kind: {kind}. Use 'process' or 'thread'.")
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue if max_queue is not None else 2 * self.max_workers
+        self.retry_after = retry_after
+        self._pool: Optional[Executor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Tasks currently running or waiting in the pool."""
+        return self._pending
+
+    def _get_pool(self) -> Executor:
+        # Created on first use so importing the app does not spawn workers
+        if self._pool is None:
+            if self.kind == "process":
+                # spawn: forking a process that already runs threads (event loop, OpenCV) is unsafe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sketchsplit-cpu")
+        return self._pool
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) in the pool and awaits its result. Stage timings taken
+        inside fn (metrics.timed) come back with the result and are recorded here.
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise ExecutorSaturated(self.retry_after)
+            self._pending += 1
+        try:
+            future = self._get_pool().submit(functools.partial(metrics.call_collecting, fn, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        # Release the slot when the work finishes, even if the awaiting request was cancelled
+        future.add_done_callback(self._release)
+        result, observations = await asyncio.wrap_future(future)
+        metrics.record_observations(observations)
+        return result
+
+    def shutdown(self, wait: bool = True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+def create_executor() -> BoundedExecutor:
+    """
+    Builds the CPU executor from PREPROCESS_EXECUTOR (process|thread),
+    PREPROCESS_WORKERS, PREPROCESS_MAX_QUEUE and PREPROCESS_RETRY_AFTER_SECONDS.
+    """
+    workers = os.getenv("PREPROCESS_WORKERS")
+    max_queue = os.getenv("PREPROCESS_MAX_QUEUE")
+    return BoundedExecutor(
+        kind=os.getenv("PREPROCESS_EXECUTOR", "process"),
+        max_workers=int(workers) if workers else None,
+        max_queue=int(max_queue) if max_queue else None,
+        retry_after=int(os.getenv("PREPROCESS_RETRY_AFTER_SECONDS", "2")),
+    )
@@ -42,9 +42,10 @@ export default function Home() {
       
       const data = await response.json();
       
-      // Store the job ID and edge path for status checking
+      // Store the job ID and edge path for status checking; the WebP thumbnail is a
+      // fraction of the full-size PNG, so the preview shows up right away
       setJobId(data.job_id);
-      setEdgePath(data.edge_path);
+      setEdgePath(data.edge_previews?.['1024'] ?? data.edge_path);
       
       // Move to processing state
       setAppState(AppState.PROCESSING);
@@ -14,15 +14,53 @@ interface JobStatus {
   edge_map_path: string | null;
   stylized_image_path: string | null;
   error_message: string | null;
+  queue_position?: number | null;
+  eta_seconds?: number | null;
 }
 
 export function StatusChecker({ jobId, onComplete, edgePath }: StatusCheckerProps) {
   const [status, setStatus] = useState<string>('processing');
   const [error, setError] = useState<string | null>(null);
   const [stylizedPath, setStylizedPath] = useState<string | null>(null);
+  const [queue, setQueue] = useState<{ position: number; eta: number | null } | null>(null);
   
   useEffect(() => {
-    let interval: NodeJS.Timeout;
+    let interval: NodeJS.Timeout | undefined;
+    let events: EventSource | undefined;
+    let finished = false;
+
+    const stop = () => {
+      finished = true;
+      events?.close();
+      clearInterval(interval);
+    };
+
+    const handleStatus = (data: JobStatus) => {
+      setStatus(data.status);
+      // Waiting for a stylization slot behind other jobs
+      setQueue(data.queue_position != null ? { position: data.queue_position, eta: data.eta_seconds ?? null } : null);
+      
+      if (data.error_message) {
+        setError(data.error_message);
+      }
+      
+      if (data.stylized_image_path) {
+        setStylizedPath(data.stylized_image_path);
+      }
+      
+      if (data.status === 'complete' && data.edge_map_path && data.stylized_image_path) {
+        onComplete(
+          `${API_URL}/${data.edge_map_path}`, 
+          `${API_URL}/${data.stylized_image_path}`,
+          data.job_id
+        );
+        stop();
+      }
+      
+      if (data.status === 'failed' || data.status === 'expired') {
+        stop();
+      }
+    };
     
     const checkStatus = async () => {
       try {
@@ -32,42 +70,39 @@ export function StatusChecker({ jobId, onComplete, edgePath }: StatusCheckerProp
           throw new Error(`Server returned ${response.status}: ${response.statusText}`);
         }
         
-        const data: JobStatus = await response.json();
-        setStatus(data.status);
-        
-        if (data.error_message) {
-          setError(data.error_message);
-        }
-        
-        if (data.stylized_image_path) {
-          setStylizedPath(data.stylized_image_path);
-        }
-        
-        if (data.status === 'complete' && data.edge_map_path && data.stylized_image_path) {
-          onComplete(
-            `${API_URL}/${data.edge_map_path}`, 
-            `${API_URL}/${data.stylized_image_path}`,
-            data.job_id
-          );
-          clearInterval(interval);
-        }
-        
-        if (data.status === 'failed') {
-          clearInterval(interval);
-        }
+        handleStatus(await response.json());
       } catch (err) {
         console.error('Error checking status:', err);
         setError(err instanceof Error ? err.message : 'Unknown error occurred');
       }
     };
+
+    const startPolling = () => {
+      // Initial check
+      checkStatus();
+      
+      // Set up polling every 2 seconds
+      interval = setInterval(checkStatus, 2000);
+    };
     
-    // Initial check
-    checkStatus();
-    
-    // Set up polling every 2 seconds
-    interval = setInterval(checkStatus, 2000);
+    if (typeof EventSource !== 'undefined') {
+      // The server pushes every status change; fall back to polling if the stream fails
+      events = new EventSource(`${API_URL}/status/${jobId}/events`);
+      events.addEventListener('status', (event) => {
+        handleStatus(JSON.parse((event as MessageEvent).data));
+      });
+      events.onerror = () => {
+        if (finished) return;
+        events?.close();
+        startPolling();
+      };
+    } else {
+      startPolling();
+    }
     
     return () => {
+      finished = true;
+      events?.close();
       clearInterval(interval);
     };
   }, [jobId, onComplete]);
@@ -82,6 +117,7 @@ export function StatusChecker({ jobId, onComplete, edgePath }: StatusCheckerProp
     processing_replicate: 'AI is stylizing your image (this may take 10-15 seconds)...',
     complete: 'Processing complete!',
     failed: 'Processing failed. Please try again.',
+    expired: 'These results have expired. Please upload your image again.',
   };
   
   const statusMessage = statusMessages[status as keyof typeof statusMessages] || 'Processing your image...';
@@ -94,6 +130,13 @@ export function StatusChecker({ jobId, onComplete, edgePath }: StatusCheckerProp
         </h3>
         
         <p className="text-gray-600 mb-4">{statusMessage}</p>
+
+        {queue && (
+          <p className="text-sm text-gray-500 mb-4">
+            {queue.position === 0 ? 'You are next in line' : `${queue.position} job(s) ahead of yours`}
+            {queue.eta != null && ` (about ${Math.ceil(queue.eta)}s)`}
+          </p>
+        )}
         
         {error && (
           <div className="bg-red-50 border border-red-200 text-red-700 px-4 py-3 rounded-md mb-4">
@@ -101,7 +144,7 @@ export function StatusChecker({ jobId, onComplete, edgePath }: StatusCheckerProp
           </div>
         )}
         
-        {status !== 'complete' && status !== 'failed' && (
+        {status !== 'complete' && status !== 'failed' && status !== 'expired' && (
           <div className="relative h-2 bg-gray-200 rounded-full overflow-hidden">
             <div className="absolute top-0 left-0 h-full w-full bg-blue-500 rounded-full animate-pulse"></div>
           </div>
@@ -0,0 +1,162 @@
+"""
+Benchmarks for composer.
+
+alpha:  ensure_rgba_and_transparent_background, vectorized vs the original
+        per-pixel loop, on 1 MP, 12 MP and 48 MP synthetic Canny edge maps.
+bundle: the download ZIP, streamed (STORED PNG/GIF) vs the original
+        ZIP_DEFLATED archive written to disk before sending. Reports time to
+        first byte and CPU time.
+preview: the animated preview of a job (12 MP edge map, 1024x768 stylized and
+        composite), the original path (re-read each layer from disk, full size,
+        one palette per frame) vs build_preview from the in-memory layers as
+        GIF, WebP and MP4. Reports time and output size.
+
+Run from the repo root:
+
+    python tests/bench_composer.py [alpha|bundle|preview] [--max-legacy-mp 12]
+
+The legacy loop is slow (tens of seconds at 12 MP), so it is skipped above
+--max-legacy-mp megapixels.
+"""
+import argparse
+import json
+import os
+import zipfile
+import sys
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from PIL import Image
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.composer import ensure_rgba_and_transparent_background, stream_zip_bundle, build_preview, compose_layers
+from test_composer import reference_rgba
+
+SIZES = {
+    "1MP": (1000, 1000),
+    "12MP": (4000, 3000),
+    "48MP": (8000, 6000),
+}
+
+def make_edge_map(path: Path, width: int, height: int):
+    """Sparse white lines on black, roughly the density Canny gives on a photo."""
+    rng = np.random.default_rng(0)
+    edges = np.zeros((height, width), dtype=np.uint8)
+    edges[rng.random((height, width)) < 0.05] = 255
+    Image.fromarray(edges, "L").save(path)
+
+def time_call(fn, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+def deflate_bundle_to_disk(job_id: str, files_to_zip: dict, output_zip_path: Path):
+    """The original create_zip_bundle: everything ZIP_DEFLATED, written out before sending."""
+    with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for arcname, file_path in files_to_zip.items():
+            zf.write(file_path, arcname=arcname)
+        zf.writestr("steps.json", json.dumps({"job_id": job_id, "files_included": list(files_to_zip)}, indent=2))
+    with open(output_zip_path, "rb") as f:
+        while f.read(256 * 1024):
+            pass
+
+def bench_alpha(tmp: str, max_legacy_mp: float):
+    print(f"{'size':>6} {'vectorized_s':>13} {'legacy_s':>10} {'speedup':>9}")
+    for label, (width, height) in SIZES.items():
+        path = Path(tmp) / f"edge_{label}.png"
+        make_edge_map(path, width, height)
+
+        vectorized = time_call(ensure_rgba_and_transparent_background, path, background_color_value=0)
+        if width * height / 1e6 <= max_legacy_mp:
+            legacy = time_call(reference_rgba, path, background_color_value=0)
+            print(f"{label:>6} {vectorized:>13.3f} {legacy:>10.3f} {legacy / vectorized:>8.1f}x")
+        else:
+            print(f"{label:>6} {vectorized:>13.3f} {'skipped':>10} {'-':>9}")
+
+def bench_bundle(tmp: str):
+    # Three 12 MP layers, roughly what a phone photo job bundles
+    rng = np.random.default_rng(0)
+    files = {}
+    for name in ("01_edge_map.png", "02_stylized.png", "03_composite.png"):
+        path = Path(tmp) / name
+        Image.fromarray(rng.integers(0, 256, (3000, 4000, 3), dtype=np.uint8)).save(path, compress_level=1)
+        files[name] = path
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    deflate_bundle_to_disk("bench", files, Path(tmp) / "bundle.zip")
+    legacy_wall, legacy_cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    stream = stream_zip_bundle("bench", files)
+    next(stream)
+    ttfb = time.perf_counter() - start_wall
+    for _ in stream:
+        pass
+    stream_wall, stream_cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+    total_mb = sum(p.stat().st_size for p in files.values()) / 1e6
+    print(f"bundle of {total_mb:.0f} MB of PNG layers")
+    print(f"{'path':>10} {'ttfb_s':>8} {'total_s':>8} {'cpu_s':>7}")
+    print(f"{'deflate':>10} {legacy_wall:>8.3f} {legacy_wall:>8.3f} {legacy_cpu:>7.3f}")
+    print(f"{'streamed':>10} {ttfb:>8.4f} {stream_wall:>8.3f} {stream_cpu:>7.3f}")
+
+def legacy_gif_preview(layer_paths: list, output_gif_path: Path, duration_ms: int = 400):
+    """
+    The original create_gif_preview: every layer re-read from disk at full size, and
+    each frame palette-quantized on its own by the GIF writer. Mismatched sizes made it
+    fail outright, so frames are resized to the composite's (last frame's) size here.
+    """
+    frames = [Image.open(p).convert("RGB") for p in layer_paths]
+    frames = [f if f.size == frames[-1].size else f.resize(frames[-1].size) for f in frames]
+    frames[0].save(output_gif_path, save_all=True, append_images=frames[1:], duration=duration_ms, loop=0)
+
+def bench_preview(tmp: str):
+    edge_path = Path(tmp) / "edge_preview.png"
+    make_edge_map(edge_path, 4000, 3000)
+    # A smooth "stylized" image: gradients plus low-frequency noise
+    rng = np.random.default_rng(1)
+    y, x = np.mgrid[0:768, 0:1024]
+    noise = np.kron(rng.integers(0, 40, (24, 32)), np.ones((32, 32)))
+    stylized = np.stack([(x / 4 + noise) % 256, (y / 3 + noise) % 256, (x + y) / 7 % 256], axis=-1).astype(np.uint8)
+    stylized_path = Path(tmp) / "stylized_preview.png"
+    Image.fromarray(stylized).save(stylized_path)
+    composite_path = Path(tmp) / "composite_preview.png"
+    composite = compose_layers(Image.open(stylized_path), edge_path)
+    composite.save(composite_path)
+    paths = [edge_path, stylized_path, composite_path]
+
+    results = {}
+    out = Path(tmp) / "legacy.gif"
+    results["legacy gif"] = (time_call(legacy_gif_preview, paths, out), out.stat().st_size)
+
+    edge_img, stylized_img = Image.open(edge_path), Image.open(stylized_path)
+    edge_img.load()
+    stylized_img.load()
+    for fmt in ("gif", "webp", "mp4"):
+        out = Path(tmp) / f"preview.{fmt}"
+        elapsed = time_call(build_preview, [edge_img, stylized_img, composite], out)
+        results[f"in-memory {fmt}"] = (elapsed, out.stat().st_size if out.exists() else None)
+
+    print(f"{'path':>14} {'time_s':>8} {'size_kb':>9}")
+    for name, (elapsed, size) in results.items():
+        print(f"{name:>14} {elapsed:>8.3f} {size / 1024 if size else float('nan'):>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("which", nargs="?", choices=("alpha", "bundle", "preview", "all"), default="all")
+    parser.add_argument("--max-legacy-mp", type=float, default=12, help="Skip the per-pixel loop above this size")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.which in ("alpha", "all"):
+            bench_alpha(tmp, args.max_legacy_mp)
+        if args.which in ("bundle", "all"):
+            bench_bundle(tmp)
+        if args.which in ("preview", "all"):
+            bench_preview(tmp)
+
+if __name__ == "__main__":
+    main()
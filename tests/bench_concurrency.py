@@ -0,0 +1,118 @@
+"""
+Latency benchmark for concurrent uploads.
+
+Starts the API with uvicorn in a subprocess, fires --uploads concurrent
+/stylize requests with a large photo-like JPEG, and polls /health the whole
+time. Prints p50/p99 latency for both, which shows whether preprocessing
+blocks the event loop. Run from the repo root:
+
+    python tests/bench_concurrency.py [--uploads 16] [--app-dir .]
+
+Point --app-dir at another checkout (e.g. a git worktree) to compare revisions.
+Without REPLICATE_API_TOKEN the background stylization step fails fast, so the
+numbers isolate the upload/preprocessing path.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import httpx
+import numpy as np
+
+def make_photo_jpeg(width: int, height: int) -> bytes:
+    """Noisy gradients so Canny has real work to do and the JPEG stays under the upload limit."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = (x + y) / 2
+    img = np.dstack([base, 255 - base, np.roll(base, width // 3, axis=1)])
+    img += rng.normal(0, 25, img.shape).astype(np.float32)
+    ok, buf = cv2.imencode(".jpg", np.clip(img, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return buf.tobytes()
+
+def percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_until_up(client: httpx.AsyncClient, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API did not come up in time")
+
+async def run_load(base_url: str, image: bytes, uploads: int):
+    stylize_latencies, health_latencies, statuses = [], [], []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300.0) as client:
+        await wait_until_up(client)
+
+        async def upload(i: int):
+            start = time.perf_counter()
+            response = await client.post("/stylize", files={"file": (f"photo_{i}.jpg", image, "image/jpeg")})
+            stylize_latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+        async def poll_health():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/health")
+                health_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.01)
+
+        poller = asyncio.create_task(poll_health())
+        started = time.perf_counter()
+        await asyncio.gather(*(upload(i) for i in range(uploads)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await poller
+
+    return stylize_latencies, health_latencies, statuses, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--app-dir", default=".", help="Checkout whose backend.app is benchmarked")
+    args = parser.parse_args()
+
+    image = make_photo_jpeg(args.width, args.height)
+    port = free_port()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, JOB_STORE_URL=f"sqlite:///{tmp}/jobs.db", REPLICATE_API_TOKEN="")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.app:app", "--port", str(port), "--log-level", "warning"],
+            cwd=os.path.abspath(args.app_dir), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            stylize, health, statuses, elapsed = asyncio.run(run_load(f"http://127.0.0.1:{port}", image, args.uploads))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{args.uploads} concurrent uploads of {len(image) / 1e6:.1f} MB ({args.width}x{args.height}) in {elapsed:.2f}s")
+    print(f"status codes: { {code: statuses.count(code) for code in sorted(set(statuses))} }")
+    print(f"/stylize  p50={percentile(stylize, 50) * 1000:8.1f} ms  p99={percentile(stylize, 99) * 1000:8.1f} ms")
+    print(f"/health   p50={percentile(health, 50) * 1000:8.1f} ms  p99={percentile(health, 99) * 1000:8.1f} ms  (n={len(health)})")
+
+if __name__ == "__main__":
+    main()
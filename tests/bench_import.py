@@ -0,0 +1,75 @@
+"""
+Import-time benchmark of the API process (cold start before uvicorn can serve /health).
+
+Runs `python -X importtime -c "import backend.app"` --repeat times, each in a fresh
+process, and reports the median cumulative import time of backend.app, the slowest
+modules under it (cumulative, from the median run) and any heavy module that the
+import pulled in although it should load lazily (cv2, numpy, PIL, imageio, replicate).
+
+Run from the repo root:
+
+    python tests/bench_import.py [--repeat 5] [--top 15] [--budget-ms 600]
+
+Exits with status 1 if the median is over --budget-ms or a lazy module was imported.
+The budget leaves room above FastAPI's own import time, which is most of what is left.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Imported by the warm-up after startup, never by `import backend.app`
+LAZY_MODULES = ("cv2", "numpy", "PIL", "imageio", "imageio_ffmpeg", "replicate")
+DEFAULT_BUDGET_MS = 600
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def measure_once() -> dict[str, int]:
+    """Module -> cumulative import time in us, for one cold `import backend.app`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.app"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+        env=dict(os.environ, JOB_STORE_URL="memory://", PREPROCESS_EXECUTOR="thread"),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import backend.app failed:\n{result.stderr}")
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2))
+    return cumulative
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    args = parser.parse_args()
+
+    runs = sorted((measure_once() for _ in range(args.repeat)), key=lambda run: run["backend.app"])
+    median_run = runs[len(runs) // 2]
+    median_ms = statistics.median(run["backend.app"] for run in runs) / 1000
+
+    print(f"import backend.app: median {median_ms:.0f} ms, best {runs[0]['backend.app'] / 1000:.0f} ms "
+          f"({args.repeat} cold runs, budget {args.budget_ms:.0f} ms)")
+    print(f"{'module':<40} {'cumulative ms':>14}")
+    for name, us in sorted(median_run.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<40} {us / 1000:>14.1f}")
+
+    eager = sorted({name for run in runs for name in run if name.split(".")[0] in LAZY_MODULES})
+    failed = False
+    if eager:
+        print(f"Imported eagerly, should be lazy: {', '.join(eager)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"Over budget: {median_ms:.0f} ms > {args.budget_ms:.0f} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("Within budget")
+
+if __name__ == "__main__":
+    main()
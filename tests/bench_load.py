@@ -0,0 +1,304 @@
+"""
+Load test: concurrent /stylize -> /status -> /download flows against a fake Replicate.
+
+Starts tests/fake_replicate.py (--latency, --error-rate) and the API with uvicorn,
+each in a subprocess, then runs --flows end-to-end flows with at most --concurrency
+at once. Every flow uploads a distinct photo (so the result cache never answers),
+polls /status until the job is final and streams the download bundle.
+
+Reported:
+- throughput (flows/s and HTTP requests/s) and p50/p95/p99 latency per endpoint and end to end
+- server CPU time and peak RSS (API process plus its CPU-pool workers, sampled from /proc)
+- per-stage time from the server's /metrics histograms (decode, canny, replicate_*, merge, ...)
+
+Run from the repo root (Linux only):
+
+    python tests/bench_load.py [--flows 40] [--concurrency 8] [--latency 0.5] [--error-rate 0.05]
+
+--json writes the summary for comparing runs; --app-dir benchmarks another checkout.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import cv2
+import httpx
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_concurrency import free_port, percentile
+
+FINAL_STATUSES = ("complete", "failed")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+
+def make_photos(count: int, width: int, height: int) -> list[bytes]:
+    """One base photo (gradients and shapes), with a per-flow mark so no two uploads are identical."""
+    rng = np.random.default_rng(0)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = np.linspace(30, 220, width, dtype=np.uint8)[None, :, None]
+    for _ in range(60):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = [int(c) for c in rng.integers(0, 256, 3)]
+        cv2.circle(img, center, int(rng.integers(width // 50, width // 8)), color, -1)
+    photos = []
+    for i in range(count):
+        marked = img.copy()
+        cv2.putText(marked, f"#{i}", (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+        ok, buf = cv2.imencode(".jpg", marked, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        photos.append(buf.tobytes())
+    return photos
+
+# --- Server resource sampling (/proc) ---
+def _process_tree(root_pid: int) -> list[int]:
+    """root_pid and its descendants (CPU-pool workers are children of the API process)."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree, frontier = [root_pid], [root_pid]
+    while frontier:
+        children = [pid for pid, ppid in parents.items() if ppid in frontier]
+        tree += children
+        frontier = children
+    return tree
+
+def _cpu_and_rss(pids: list[int]) -> tuple[float, float]:
+    """(CPU seconds, RSS in MB) summed over pids."""
+    cpu, rss_pages = 0.0, 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{pid}/statm") as f:
+                rss_pages += int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue  # Worker exited between listing and reading
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+    return cpu, rss_pages * PAGE_KB / 1024
+
+class ResourceSampler(threading.Thread):
+    """Samples the server's CPU time and RSS every `interval` seconds while the load runs."""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self.cpu_start = self.cpu_end = 0.0
+        self._done = threading.Event()
+
+    def run(self):
+        # Workers come and go, so CPU is taken from the whole tree at start and end only
+        self.cpu_start, rss = _cpu_and_rss(_process_tree(self.pid))
+        self.peak_rss_mb = rss
+        while not self._done.wait(self.interval):
+            _, rss = _cpu_and_rss(_process_tree(self.pid))
+            self.peak_rss_mb = max(self.peak_rss_mb, rss)
+        self.cpu_end, rss = _cpu_and_rss(_process_tree(self.pid))
+        self.peak_rss_mb = max(self.peak_rss_mb, rss)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+# --- Load ---
+async def wait_until_up(client: httpx.AsyncClient, path: str = "/ready", timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(path)).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{client.base_url} did not come up in time")
+
+async def run_flow(client: httpx.AsyncClient, photo: bytes, i: int, poll_interval: float, stats: dict):
+    def record(endpoint: str, started: float, status_code: int):
+        stats["latency"].setdefault(endpoint, []).append(time.perf_counter() - started)
+        stats["codes"].setdefault(endpoint, {}).setdefault(status_code, 0)
+        stats["codes"][endpoint][status_code] += 1
+
+    flow_started = time.perf_counter()
+    while True:
+        started = time.perf_counter()
+        response = await client.post("/stylize", files={"file": (f"photo_{i}.jpg", photo, "image/jpeg")})
+        record("/stylize", started, response.status_code)
+        if response.status_code != 503:
+            break
+        await asyncio.sleep(float(response.headers.get("Retry-After", "1")))  # Backpressure: retry
+    if response.status_code != 200:
+        stats["outcomes"]["rejected"] = stats["outcomes"].get("rejected", 0) + 1
+        return
+    job_id = response.json()["job_id"]
+
+    while True:
+        started = time.perf_counter()
+        response = await client.get(f"/status/{job_id}")
+        record("/status", started, response.status_code)
+        status = response.json().get("status") if response.status_code == 200 else "failed"
+        if status in FINAL_STATUSES:
+            break
+        await asyncio.sleep(poll_interval)
+    stats["outcomes"][status] = stats["outcomes"].get(status, 0) + 1
+    if status != "complete":
+        return
+
+    while True:
+        # Artifacts not built yet are built on demand, which can also hit backpressure
+        started = time.perf_counter()
+        async with client.stream("GET", f"/download/{job_id}") as response:
+            if response.status_code == 200:
+                stats["download_ttfb"].append(time.perf_counter() - started)
+                async for chunk in response.aiter_bytes():
+                    stats["download_bytes"] += len(chunk)
+        record("/download", started, response.status_code)
+        if response.status_code != 503:
+            break
+        await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+    if response.status_code == 200:
+        stats["latency"].setdefault("end_to_end", []).append(time.perf_counter() - flow_started)
+
+async def run_load(base_url: str, photos: list[bytes], concurrency: int, poll_interval: float) -> tuple[dict, float]:
+    stats = {"latency": {}, "codes": {}, "outcomes": {}, "download_ttfb": [], "download_bytes": 0}
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=300.0, limits=limits) as client:
+        await wait_until_up(client)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def flow(i: int, photo: bytes):
+            async with semaphore:
+                await run_flow(client, photo, i, poll_interval, stats)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(flow(i, photo) for i, photo in enumerate(photos)))
+        elapsed = time.perf_counter() - started
+        stats["metrics"] = (await client.get("/metrics")).text
+    return stats, elapsed
+
+def parse_stage_metrics(text: str) -> dict[str, dict]:
+    """stage -> {"count", "sum_s"} from sketchsplit_stage_seconds in a /metrics scrape."""
+    stages: dict[str, dict] = {}
+    for kind, stage, value in re.findall(r'^sketchsplit_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', text, re.M):
+        stages.setdefault(stage, {})["sum_s" if kind == "sum" else "count"] = float(value)
+    return stages
+
+def summarize(stats: dict, elapsed: float, flows: int, sampler: ResourceSampler) -> dict:
+    requests = sum(len(samples) for endpoint, samples in stats["latency"].items() if endpoint != "end_to_end")
+    cpu_s = sampler.cpu_end - sampler.cpu_start
+    return {
+        "flows": flows,
+        "elapsed_s": elapsed,
+        "flows_per_s": flows / elapsed,
+        "requests_per_s": requests / elapsed,
+        "outcomes": stats["outcomes"],
+        "status_codes": {endpoint: {str(k): v for k, v in codes.items()} for endpoint, codes in stats["codes"].items()},
+        "latency_ms": {
+            endpoint: {f"p{pct}": percentile(samples, pct) * 1000 for pct in (50, 95, 99)} | {"n": len(samples)}
+            for endpoint, samples in stats["latency"].items() if samples
+        },
+        "download_ttfb_ms_p50": percentile(stats["download_ttfb"], 50) * 1000 if stats["download_ttfb"] else None,
+        "download_mb": stats["download_bytes"] / 1e6,
+        "server_cpu_s": cpu_s,
+        "server_cpu_pct": 100 * cpu_s / elapsed,
+        "server_peak_rss_mb": sampler.peak_rss_mb,
+        "stages": parse_stage_metrics(stats["metrics"]),
+    }
+
+def print_summary(summary: dict):
+    print(f"{summary['flows']} flows in {summary['elapsed_s']:.2f}s: "
+          f"{summary['flows_per_s']:.2f} flows/s, {summary['requests_per_s']:.1f} req/s, outcomes {summary['outcomes']}")
+    print(f"status codes: {summary['status_codes']}")
+    for endpoint, latency in summary["latency_ms"].items():
+        print(f"{endpoint:<11} p50={latency['p50']:8.1f} ms  p95={latency['p95']:8.1f} ms  "
+              f"p99={latency['p99']:8.1f} ms  (n={latency['n']})")
+    if summary["download_ttfb_ms_p50"] is not None:
+        print(f"download: {summary['download_mb']:.1f} MB, time to first byte p50={summary['download_ttfb_ms_p50']:.1f} ms")
+    print(f"server: {summary['server_cpu_s']:.2f} CPU s ({summary['server_cpu_pct']:.0f}% of one core), "
+          f"peak RSS {summary['server_peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<20} {'count':>6} {'mean ms':>9} {'total s':>8}")
+    for stage, values in sorted(summary["stages"].items(), key=lambda item: -item[1].get("sum_s", 0)):
+        count = values.get("count", 0)
+        mean_ms = 1000 * values.get("sum_s", 0) / count if count else 0
+        print(f"{stage:<20} {count:>6.0f} {mean_ms:>9.1f} {values.get('sum_s', 0):>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flows", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake prediction time in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake API calls answering 429/503")
+    parser.add_argument("--width", type=int, default=2000)
+    parser.add_argument("--height", type=int, default=1500)
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="Client /status poll interval")
+    parser.add_argument("--executor", choices=("process", "thread"), default="process")
+    parser.add_argument("--app-dir", default=".", help="Checkout whose backend.app is benchmarked")
+    parser.add_argument("--json", help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    photos = make_photos(args.flows, args.width, args.height)
+    fake_port, api_port = free_port(), free_port()
+    bench_dir = os.path.dirname(os.path.abspath(__file__))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fake = subprocess.Popen(
+            [sys.executable, os.path.join(bench_dir, "fake_replicate.py"), "--port", str(fake_port),
+             "--latency", str(args.latency), "--error-rate", str(args.error_rate)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        env = dict(
+            os.environ,
+            JOB_STORE_URL=f"sqlite:///{tmp}/jobs.db",
+            RESULT_CACHE_MAX_BYTES="0",  # Every flow does the full work
+            REPLICATE_API_TOKEN="bench-token",
+            REPLICATE_API_BASE_URL=f"http://127.0.0.1:{fake_port}/v1",
+            REPLICATE_POLL_INTERVAL=str(min(0.1, args.latency / 5 or 0.01)),
+            REPLICATE_WEBHOOK_URL="",
+            PREPROCESS_EXECUTOR=args.executor,
+            METRICS_ENABLED="1",
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.app:app", "--port", str(api_port), "--log-level", "warning"],
+            cwd=os.path.abspath(args.app_dir), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        sampler = ResourceSampler(server.pid)
+        try:
+            async def load():
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{fake_port}") as fake_client:
+                    await wait_until_up(fake_client, "/v1/predictions/missing")
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}") as api_client:
+                    await wait_until_up(api_client)
+                sampler.start()
+                return await run_load(f"http://127.0.0.1:{api_port}", photos, args.concurrency, args.poll_interval)
+
+            stats, elapsed = asyncio.run(load())
+            sampler.stop()
+        finally:
+            server.terminate()
+            fake.terminate()
+            server.wait()
+            fake.wait()
+
+    summary = summarize(stats, elapsed, args.flows, sampler)
+    print(f"{args.width}x{args.height} JPEG uploads, fake latency {args.latency}s, error rate {args.error_rate}, "
+          f"{args.executor} pool, concurrency {args.concurrency}")
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == "__main__":
+    main()
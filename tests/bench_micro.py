@@ -0,0 +1,165 @@
+"""
+Microbenchmarks for the pipeline's CPU-bound functions, for spotting regressions.
+
+canny_edge:         preprocess.canny_edge on a --width x --height JPEG (full mode)
+merge_layers:       composer.merge_layers of the stylized image and the edge map
+create_gif_preview: composer.create_gif_preview of edge map, stylized and composite
+create_zip_bundle:  composer.create_zip_bundle of those layers and the GIF
+
+Each function runs in a fresh process, --repeat times after one warm-up call.
+Reported per function: median and best wall time, median CPU time, and peak RSS
+above the RSS after the warm-up (VmHWM; Linux only).
+
+Run from the repo root:
+
+    python tests/bench_micro.py [--repeat 5] [--json results.json]
+    python tests/bench_micro.py --baseline results.json [--tolerance 0.25]
+
+With --baseline, exits with status 1 if any function's median wall time is more
+than --tolerance (a fraction) slower than in the baseline file.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from pathlib import Path
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.preprocess import canny_edge
+from backend.composer import merge_layers, create_gif_preview, create_zip_bundle
+
+def make_photo_jpeg(width: int, height: int) -> bytes:
+    """Gradients plus filled shapes, so Canny finds edges along the shapes."""
+    rng = np.random.default_rng(0)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = np.linspace(30, 220, width, dtype=np.uint8)[None, :, None]
+    for _ in range(80):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = [int(c) for c in rng.integers(0, 256, 3)]
+        cv2.circle(img, center, int(rng.integers(width // 50, width // 8)), color, -1)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buf.tobytes()
+
+def status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field + ":"))
+
+def reset_peak_rss():
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+def measure(fn, repeat: int) -> dict:
+    fn()  # Warm-up: imports, codec initialisation, page cache
+    reset_peak_rss()
+    baseline_kb = status_kb("VmRSS")
+    wall, cpu = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        fn()
+        wall.append(time.perf_counter() - wall_start)
+        cpu.append(time.process_time() - cpu_start)
+    return {
+        "median_s": statistics.median(wall),
+        "best_s": min(wall),
+        "cpu_median_s": statistics.median(cpu),
+        "peak_extra_mb": (status_kb("VmHWM") - baseline_kb) / 1024,
+    }
+
+def make_fixtures(width: int, height: int, work_dir: Path) -> dict:
+    """Photo, edge map, stylized image, composite and GIF on disk, shared by the cases."""
+    photo_path = work_dir / "photo.jpg"
+    photo_path.write_bytes(make_photo_jpeg(width, height))
+    edge_map_path = canny_edge(photo_path.read_bytes(), "bench.jpg").replace(work_dir / "edges.png")
+    # Stand-in for the model output: a smaller, coloured version of the edge map
+    edges = cv2.imread(str(edge_map_path), cv2.IMREAD_GRAYSCALE)
+    stylized = cv2.applyColorMap(cv2.resize(255 - edges, (1024, 768), interpolation=cv2.INTER_AREA), cv2.COLORMAP_BONE)
+    stylized_path = work_dir / "stylized.png"
+    cv2.imwrite(str(stylized_path), stylized)
+    composite_path = work_dir / "composite.png"
+    gif_path = work_dir / "preview.gif"
+    merge_layers(stylized_path, edge_map_path, composite_path)
+    create_gif_preview([edge_map_path, stylized_path, composite_path], gif_path)
+    return {"photo": photo_path, "edges": edge_map_path, "stylized": stylized_path,
+            "composite": composite_path, "gif": gif_path, "zip": work_dir / "bundle.zip"}
+
+def run_case(name: str, files: dict, repeat: int) -> dict:
+    """Runs one case; called in a fresh process so its peak RSS is its own."""
+    photo = files["photo"].read_bytes()
+    layers = [files["edges"], files["stylized"], files["composite"]]
+    cases = {
+        "canny_edge": lambda: canny_edge(photo, "bench.jpg").unlink(),
+        "merge_layers": lambda: merge_layers(files["stylized"], files["edges"], files["composite"]),
+        "create_gif_preview": lambda: create_gif_preview(layers, files["gif"]),
+        "create_zip_bundle": lambda: create_zip_bundle(
+            "bench", {"edges.png": files["edges"], "stylized.png": files["stylized"],
+                      "composite.png": files["composite"], "preview.gif": files["gif"]}, files["zip"],
+        ),
+    }
+    return measure(cases[name], repeat)
+
+CASES = ("canny_edge", "merge_layers", "create_gif_preview", "create_zip_bundle")
+
+def run_benchmarks(width: int, height: int, repeat: int, work_dir: Path) -> dict:
+    files = make_fixtures(width, height, work_dir)
+    results = {}
+    for name in CASES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results[name] = pool.submit(run_case, name, files, repeat).result()
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Functions whose median is more than `tolerance` slower than the baseline."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("results", baseline).get(name)
+        if before and result["median_s"] > before["median_s"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {result['median_s'] * 1000:.1f} ms vs {before['median_s'] * 1000:.1f} ms "
+                f"(+{100 * (result['median_s'] / before['median_s'] - 1):.0f}%)"
+            )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write the results to this file (usable as a --baseline)")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_benchmarks(args.width, args.height, args.repeat, Path(tmp))
+
+    print(f"{args.width}x{args.height} photo, {args.repeat} runs each")
+    print(f"{'function':<20} {'median ms':>10} {'best ms':>9} {'cpu ms':>8} {'peak MB':>8}")
+    for name, result in results.items():
+        print(f"{name:<20} {result['median_s'] * 1000:>10.1f} {result['best_s'] * 1000:>9.1f} "
+              f"{result['cpu_median_s'] * 1000:>8.1f} {result['peak_extra_mb']:>8.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"width": args.width, "height": args.height, "repeat": args.repeat, "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Slower than baseline by more than {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Memory/latency benchmark for preprocess.canny_edge modes on large photos.
+
+Each (size, mode) run happens in a fresh subprocess, and its peak RSS (VmHWM, reset
+right before the calls) only reflects canny_edge itself. Reported: best wall time of
+canny_edge, peak RSS above the baseline, and the edge map's resolution.
+
+Run from the repo root (Linux only):
+
+    python tests/bench_preprocess.py [--sizes 12 48] [--modes full reduced tiled] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKER = r"""
+import json, sys, time
+import cv2
+from backend.preprocess import canny_edge
+
+def status_kb(field):
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field + ":"))
+
+path, mode, target_size, repeat = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+with open(path, "rb") as f:
+    data = f.read()
+# Import-time spikes would hide the call's own peak: reset VmHWM to the current RSS
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")
+baseline_kb = status_kb("VmRSS")
+timings, edge_map_paths = [], []
+for _ in range(repeat):
+    started = time.perf_counter()
+    edge_map_paths.append(canny_edge(data, "bench.jpg", mode=mode, target_size=target_size))
+    timings.append(time.perf_counter() - started)
+peak_kb = status_kb("VmHWM")
+shape = cv2.imread(str(edge_map_paths[0]), cv2.IMREAD_GRAYSCALE).shape
+for edge_map_path in edge_map_paths:
+    edge_map_path.unlink()
+print(json.dumps({"best_s": min(timings), "extra_mb": (peak_kb - baseline_kb) / 1024, "shape": shape}))
+"""
+
+def make_photo_jpeg(megapixels: float, path: str):
+    """Smooth gradients plus filled shapes and mild noise, encoded as a quality-90 JPEG (3:2)."""
+    width = int((megapixels * 1e6 * 1.5) ** 0.5)
+    height = int(width / 1.5)
+    rng = np.random.default_rng(0)
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = np.linspace(30, 220, width, dtype=np.uint8)[None, :, None]
+    for _ in range(200):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        color = [int(c) for c in rng.integers(0, 256, 3)]
+        cv2.circle(img, center, int(rng.integers(width // 100, width // 10)), color, -1)
+    img += rng.integers(0, 8, img.shape, dtype=np.uint8)
+    cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+def run_mode(path: str, mode: str, target_size: int, repeat: int) -> dict:
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER, path, mode, str(target_size), str(repeat)],
+        cwd=repo_root, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[12, 48], help="Megapixels")
+    parser.add_argument("--modes", nargs="+", default=["full", "reduced", "tiled"])
+    parser.add_argument("--target-size", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for megapixels in args.sizes:
+            path = os.path.join(tmp, f"photo_{megapixels:g}mp.jpg")
+            make_photo_jpeg(megapixels, path)
+            print(f"{megapixels:g} MP JPEG ({os.path.getsize(path) / 1e6:.1f} MB):")
+            for mode in args.modes:
+                result = run_mode(path, mode, args.target_size, args.repeat)
+                height, width = result["shape"]
+                print(f"  {mode:>8}: {result['best_s']:.3f}s  +{result['extra_mb']:.0f} MB peak  -> {width}x{height}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Peak-RSS benchmark for /stylize uploads.
+
+Starts the API with uvicorn (thread executor, so all work stays in the measured
+process), sends --uploads concurrent requests and reads the server's peak RSS
+(VmHWM from /proc). Two scenarios, each on a fresh server:
+
+  valid     uploads just under the size limit
+  oversize  uploads of --oversize-mb, which should be refused early
+
+Run from the repo root (Linux only):
+
+    python tests/bench_upload_memory.py [--uploads 8] [--app-dir .]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import httpx
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_concurrency import free_port, wait_until_up
+
+def read_status_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+def make_png_near(size_bytes: int) -> bytes:
+    """Random-noise PNG (incompressible) of roughly size_bytes."""
+    side = int((size_bytes / 3) ** 0.5)
+    noise = np.random.default_rng(0).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    ok, png = cv2.imencode(".png", noise, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+    return png.tobytes()
+
+async def send_uploads(base_url: str, payload: bytes, uploads: int) -> list[int]:
+    async with httpx.AsyncClient(base_url=base_url, timeout=300.0) as client:
+        await wait_until_up(client)
+
+        async def upload(i: int) -> int:
+            try:
+                response = await client.post("/stylize", files={"file": (f"img_{i}.png", payload, "image/png")})
+                return response.status_code
+            except httpx.HTTPError:
+                return -1  # Server hung up mid-upload
+
+        return await asyncio.gather(*(upload(i) for i in range(uploads)))
+
+def run_scenario(app_dir: str, payload: bytes, uploads: int) -> dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            JOB_STORE_URL=f"sqlite:///{tmp}/jobs.db",
+            RESULT_CACHE_DIR=f"{tmp}/cache",
+            PREPROCESS_EXECUTOR="thread",
+            PREPROCESS_MAX_QUEUE="64",
+            REPLICATE_API_BASE_URL="http://127.0.0.1:9/v1",  # Nothing listens: stylization fails fast
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.app:app", "--port", str(port), "--log-level", "warning"],
+            cwd=os.path.abspath(app_dir), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            asyncio.run(send_uploads(f"http://127.0.0.1:{port}", b"", 0))  # Wait for startup
+            idle_kb = read_status_kb(server.pid, "VmRSS")
+            started = time.perf_counter()
+            statuses = asyncio.run(send_uploads(f"http://127.0.0.1:{port}", payload, uploads))
+            elapsed = time.perf_counter() - started
+            peak_kb = read_status_kb(server.pid, "VmHWM")
+        finally:
+            server.terminate()
+            server.wait()
+    return {
+        "statuses": {code: statuses.count(code) for code in sorted(set(statuses))},
+        "idle_mb": idle_kb / 1024,
+        "peak_mb": peak_kb / 1024,
+        "per_upload_mb": (peak_kb - idle_kb) / 1024 / uploads,
+        "elapsed_s": elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--valid-mb", type=float, default=9.0)
+    parser.add_argument("--oversize-mb", type=float, default=60.0)
+    parser.add_argument("--app-dir", default=".", help="Checkout whose backend.app is benchmarked")
+    args = parser.parse_args()
+
+    scenarios = {
+        "valid": make_png_near(int(args.valid_mb * 1024 * 1024)),
+        "oversize": b"\x89PNG\r\n\x1a\n" + os.urandom(int(args.oversize_mb * 1024 * 1024)),
+    }
+    for name, payload in scenarios.items():
+        result = run_scenario(args.app_dir, payload, args.uploads)
+        print(
+            f"{name:>8}: {args.uploads} x {len(payload) / 1e6:.1f} MB -> {result['statuses']}  "
+            f"idle {result['idle_mb']:.0f} MB, peak {result['peak_mb']:.0f} MB, "
+            f"{result['per_upload_mb']:.1f} MB/upload, {result['elapsed_s']:.2f}s"
+        )
+
+if __name__ == "__main__":
+    main()
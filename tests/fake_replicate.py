@@ -0,0 +1,170 @@
+"""
+Local fake of the Replicate HTTP API, for tests and benchmarks.
+
+Implements just what backend.replicate_client uses: creating predictions (by model
+or by version), polling and cancelling them, and serving the output image. A
+prediction stays "processing" for `latency` seconds, then succeeds with a URL
+pointing back at this server. `error_rate` makes that share of API calls answer
+503 (or 429), so retry paths get exercised. `gateway_errors` makes that many creates
+answer 502 after the prediction was made, like a proxy dropping the response.
+
+Use it in-process through httpx.ASGITransport, or as a real server:
+
+    python tests/fake_replicate.py --port 8010 --latency 2 --error-rate 0.05
+"""
+import argparse
+import base64
+import contextlib
+import io
+import random
+import socket
+import threading
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from PIL import Image, ImageOps
+
+def _stylize(image_uri: str) -> bytes:
+    """Stand-in for the model: invert the edge map and tint it, same size as the input."""
+    try:
+        data = base64.b64decode(image_uri.split(",", 1)[1])
+        edges = Image.open(io.BytesIO(data)).convert("L")
+    except Exception:
+        edges = Image.new("L", (64, 64), 0)
+    stylized = ImageOps.colorize(ImageOps.invert(edges), black=(40, 30, 20), white=(250, 240, 220))
+    buf = io.BytesIO()
+    stylized.save(buf, format="PNG")
+    return buf.getvalue()
+
+def create_fake_replicate_app(latency: float = 0.0, error_rate: float = 0.0,
+                              fail_predictions: bool = False, seed=None, gateway_errors: int = 0) -> FastAPI:
+    app = FastAPI()
+    rng = random.Random(seed)
+    state = app.state
+    state.predictions = {}
+    state.outputs = {}
+    state.calls = 0
+    state.created = 0
+    state.create_calls = 0
+    state.gateway_errors = gateway_errors
+    state.in_flight = 0
+    state.max_in_flight = 0
+
+    def injected_error():
+        state.calls += 1
+        if error_rate and rng.random() < error_rate:
+            status = rng.choice((429, 503))
+            return JSONResponse({"detail": "injected error"}, status_code=status, headers={"Retry-After": "0"})
+        return None
+
+    def refresh(prediction: dict):
+        if prediction["status"] == "processing" and time.monotonic() >= prediction["_ready_at"]:
+            state.in_flight -= 1
+            if fail_predictions:
+                prediction.update(status="failed", error="injected prediction failure")
+            else:
+                prediction.update(status="succeeded", output=[prediction["_output_url"]])
+
+    def public(prediction: dict) -> dict:
+        return {k: v for k, v in prediction.items() if not k.startswith("_")}
+
+    async def create(request: Request, version=None):
+        state.create_calls += 1
+        error = injected_error()
+        if error:
+            return error
+        body = await request.json()
+        prediction_id = uuid.uuid4().hex
+        state.outputs[prediction_id] = _stylize(body.get("input", {}).get("image", ""))
+        prediction = {
+            "id": prediction_id,
+            "version": version or body.get("version"),
+            "status": "processing",
+            "input": {"prompt": body.get("input", {}).get("prompt")},
+            "output": None,
+            "error": None,
+            "urls": {"get": str(request.url_for("get_prediction", prediction_id=prediction_id))},
+            "_ready_at": time.monotonic() + latency,
+            "_output_url": str(request.url_for("get_output", prediction_id=prediction_id)),
+        }
+        state.predictions[prediction_id] = prediction
+        state.created += 1
+        state.in_flight += 1
+        state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        refresh(prediction)
+        if state.gateway_errors:
+            state.gateway_errors -= 1
+            return JSONResponse({"detail": "Bad Gateway"}, status_code=502)
+        return JSONResponse(public(prediction), status_code=201)
+
+    @app.post("/v1/models/{owner}/{name}/predictions")
+    async def create_model_prediction(owner: str, name: str, request: Request):
+        return await create(request, version=f"{owner}/{name}")
+
+    @app.post("/v1/predictions")
+    async def create_version_prediction(request: Request):
+        return await create(request)
+
+    @app.get("/v1/predictions/{prediction_id}", name="get_prediction")
+    async def get_prediction(prediction_id: str):
+        error = injected_error()
+        if error:
+            return error
+        prediction = state.predictions.get(prediction_id)
+        if prediction is None:
+            return JSONResponse({"detail": "Not found"}, status_code=404)
+        refresh(prediction)
+        return public(prediction)
+
+    @app.post("/v1/predictions/{prediction_id}/cancel")
+    async def cancel_prediction(prediction_id: str):
+        prediction = state.predictions.get(prediction_id)
+        if prediction is None:
+            return JSONResponse({"detail": "Not found"}, status_code=404)
+        if prediction["status"] == "processing":
+            state.in_flight -= 1
+            prediction["status"] = "canceled"
+        return public(prediction)
+
+    @app.get("/files/{prediction_id}.png", name="get_output")
+    async def get_output(prediction_id: str):
+        data = state.outputs.get(prediction_id)
+        if data is None:
+            return JSONResponse({"detail": "Not found"}, status_code=404)
+        return Response(content=data, media_type="image/png")
+
+    return app
+
+@contextlib.contextmanager
+def run_fake_replicate_server(**kwargs):
+    """
+    Serves a fake on a free local port from a background thread.
+    Yields (base_url, app); the API lives under base_url + "/v1".
+    """
+    import uvicorn
+
+    app = create_fake_replicate_app(**kwargs)
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}", app
+    finally:
+        server.should_exit = True
+        thread.join()
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(create_fake_replicate_app(args.latency, args.error_rate), host="127.0.0.1", port=args.port, log_level="warning")
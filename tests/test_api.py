@@ -1,13 +1,74 @@
 import unittest
+import asyncio
+import base64
+import hashlib
+import hmac
+import io
 import os
+import subprocess
 import sys
+import json
+import tempfile
+import time
+import uuid
+import zipfile
+import cv2
+import numpy as np
 from fastapi.testclient import TestClient
 from pathlib import Path
+from typing import Optional
+from unittest import mock
 
 # Add the parent directory to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.app.app import app
+# Keep test runs self-contained: in-process job store, thread pool instead of spawning processes
+os.environ.setdefault("JOB_STORE_URL", "memory://")
+os.environ.setdefault("PREPROCESS_EXECUTOR", "thread")
+os.environ.setdefault("RESULT_CACHE_DIR", tempfile.mkdtemp(prefix="sketchsplit_cache_"))
+# Only the startup recovery scan; tests drive recovery themselves
+os.environ.setdefault("WORKER_HEARTBEAT_SECONDS", "3600")
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend import app as app_module
+from backend import replicate_client
+from backend.app import app
+from backend.recovery import WorkerRegistry
+from fake_replicate import run_fake_replicate_server
+
+def make_png(width=96, height=64, seed=0) -> bytes:
+    """A white image with a black square; seed shifts the square so images differ."""
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    img[16 + seed:48 + seed, 24:72] = 0
+    ok, png = cv2.imencode('.png', img)
+    return png.tobytes()
+
+class PipelineTestCase(unittest.TestCase):
+    """Runs the app against a fake Replicate server on a local port."""
+    fake_latency = 0.0
+
+    @classmethod
+    def setUpClass(cls):
+        cls._fake_server = run_fake_replicate_server(latency=cls.fake_latency)
+        cls.fake_base_url, cls.fake_app = cls._fake_server.__enter__()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._fake_server.__exit__(None, None, None)
+
+    def setUp(self):
+        self.client = TestClient(app)
+        self.client.__enter__()
+        replicate_client._async_client = replicate_client.AsyncReplicateClient(
+            api_token="test-token", base_url=f"{self.fake_base_url}/v1", poll_interval=0.01, webhook_url=""
+        )
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+
+    def stylize(self, image: bytes, filename="sketch.png", **data):
+        return self.client.post("/stylize", files={"file": (filename, image, "image/png")}, data=data)
 
 class TestAPI(unittest.TestCase):
     def setUp(self):
@@ -61,5 +122,651 @@ class TestAPI(unittest.TestCase):
         self.assertIn("job_id", data)
         self.assertIn("edge_path", data)
 
+class TestStylizePipeline(PipelineTestCase):
+    def test_png_accepted_with_generic_content_type(self):
+        response = self.client.post(
+            "/stylize", files={"file": ("sketch.png", make_png(seed=4), "application/octet-stream")}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_job_completes_through_fake_replicate(self):
+        response = self.stylize(make_png(seed=1), prompt="ink wash")
+        self.assertEqual(response.status_code, 200)
+        job_id = response.json()["job_id"]
+
+        status = self.client.get(f"/status/{job_id}").json()
+        self.assertEqual(status["status"], "complete")
+        self.assertTrue(Path(status["stylized_image_path"]).exists())
+
+    def test_layers_written_once_and_released_after_artifacts(self):
+        job_id = self.stylize(make_png(seed=7), filename="layers.png", prompt="layers").json()["job_id"]
+        job_dir = app_module.TEMP_IMAGE_DIR / job_id
+        # Only served files, no intermediate copies or leftovers in the shared temp dir
+        names = sorted(p.name for p in job_dir.iterdir())
+        thumbnails = [name for name in names if app_module.EDGE_PREVIEW_NAME.fullmatch(name)]
+        self.assertEqual(len(thumbnails), len(app_module.EDGE_PREVIEW_SIZES))
+        self.assertEqual(
+            [name for name in names if name not in thumbnails],
+            ["composite_layers.png", "edge_layers.png", "preview_layers.gif", "stylized_layers.png"],
+        )
+        self.assertEqual(list(app_module.TEMP_IMAGE_DIR.glob("edge_*_layers.png")), [])
+        self.assertIsNone(app_module.LAYERS.get(job_id, "edge"))
+        self.assertIsNone(app_module.LAYERS.get(job_id, "stylized"))
+
+    def test_edge_thumbnails_are_served_with_long_cache_headers(self):
+        response = self.stylize(make_png(width=2000, height=1200, seed=17), filename="thumbs.png")
+        previews = response.json()["edge_previews"]
+        self.assertEqual(set(previews), {"256", "1024"})
+        for size, path in previews.items():
+            served = self.client.get(f"/{path}")
+            self.assertEqual(served.status_code, 200)
+            self.assertIn("immutable", served.headers["cache-control"])
+            thumbnail = cv2.imdecode(np.frombuffer(served.content, np.uint8), cv2.IMREAD_GRAYSCALE)
+            self.assertEqual(max(thumbnail.shape), int(size))
+        # The full-size edge map keeps revalidating
+        self.assertNotIn("cache-control", self.client.get(f"/{response.json()['edge_path']}").headers)
+
+        # Same upload again: thumbnails come from the cache, and /status reports them too
+        job_id = self.stylize(make_png(width=2000, height=1200, seed=17), filename="thumbs.png").json()["job_id"]
+        status = self.client.get(f"/status/{job_id}").json()
+        self.assertEqual({size: Path(path).name for size, path in status["edge_previews"].items()},
+                         {size: Path(path).name for size, path in previews.items()})
+        self.assertTrue(all(Path(path).exists() for path in status["edge_previews"].values()))
+
+    def test_repeat_upload_is_served_from_cache(self):
+        image = make_png(seed=2)
+        first = self.stylize(image, prompt="charcoal")
+        created_before = self.fake_app.state.created
+        hits_before = app_module.RESULT_CACHE.stats()["hits"].get("stylized", 0)
+
+        second = self.stylize(image, prompt="charcoal")
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["status"], "complete")
+        self.assertNotEqual(second.json()["job_id"], first.json()["job_id"])
+        self.assertEqual(self.fake_app.state.created, created_before)  # No new prediction
+        self.assertEqual(app_module.RESULT_CACHE.stats()["hits"]["stylized"], hits_before + 1)
+
+        status = self.client.get(f"/status/{second.json()['job_id']}").json()
+        self.assertEqual(status["status"], "complete")
+        self.assertTrue(Path(status["stylized_image_path"]).exists())
+
+        # A different prompt is a different result
+        third = self.stylize(image, prompt="watercolor")
+        self.assertEqual(self.fake_app.state.created, created_before + 1)
+        self.assertEqual(self.client.get(f"/status/{third.json()['job_id']}").json()["status"], "complete")
+
+    def test_identical_in_flight_jobs_share_one_prediction(self):
+        image = make_png(seed=15)
+        created_before = self.fake_app.state.created
+
+        async def scenario():
+            # Prepared before either is stylized, like a double click
+            prepared = [await app_module.prepare_job(image, "twice.png", "twins", "jagilley/controlnet-canny")
+                        for _ in range(2)]
+            await asyncio.gather(*(app_module.finish_job(job_id, edge_path, "twins", key, "jagilley/controlnet-canny")
+                                   for job_id, edge_path, key in prepared))
+            return [job_id for job_id, _, _ in prepared]
+
+        # On the app's own loop, where the shared Replicate client lives
+        job_ids = self.client.portal.call(scenario)
+        self.assertEqual(self.fake_app.state.created, created_before + 1)
+        first, second = (app_module.JOB_STORE.get(job_id) for job_id in job_ids)
+        self.assertEqual((first["status"], second["status"]), ("complete", "complete"))
+        self.assertNotEqual(first["stylized_image_path"], second["stylized_image_path"])
+        self.assertEqual(Path(first["stylized_image_path"]).read_bytes(), Path(second["stylized_image_path"]).read_bytes())
+        self.assertEqual(second["artifacts_status"], "ready")
+
+    def test_dead_workers_job_reattaches_to_its_prediction(self):
+        model_id = "jagilley/controlnet-canny"
+
+        async def scenario():
+            job_id, edge_path, _ = await app_module.prepare_job(make_png(seed=18), "resume.png", "resume", model_id)
+            # The worker that started this prediction died before the output came back
+            prediction = await replicate_client.get_async_client().create_prediction(
+                model_id, {"image": replicate_client._edge_map_data_uri(str(edge_path)), "prompt": "resume"}
+            )
+            app_module.JOB_STORE.transition(job_id, "processing_replicate", worker_id="dead-worker",
+                                            prediction_id=prediction["id"])
+            orphans = [job for job in app_module.WORKERS.orphaned(app_module.ACTIVE_STATUSES) if job["job_id"] == job_id]
+            self.assertEqual(len(orphans), 1)
+            self.assertTrue(app_module.WORKERS.claim(orphans[0]))
+            self.assertFalse(app_module.WORKERS.claim(orphans[0]))  # Claimed once only
+            await app_module.recover_job(orphans[0])
+            return job_id, prediction["id"]
+
+        created_before = self.fake_app.state.created
+        job_id, prediction_id = self.client.portal.call(scenario)
+        self.assertEqual(self.fake_app.state.created, created_before + 1)  # No second prediction
+        job = app_module.JOB_STORE.get(job_id)
+        self.assertEqual((job["status"], job["artifacts_status"]), ("complete", "ready"))
+        self.assertEqual(job["worker_id"], app_module.WORKERS.worker_id)
+        self.assertEqual(Path(job["stylized_image_path"]).read_bytes(), self.fake_app.state.outputs[prediction_id])
+
+    def test_dead_workers_flight_does_not_hold_up_resubmission(self):
+        image = make_png(seed=19)
+
+        async def scenario():
+            job_id, _, stylized_key = await app_module.prepare_job(image, "crash.png", "crash", "jagilley/controlnet-canny")
+            # Its worker died while leading the flight, long before the lease would run out
+            app_module.JOB_STORE.create(f"flight:{stylized_key}", "running", kind="flight", flight_id="dead",
+                                        worker_id="dead-worker", lease_until=time.time() + 900)
+            app_module.JOB_STORE.transition(job_id, "processing_replicate", worker_id="dead-worker")
+            return job_id
+
+        job_id = self.client.portal.call(scenario)
+        created_before = self.fake_app.state.created
+        started = time.monotonic()
+        resubmitted = self.stylize(image, filename="crash.png", prompt="crash").json()["job_id"]
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(self.client.get(f"/status/{resubmitted}").json()["status"], "complete")
+        self.assertEqual(self.fake_app.state.created, created_before + 1)
+
+        # The orphan had no prediction of its own (a follower): it takes the cached result
+        self.client.portal.call(app_module.recover_job, app_module.JOB_STORE.get(job_id))
+        self.assertEqual(self.fake_app.state.created, created_before + 1)
+        self.assertEqual(self.client.get(f"/status/{job_id}").json()["status"], "complete")
+
+    def test_dead_workers_job_without_edge_map_fails(self):
+        job_id = str(uuid.uuid4())
+        app_module.JOB_STORE.create(job_id, "processing_upload", original_filename="lost.png", worker_id="dead-worker")
+        self.client.portal.call(app_module.recover_job, app_module.JOB_STORE.get(job_id))
+        status = self.client.get(f"/status/{job_id}").json()
+        self.assertEqual(status["status"], "failed")
+        self.assertIn("resubmit", status["error_message"])
+
+    def test_full_stylization_queue_sheds_load(self):
+        scheduler = app_module.SCHEDULER
+        max_queue = scheduler.max_queue
+        scheduler.max_queue = 0
+        try:
+            response = self.stylize(make_png(seed=16), filename="shed.png")
+        finally:
+            scheduler.max_queue = max_queue
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        self.assertIn("queue is full", response.json()["detail"])
+
+    def test_local_model_completes_without_replicate(self):
+        created_before = self.fake_app.state.created
+        response = self.stylize(make_png(seed=9), filename="local.png", model="local/pencil")
+        self.assertEqual(response.status_code, 200)
+
+        status = self.client.get(f"/status/{response.json()['job_id']}").json()
+        self.assertEqual(status["status"], "complete")
+        self.assertTrue(Path(status["stylized_image_path"]).exists())
+        self.assertEqual(self.fake_app.state.created, created_before)
+
+    def test_unknown_model_is_rejected(self):
+        response = self.stylize(make_png(seed=10), model="someone/else")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Unsupported model", response.json()["detail"])
+
+    def test_extra_control_filters_join_the_bundle(self):
+        response = self.stylize(make_png(seed=13), filename="filters.png", filters="soft_edges,canny,silhouette")
+        self.assertEqual(response.status_code, 200)
+        job_id = response.json()["job_id"]
+
+        status = self.client.get(f"/status/{job_id}").json()
+        self.assertEqual(status["status"], "complete")
+        self.assertEqual(set(status["control_map_paths"]), {"canny", "silhouette"})
+        with zipfile.ZipFile(io.BytesIO(self.client.get(f"/download/{job_id}").content)) as zf:
+            names = zf.namelist()
+        self.assertIn("01_edge_map_filters.png", names)
+        self.assertIn("04_control_canny_filters.png", names)
+        self.assertIn("04_control_silhouette_filters.png", names)
+
+    def test_unknown_control_filter_is_rejected(self):
+        response = self.stylize(make_png(seed=14), filters="canny,hed")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Unknown control filter", response.json()["detail"])
+
+class TestMetrics(PipelineTestCase):
+    def test_metrics_cover_pipeline_stages(self):
+        job_id = self.stylize(make_png(seed=11), filename="metrics.png").json()["job_id"]
+        self.assertEqual(self.client.get(f"/download/{job_id}").status_code, 200)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        text = response.text
+        for stage in ("decode", "blur", "canny", "imwrite", "replicate_queue", "replicate_inference",
+                      "replicate_download", "merge", app_module.PREVIEW_FORMAT, "zip"):
+            self.assertIn(f'sketchsplit_stage_seconds_count{{stage="{stage}"}}', text)
+        self.assertIn('sketchsplit_cache_misses_total{kind="edge"}', text)
+        self.assertIn("sketchsplit_job_records ", text)
+        self.assertIn('sketchsplit_jobs_in_flight{status="processing_replicate"}', text)
+
+class TestStorageExpiry(PipelineTestCase):
+    def test_evicted_job_reports_expired(self):
+        job_id = self.stylize(make_png(seed=12), filename="expiry.png").json()["job_id"]
+        self.assertEqual(self.client.get(f"/status/{job_id}").json()["status"], "complete")
+
+        storage = app_module.STORAGE
+        ttl = storage.ttl_seconds
+        storage.ttl_seconds = 0
+        try:
+            storage.sweep()
+        finally:
+            storage.ttl_seconds = ttl
+
+        self.assertFalse((app_module.TEMP_IMAGE_DIR / job_id).exists())
+        status = self.client.get(f"/status/{job_id}").json()
+        self.assertEqual(status["status"], "expired")
+        self.assertIsNone(status["stylized_image_path"])
+        self.assertEqual(self.client.get(f"/download/{job_id}").status_code, 410)
+
+class TestStartup(unittest.TestCase):
+    def test_importing_the_app_leaves_imaging_modules_for_later(self):
+        # A fresh interpreter: this one has long imported everything
+        code = ("import sys, backend.app; "
+                "print(','.join(m for m in ('cv2', 'numpy', 'PIL', 'replicate') if m in sys.modules))")
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=dict(os.environ, JOB_STORE_URL="memory://", PREPROCESS_EXECUTOR="thread", REPLICATE_API_TOKEN="test-token"),
+        )
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_ready_only_after_warm_up(self):
+        saved = dict(app_module.READINESS)
+        self.addCleanup(app_module.READINESS.update, saved)
+        app_module.READINESS.update(status="warming_up")
+        client = TestClient(app)
+        self.assertEqual(client.get("/health").status_code, 200)  # Liveness does not wait
+        response = client.get("/ready")
+        self.assertEqual((response.status_code, response.json()), (503, {"status": "warming_up"}))
+
+        with TestClient(app) as client:  # Startup runs the warm-up
+            deadline = time.monotonic() + 30
+            while client.get("/ready").status_code != 200 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(client.get("/ready").json(), {"status": "ready"})
+        self.assertTrue(all(module.loaded for module in app_module.WARM_UP_MODULES))
+
+class TestUploadLimits(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def test_declared_content_length_over_limit_is_refused_up_front(self):
+        response = self.client.post(
+            "/stylize",
+            content=b"x" * 16,
+            headers={
+                "content-type": "multipart/form-data; boundary=x",
+                "content-length": str(app_module.MAX_FILE_SIZE_BYTES * 2),
+            },
+        )
+        self.assertEqual(response.status_code, 413)
+
+    def test_refusal_carries_cors_headers(self):
+        # Without them the browser hides the 413 from the frontend as a network error
+        limits = {"/stylize": app_module.MAX_FILE_SIZE_BYTES, "/batch/stylize": app_module.BATCH_MAX_UPLOAD_BYTES}
+        for path, limit in limits.items():
+            response = self.client.post(
+                path,
+                content=b"x" * 16,
+                headers={
+                    "origin": "http://localhost:3000",
+                    "content-type": "multipart/form-data; boundary=x",
+                    "content-length": str(limit * 2),
+                },
+            )
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(response.headers.get("access-control-allow-origin"), "http://localhost:3000")
+
+    def test_streamed_body_over_limit_is_cut_off(self):
+        boundary = b"sketchsplit"
+        chunk = b"\x00" * (1024 * 1024)
+
+        def body():
+            yield b"--" + boundary + b'\r\nContent-Disposition: form-data; name="file"; filename="big.png"\r\n'
+            yield b"Content-Type: image/png\r\n\r\n\x89PNG\r\n\x1a\n"
+            for _ in range(app_module.MAX_FILE_SIZE_MB + 2):
+                yield chunk
+            yield b"\r\n--" + boundary + b"--\r\n"
+
+        # A generator body is sent chunked, without Content-Length
+        response = self.client.post(
+            "/stylize", content=body(), headers={"content-type": f"multipart/form-data; boundary={boundary.decode()}"}
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()["detail"], "Request body too large.")  # Stopped by the middleware
+
+    def test_file_type_is_sniffed_not_trusted(self):
+        response = self.client.post("/stylize", files={"file": ("fake.png", b"GIF89a not really a png", "image/png")})
+        self.assertEqual(response.status_code, 415)
+        self.assertIn("Unsupported file type", response.json()["detail"])
+
+class TestDownloadArtifacts(PipelineTestCase):
+    def test_artifacts_built_eagerly_and_bundle_streamed(self):
+        job_id = self.stylize(make_png(seed=5), prompt="artifacts").json()["job_id"]
+
+        status = self.client.get(f"/status/{job_id}").json()
+        self.assertEqual(status["status"], "complete")
+        self.assertEqual(status["artifacts_status"], "ready")
+        composite_path = Path(app_module.JOB_STORE.get(job_id)["composite_image_path"])
+        built_at = composite_path.stat().st_mtime_ns
+
+        first = self.client.get(f"/download/{job_id}")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers["content-type"], "application/zip")
+        self.assertIn(f"sketchsplit_results_{job_id}.zip", first.headers["content-disposition"])
+        with zipfile.ZipFile(io.BytesIO(first.content)) as zf:
+            self.assertIn("steps.json", zf.namelist())
+            self.assertEqual(zf.read("03_composite_sketch.png"), composite_path.read_bytes())
+            self.assertIn("preview_sketch.gif", zf.namelist())
+        etag = first.headers["etag"]
+
+        # Layers are not rebuilt and the bundle never touches disk
+        self.assertEqual(self.client.get(f"/download/{job_id}").headers["etag"], etag)
+        self.assertEqual(composite_path.stat().st_mtime_ns, built_at)
+        self.assertEqual(list(composite_path.parent.glob("*.zip")), [])
+
+        not_modified = self.client.get(f"/download/{job_id}", headers={"If-None-Match": etag})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_download_rebuilds_missing_artifacts(self):
+        job_id = self.stylize(make_png(seed=6), prompt="rebuild").json()["job_id"]
+        Path(app_module.JOB_STORE.get(job_id)["composite_image_path"]).unlink()
+        response = self.client.get(f"/download/{job_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content[:2], b"PK")
+
+class TestEdgesOutput(PipelineTestCase):
+    def test_edges_only_job_skips_stylization(self):
+        created_before = self.fake_app.state.created
+        response = self.stylize(make_png(width=112, seed=1), filename="lines.png", output="edges", svg="true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "complete")
+        job_id = response.json()["job_id"]
+
+        status = self.client.get(f"/status/{job_id}").json()
+        self.assertEqual(status["artifacts_status"], "ready")
+        self.assertIsNone(status["stylized_image_path"])
+        served = self.client.get(f"/{status['edge_svg_path']}")
+        self.assertEqual(served.status_code, 200)
+        self.assertTrue(served.content.startswith(b"<svg"))
+        self.assertIn(b'd="M', served.content)  # The square's outline
+        self.assertEqual(self.fake_app.state.created, created_before)  # No prediction
+
+        with zipfile.ZipFile(io.BytesIO(self.client.get(f"/download/{job_id}").content)) as zf:
+            names = zf.namelist()
+            self.assertEqual(zf.read("01_edge_map_lines.svg"), served.content)
+        self.assertEqual(sorted(names), ["01_edge_map_lines.png", "01_edge_map_lines.svg", "steps.json"])
+
+        # Same upload again: the SVG comes from the cache
+        hits_before = app_module.RESULT_CACHE.stats()["hits"].get("edge_svg", 0)
+        again = self.stylize(make_png(width=112, seed=1), filename="lines.png", output="edges", svg="true").json()
+        self.assertEqual(app_module.RESULT_CACHE.stats()["hits"]["edge_svg"], hits_before + 1)
+        self.assertEqual(Path(app_module.JOB_STORE.get(again["job_id"])["edge_svg_path"]).read_bytes(), served.content)
+
+    def test_svg_layer_added_to_stylized_bundle(self):
+        job_id = self.stylize(make_png(width=112, seed=2), filename="both.png", svg="1").json()["job_id"]
+        with zipfile.ZipFile(io.BytesIO(self.client.get(f"/download/{job_id}").content)) as zf:
+            self.assertTrue({"01_edge_map_both.svg", "03_composite_both.png"} <= set(zf.namelist()))
+
+    def test_edges_only_batch(self):
+        files = [("files", (f"page{i}.png", make_png(width=112, seed=3 + i), "image/png")) for i in range(2)]
+        response = self.client.post("/batch/stylize", files=files, data={"output": "edges"})
+        self.assertEqual([job["status"] for job in response.json()["jobs"]], ["complete", "complete"])
+        download = self.client.get(f"/batch/{response.json()['batch_id']}/download")
+        with zipfile.ZipFile(io.BytesIO(download.content)) as zf:
+            self.assertIn("02_page1/01_edge_map_page1.png", zf.namelist())
+
+    def test_dead_workers_edges_only_job_completes_without_stylizing(self):
+        job_id = self.stylize(make_png(width=112, seed=6), output="edges").json()["job_id"]
+        app_module.JOB_STORE.transition(job_id, "processing_canny", worker_id="dead-worker")
+        created_before = self.fake_app.state.created
+        app_module.JOB_STORE.update(job_id, artifacts_status=None)
+        self.client.portal.call(app_module.recover_job, app_module.JOB_STORE.get(job_id))
+        status = self.client.get(f"/status/{job_id}").json()
+        # Artifacts settled too, so /status/{job_id}/events can close
+        self.assertEqual((status["status"], status["artifacts_status"]), ("complete", "ready"))
+        self.assertEqual(self.fake_app.state.created, created_before)
+
+    def test_unknown_output_is_rejected(self):
+        self.assertEqual(self.stylize(make_png(width=112, seed=5), output="vector").status_code, 400)
+
+def parse_sse_status(chunk: str) -> dict:
+    """The status payload of one SSE message."""
+    data = next(line for line in chunk.splitlines() if line.startswith("data: "))
+    return json.loads(data[len("data: "):])
+
+class TestStatusEvents(PipelineTestCase):
+    def test_transitions_are_pushed_as_they_happen(self):
+        # TestClient buffers whole responses, so drive the SSE body iterator directly
+        job_id = str(uuid.uuid4())
+        app_module.JOB_STORE.create(job_id, "processing_canny", original_filename="live.png",
+                                    worker_id=app_module.WORKERS.worker_id)
+
+        async def scenario():
+            response = await app_module.stream_job_status(job_id)
+            self.assertEqual(response.media_type, "text/event-stream")
+            stream = response.body_iterator
+            self.assertEqual(parse_sse_status(await anext(stream))["status"], "processing_canny")
+
+            app_module.JOB_STORE.transition(job_id, "processing_replicate")
+            self.assertEqual(parse_sse_status(await anext(stream))["status"], "processing_replicate")
+
+            # Writes from other threads reach the subscriber through the job store listener
+            await asyncio.to_thread(app_module.JOB_STORE.transition, job_id, "failed", error_message="boom")
+            last = parse_sse_status(await anext(stream))
+            self.assertEqual((last["status"], last["error_message"]), ("failed", "boom"))
+            with self.assertRaises(StopAsyncIteration):  # Stream closes after the final status
+                await anext(stream)
+
+        asyncio.run(scenario())
+        self.assertFalse(app_module.JOB_EVENTS.has_subscribers(job_id))
+
+    def test_scheduler_is_only_read_on_the_event_loop(self):
+        job_id = str(uuid.uuid4())
+        app_module.JOB_STORE.create(job_id, "processing_canny", original_filename="queued.png",
+                                    worker_id=app_module.WORKERS.worker_id)
+        read_on = []
+
+        def position(_job_id):
+            read_on.append(app_module._on_event_loop())
+            return 3
+
+        async def scenario():
+            stream = (await app_module.stream_job_status(job_id)).body_iterator
+            await anext(stream)
+            # A write from a worker thread (recovery claim, storage sweep): no scheduler read there
+            await asyncio.to_thread(app_module.JOB_STORE.transition, job_id, "processing_replicate")
+            off_loop = parse_sse_status(await anext(stream))
+            app_module.JOB_STORE.update(job_id, note="on the loop")
+            on_loop = parse_sse_status(await anext(stream))
+            await stream.aclose()
+            return off_loop, on_loop
+
+        with mock.patch.object(app_module.SCHEDULER, "position", position):
+            off_loop, on_loop = asyncio.run(scenario())
+        self.assertEqual((off_loop["status"], off_loop["queue_position"]), ("processing_replicate", None))
+        self.assertEqual(on_loop["queue_position"], 3)
+        self.assertTrue(read_on and all(read_on))
+
+    def test_keep_alive_picks_up_updates_the_broker_missed(self):
+        # Simulates another worker writing the job: the store change is not published here
+        job_id = str(uuid.uuid4())
+        peer = WorkerRegistry(app_module.JOB_STORE, "peer-worker")
+        peer.heartbeat()  # Alive, so this worker leaves its job alone
+        self.addCleanup(peer.retire)
+        app_module.JOB_STORE.create(job_id, "processing_replicate", original_filename="other.png", worker_id=peer.worker_id)
+        saved_keepalive = app_module.SSE_KEEPALIVE_SECONDS
+        app_module.SSE_KEEPALIVE_SECONDS = 0.05
+
+        async def scenario():
+            stream = (await app_module.stream_job_status(job_id)).body_iterator
+            await anext(stream)
+            self.assertEqual(await anext(stream), ": keep-alive\n\n")
+            app_module.JOB_STORE.remove_listener(app_module._publish_job_update)
+            try:
+                app_module.JOB_STORE.transition(job_id, "failed", error_message="elsewhere")
+            finally:
+                app_module.JOB_STORE.add_listener(app_module._publish_job_update)
+            self.assertEqual(parse_sse_status(await anext(stream))["status"], "failed")
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            app_module.SSE_KEEPALIVE_SECONDS = saved_keepalive
+
+    def test_finished_job_gets_one_event_and_stream_closes(self):
+        job_id = self.stylize(make_png(seed=50), prompt="events").json()["job_id"]
+        response = self.client.get(f"/status/{job_id}/events")
+        statuses = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+        self.assertEqual(len(statuses), 1)
+        self.assertEqual((statuses[0]["status"], statuses[0]["artifacts_status"]), ("complete", "ready"))
+        self.assertEqual(statuses[0], self.client.get(f"/status/{job_id}").json())
+
+    def test_unknown_job_is_404(self):
+        self.assertEqual(self.client.get("/status/missing/events").status_code, 404)
+
+class TestBatch(PipelineTestCase):
+    def test_multipart_batch_completes_with_combined_bundle(self):
+        files = [("files", (f"page{i}.png", make_png(seed=10 + i), "image/png")) for i in range(3)]
+        response = self.client.post("/batch/stylize", files=files, data={"prompt": "sketchbook"})
+        self.assertEqual(response.status_code, 200)
+        batch = response.json()
+        self.assertEqual(len(batch["jobs"]), 3)
+
+        status = self.client.get(f"/batch/{batch['batch_id']}").json()
+        self.assertEqual(status["status"], "complete")
+        self.assertEqual(status["counts"], {"complete": 3})
+        self.assertEqual(status["progress"], 1.0)
+        self.assertEqual([job["job_id"] for job in status["jobs"]], [job["job_id"] for job in batch["jobs"]])
+
+        download = self.client.get(f"/batch/{batch['batch_id']}/download")
+        self.assertEqual(download.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(download.content)) as zf:
+            names = zf.namelist()
+        for i in range(3):
+            self.assertIn(f"{i + 1:02d}_page{i}/03_composite_page{i}.png", names)
+        self.assertIn("steps.json", names)
+
+    def test_zip_batch_skips_non_images_and_reports_partial_failure(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("sketches/a.png", make_png(seed=20))
+            zf.writestr("sketches/notes.txt", "not an image")
+            zf.writestr("__MACOSX/sketches/._a.png", b"\x89PNG\r\n\x1a\nresource fork")
+            zf.writestr("sketches/broken.png", b"\x89PNG\r\n\x1a\n" + b"\x00" * 64)  # Sniffs as PNG, fails to decode
+        response = self.client.post(
+            "/batch/stylize", files={"archive": ("set.zip", archive.getvalue(), "application/zip")}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([job["status"] for job in response.json()["jobs"]], ["processing_canny", "failed"])
+
+        batch_id = response.json()["batch_id"]
+        status = self.client.get(f"/batch/{batch_id}").json()
+        self.assertEqual(status["status"], "partial")
+        self.assertEqual(status["counts"], {"complete": 1, "failed": 1})
+        with zipfile.ZipFile(io.BytesIO(self.client.get(f"/batch/{batch_id}/download").content)) as zf:
+            self.assertIn("01_a/03_composite_a.png", zf.namelist())
+            self.assertFalse(any(name.startswith("02_") for name in zf.namelist()))
+
+    def test_batch_and_job_ids_are_not_interchangeable(self):
+        batch_id = self.client.post(
+            "/batch/stylize", files=[("files", ("one.png", make_png(seed=30), "image/png"))]
+        ).json()["batch_id"]
+        self.assertEqual(self.client.get(f"/status/{batch_id}").status_code, 404)
+        self.assertEqual(self.client.get("/batch/not-a-batch").status_code, 404)
+
+    def test_empty_batch_is_rejected(self):
+        self.assertEqual(self.client.post("/batch/stylize", data={"prompt": "x"}).status_code, 400)
+
+class TestReplicateWebhook(unittest.TestCase):
+    key = b"webhook-signing-key"
+
+    def setUp(self):
+        self.client = TestClient(app)
+        self.saved_client = replicate_client._async_client
+        self.addCleanup(setattr, replicate_client, "_async_client", self.saved_client)
+
+    def configure(self, webhook_url: str, secret: Optional[str]):
+        replicate_client._async_client = replicate_client.AsyncReplicateClient(api_token="test-token", webhook_url=webhook_url)
+        env = mock.patch.dict(os.environ, {"REPLICATE_WEBHOOK_SECRET": secret or ""})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def post_signed(self, body: bytes, key: bytes):
+        timestamp = str(int(time.time()))
+        signature = base64.b64encode(hmac.new(key, f"msg_1.{timestamp}.".encode() + body, hashlib.sha256).digest()).decode()
+        headers = {"webhook-id": "msg_1", "webhook-timestamp": timestamp, "webhook-signature": f"v1,{signature}"}
+        return self.client.post("/webhooks/replicate", content=body, headers=headers)
+
+    def test_unconfigured_endpoint_is_not_served(self):
+        body = b'{"id": "p1", "status": "succeeded"}'
+        self.configure("", "whsec_" + base64.b64encode(self.key).decode())
+        self.assertEqual(self.post_signed(body, self.key).status_code, 404)
+        self.configure("https://api.example.com/webhooks/replicate", None)
+        self.assertEqual(self.post_signed(body, self.key).status_code, 404)
+
+    def test_only_signed_deliveries_are_accepted(self):
+        self.configure("https://api.example.com/webhooks/replicate", "whsec_" + base64.b64encode(self.key).decode())
+        body = b'{"id": "not-running-here", "status": "succeeded"}'
+        self.assertEqual(self.client.post("/webhooks/replicate", content=body).status_code, 401)
+        self.assertEqual(self.post_signed(body, b"another-key").status_code, 401)
+        response = self.post_signed(body, self.key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"delivered": False})
+
+    def test_malformed_signed_body_is_a_client_error(self):
+        self.configure("https://api.example.com/webhooks/replicate", "whsec_" + base64.b64encode(self.key).decode())
+        self.assertEqual(self.post_signed(b'{"id": "p1", ', self.key).status_code, 400)
+        self.assertEqual(self.post_signed(b'["p1"]', self.key).status_code, 400)
+
+class TestBackpressure(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        self.executor = app_module.CPU_EXECUTOR
+        self.saved_limits = (self.executor.max_workers, self.executor.max_queue)
+
+    def tearDown(self):
+        self.executor.max_workers, self.executor.max_queue = self.saved_limits
+
+    def test_stylize_returns_503_when_cpu_pool_saturated(self):
+        self.executor.max_workers, self.executor.max_queue = 0, 0
+        jobs_before = len(app_module.JOB_STORE)
+
+        response = self.client.post(
+            "/stylize",
+            files={"file": ("busy.png", make_png(seed=3), "image/png")},
+        )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], str(self.executor.retry_after))
+        self.assertEqual(len(app_module.JOB_STORE), jobs_before)  # Rejected jobs are not kept
+
+    def test_batch_is_refused_as_a_whole_when_cpu_pool_saturated(self):
+        self.executor.max_workers, self.executor.max_queue = 0, 0
+        jobs_before = len(app_module.JOB_STORE)
+
+        files = [("files", (f"busy{i}.png", make_png(seed=40 + i), "image/png")) for i in range(2)]
+        response = self.client.post("/batch/stylize", files=files)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(app_module.JOB_STORE), jobs_before)
+
+    def test_layers_released_when_batch_is_refused(self):
+        run, calls = self.executor.run, []
+
+        async def saturate_after_first(*args, **kwargs):
+            calls.append(args[0])
+            if len(calls) > 1:
+                raise app_module.ExecutorSaturated(self.executor.retry_after)
+            return await run(*args, **kwargs)
+
+        layers_before = app_module.LAYERS.stats()["layers"]
+        jobs_before = len(app_module.JOB_STORE)
+        files = [("files", (f"half{i}.png", make_png(width=128, seed=1 + i), "image/png")) for i in range(2)]
+        with mock.patch.object(self.executor, "run", saturate_after_first):
+            response = self.client.post("/batch/stylize", files=files)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(calls), 2)  # The first image got its edge map (and layer) before the refusal
+        self.assertEqual(app_module.LAYERS.stats()["layers"], layers_before)
+        self.assertEqual(len(app_module.JOB_STORE), jobs_before)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
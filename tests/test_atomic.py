@@ -0,0 +1,47 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.atomic import atomic_path, temp_path, write_atomically
+
+class TestAtomicWrites(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = Path(self.tmp_dir.name) / "layer.png"
+
+    def test_write_replaces_the_file_and_leaves_no_temp(self):
+        write_atomically(self.path, b"first")
+        write_atomically(self.path, b"second")
+        self.assertEqual(self.path.read_bytes(), b"second")
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["layer.png"])
+
+    def test_failed_write_keeps_the_old_file(self):
+        write_atomically(self.path, b"kept")
+        with self.assertRaises(RuntimeError):
+            with atomic_path(self.path) as tmp:
+                tmp.write_bytes(b"half")
+                raise RuntimeError("writer died")
+        self.assertEqual(self.path.read_bytes(), b"kept")
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["layer.png"])
+
+    def test_never_writes_through_a_hard_link(self):
+        other_job = Path(self.tmp_dir.name) / "other.png"
+        other_job.write_bytes(b"other job")
+        os.link(other_job, self.path)
+        write_atomically(self.path, b"this job")
+        self.assertEqual(other_job.read_bytes(), b"other job")
+        self.assertEqual(self.path.read_bytes(), b"this job")
+
+    def test_temp_names_are_unique_hidden_and_keep_the_suffix(self):
+        names = {temp_path(self.path).name for _ in range(100)}
+        self.assertEqual(len(names), 100)
+        self.assertTrue(all(name.startswith(".") and name.endswith(".png") for name in names))
+
+if __name__ == '__main__':
+    unittest.main()
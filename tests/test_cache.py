@@ -0,0 +1,106 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.cache import ResultCache, edge_cache_key, stylized_cache_key
+
+class TestCacheKeys(unittest.TestCase):
+    def test_edge_key_covers_bytes_and_params(self):
+        base = edge_cache_key(b"image", 100, 200, 5)
+        self.assertEqual(base, edge_cache_key(b"image", 100, 200, 5))
+        self.assertNotEqual(base, edge_cache_key(b"image2", 100, 200, 5))
+        self.assertNotEqual(base, edge_cache_key(b"image", 50, 200, 5))
+        self.assertNotEqual(base, edge_cache_key(b"image", 100, 150, 5))
+        self.assertNotEqual(base, edge_cache_key(b"image", 100, 200, 3))
+
+    def test_stylized_key_covers_model_and_prompt(self):
+        base = stylized_cache_key("edge", "owner/model", "ink")
+        self.assertNotEqual(base, stylized_cache_key("edge2", "owner/model", "ink"))
+        self.assertNotEqual(base, stylized_cache_key("edge", "owner/other", "ink"))
+        self.assertNotEqual(base, stylized_cache_key("edge", "owner/model", "charcoal"))
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        self.cache_dir = self.root / "cache"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_file(self, name: str, size: int) -> Path:
+        path = self.root / name
+        path.write_bytes(b"x" * size)
+        return path
+
+    def test_put_get_and_metrics(self):
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        self.assertIsNone(cache.get("edge", "k1"))
+        cache.put("edge", "k1", self.make_file("a.png", 10))
+        cached = cache.get("edge", "k1")
+        self.assertEqual(cached.read_bytes(), b"x" * 10)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], {"edge": 1})
+        self.assertEqual(stats["misses"], {"edge": 1})
+        self.assertEqual(stats["bytes"], 10)
+
+    def test_lru_eviction_by_total_bytes(self):
+        cache = ResultCache(self.cache_dir, max_bytes=250)
+        cache.put("edge", "a", self.make_file("a.png", 100))
+        cache.put("edge", "b", self.make_file("b.png", 100))
+        cache.get("edge", "a")  # a is now more recent than b
+        cache.put("edge", "c", self.make_file("c.png", 100))
+        self.assertIsNotNone(cache.get("edge", "a"))
+        self.assertIsNone(cache.get("edge", "b"))
+        self.assertIsNotNone(cache.get("edge", "c"))
+        self.assertLessEqual(cache.stats()["bytes"], 250)
+
+    def test_index_rebuilt_from_disk(self):
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        cache.put("stylized", "k", self.make_file("s.png", 42))
+        reopened = ResultCache(self.cache_dir, max_bytes=1000)
+        self.assertIsNotNone(reopened.get("stylized", "k"))
+        self.assertEqual(reopened.stats()["bytes"], 42)
+
+    def test_entry_removed_by_another_worker_is_a_miss(self):
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        path = cache.put("edge", "k", self.make_file("a.png", 10))
+        path.unlink()
+        self.assertIsNone(cache.get("edge", "k"))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+    def test_workers_storing_the_same_key_never_touch_job_files(self):
+        # One cache instance per worker, all on the same directory, storing the same key at once
+        caches = [ResultCache(self.cache_dir, max_bytes=10 ** 9) for _ in range(8)]
+        job_files = [self.make_file(f"job{i}.png", 0) for i in range(len(caches))]
+        for i, path in enumerate(job_files):
+            path.write_bytes(str(i).encode() * 20000)
+
+        def store(i: int):
+            for _ in range(50):
+                caches[i].put("stylized", "same-key", job_files[i])
+
+        threads = [threading.Thread(target=store, args=(i,)) for i in range(len(caches))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i, path in enumerate(job_files):
+            self.assertEqual(path.read_bytes(), str(i).encode() * 20000)
+        self.assertEqual([p.name for p in self.cache_dir.iterdir()], ["stylized_same-key.png"])
+
+    def test_disabled_cache(self):
+        cache = ResultCache(self.cache_dir, max_bytes=0)
+        self.assertIsNone(cache.put("edge", "k", self.make_file("a.png", 10)))
+        self.assertIsNone(cache.get("edge", "k"))
+        self.assertFalse(self.cache_dir.exists())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,238 @@
+import unittest
+import io
+import json
+import os
+import shutil
+import sys
+import zipfile
+import numpy as np
+from pathlib import Path
+from PIL import Image
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.composer import (
+    ensure_rgba_and_transparent_background, merge_layers, build_download_artifacts,
+    stream_zip_bundle, create_zip_bundle, normalize_frames, build_preview, create_gif_preview,
+    _ffmpeg_executable,
+)
+
+def reference_rgba(image_path, primary_color=(0, 0, 0), background_color_value=255):
+    """The original per-pixel implementation, kept here to check the vectorized one."""
+    img = Image.open(image_path).convert("L")
+    rgba_img = Image.new("RGBA", img.size)
+    pixels = img.load()
+    rgba_pixels = rgba_img.load()
+    for y in range(img.height):
+        for x in range(img.width):
+            if pixels[x, y] == background_color_value:
+                rgba_pixels[x, y] = (0, 0, 0, 0)
+            else:
+                rgba_pixels[x, y] = primary_color + (255,)
+    return rgba_img
+
+class TestComposer(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = Path('tests/test_data')
+        self.test_dir.mkdir(parents=True, exist_ok=True)
+
+        # Edge map like Canny output: white lines on black, plus a few grey (soft) pixels
+        edges = np.zeros((40, 60), dtype=np.uint8)
+        edges[10, 5:55] = 255
+        edges[5:35, 30] = 255
+        edges[20, 10:20] = 128
+        edges[25, 10:20] = 20
+        self.edge_map_path = self.test_dir / 'edge_composer.png'
+        Image.fromarray(edges, "L").save(self.edge_map_path)
+
+        self.stylized_path = self.test_dir / 'stylized_composer.png'
+        Image.new("RGB", (60, 40), (200, 100, 50)).save(self.stylized_path)
+        self.composite_path = self.test_dir / 'composite_composer.png'
+
+    def tearDown(self):
+        for path in (self.edge_map_path, self.stylized_path, self.composite_path):
+            if path.exists():
+                path.unlink()
+
+    def test_matches_per_pixel_reference(self):
+        for bg in (255, 0):
+            for color in ((0, 0, 0), (10, 20, 30)):
+                expected = reference_rgba(self.edge_map_path, color, bg)
+                actual = ensure_rgba_and_transparent_background(
+                    self.edge_map_path, primary_color=color, background_color_value=bg
+                )
+                self.assertEqual(actual.mode, "RGBA")
+                self.assertEqual(actual.tobytes(), expected.tobytes())
+
+    def test_threshold_treats_near_background_as_transparent(self):
+        rgba = np.asarray(ensure_rgba_and_transparent_background(
+            self.edge_map_path, primary_color=(255, 0, 0), background_color_value=0, threshold=50
+        ))
+        self.assertEqual(rgba[25, 15, 3], 0)  # 20 is within threshold of black
+        self.assertEqual(rgba[20, 15, 3], 255)
+        self.assertEqual(tuple(rgba[10, 20]), (255, 0, 0, 255))
+
+    def test_antialias_ramps_alpha(self):
+        rgba = np.asarray(ensure_rgba_and_transparent_background(
+            self.edge_map_path, background_color_value=0, antialias=True
+        ))
+        self.assertEqual(rgba[0, 0, 3], 0)
+        self.assertEqual(rgba[10, 20, 3], 255)
+        self.assertTrue(0 < rgba[20, 15, 3] < 255)
+
+    def test_merge_layers_draws_edges_over_stylized(self):
+        merge_layers(self.stylized_path, self.edge_map_path, self.composite_path)
+        composite = np.asarray(Image.open(self.composite_path).convert("RGB"))
+        self.assertEqual(tuple(composite[0, 0]), (200, 100, 50))  # Background shows through
+        self.assertEqual(tuple(composite[10, 20]), (0, 0, 0))  # Edge drawn in black
+
+    def test_merge_layers_scales_edge_map_to_stylized_size(self):
+        Image.new("RGB", (30, 20), (200, 100, 50)).save(self.stylized_path)
+        merge_layers(self.stylized_path, self.edge_map_path, self.composite_path)
+        self.assertEqual(Image.open(self.composite_path).size, (30, 20))
+
+    def test_build_download_artifacts_is_idempotent(self):
+        artifacts = build_download_artifacts("job-x", self.edge_map_path, self.stylized_path, self.test_dir, "composer")
+        composite_path = Path(artifacts["composite_image_path"])
+        try:
+            self.assertTrue(composite_path.exists())
+            built_at = composite_path.stat().st_mtime_ns
+            again = build_download_artifacts("job-x", self.edge_map_path, self.stylized_path, self.test_dir, "composer")
+            self.assertEqual(again, artifacts)
+            self.assertEqual(composite_path.stat().st_mtime_ns, built_at)
+            self.assertEqual(list(self.test_dir.glob(".tmp_*")), [])
+        finally:
+            for path in artifacts.values():
+                if path and Path(path).exists():
+                    Path(path).unlink()
+
+    def test_build_download_artifacts_webp_preview(self):
+        artifacts = build_download_artifacts(
+            "job-w", self.edge_map_path, self.stylized_path, self.test_dir, "composer", preview_format="webp"
+        )
+        try:
+            with Image.open(artifacts["preview_path"]) as preview:
+                self.assertEqual((preview.format, preview.n_frames), ("WEBP", 3))
+        finally:
+            for path in artifacts.values():
+                if path and Path(path).exists():
+                    Path(path).unlink()
+
+    def test_stream_zip_bundle_stores_images_and_deflates_text(self):
+        files = {"01_edges.png": self.edge_map_path, "02_stylized.png": self.stylized_path, "missing.png": Path("nope.png")}
+        chunks = list(stream_zip_bundle("job-z", files, chunk_size=64))
+        self.assertGreater(len(chunks), 2)  # Sent as it is produced, not in one piece
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), ["01_edges.png", "02_stylized.png", "steps.json"])
+            self.assertEqual(zf.getinfo("01_edges.png").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(zf.getinfo("steps.json").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(zf.read("01_edges.png"), self.edge_map_path.read_bytes())
+            self.assertEqual(json.loads(zf.read("steps.json"))["job_id"], "job-z")
+
+    def test_stream_zip_bundle_survives_files_deleted_while_streaming(self):
+        job_dir = self.test_dir / "swept_job"
+        job_dir.mkdir(exist_ok=True)
+        edges = job_dir / "edges.png"
+        stylized = job_dir / "stylized.png"
+        shutil.copyfile(self.edge_map_path, edges)
+        shutil.copyfile(self.stylized_path, stylized)
+        stream = stream_zip_bundle("job-s", {"01_edges.png": edges, "02_stylized.png": stylized}, chunk_size=64)
+        first = next(stream)
+        shutil.rmtree(job_dir)  # Evicted by the storage sweep mid-download
+
+        with zipfile.ZipFile(io.BytesIO(first + b"".join(stream))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.read("01_edges.png"), self.edge_map_path.read_bytes())
+            self.assertEqual(zf.read("02_stylized.png"), self.stylized_path.read_bytes())
+
+    def test_create_zip_bundle_writes_the_streamed_archive(self):
+        zip_path = self.test_dir / "bundle_composer.zip"
+        try:
+            create_zip_bundle("job-z", {"edges.png": self.edge_map_path}, zip_path)
+            with zipfile.ZipFile(zip_path) as zf:
+                self.assertEqual(zf.read("edges.png"), self.edge_map_path.read_bytes())
+        finally:
+            if zip_path.exists():
+                zip_path.unlink()
+
+class TestPreview(unittest.TestCase):
+    def setUp(self):
+        # Mixed sizes and modes, like real layers: big grayscale edge map, smaller RGB/RGBA outputs
+        edges = np.zeros((300, 400), dtype=np.uint8)
+        edges[100, 50:350] = 255
+        self.frames = [
+            edges,
+            Image.new("RGB", (200, 150), (200, 100, 50)),
+            Image.new("RGBA", (200, 150), (0, 0, 255, 0)),  # Fully transparent
+        ]
+        self.output_dir = Path('tests/test_data')
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.outputs = []
+
+    def tearDown(self):
+        for path in self.outputs:
+            path.unlink(missing_ok=True)
+
+    def output(self, name) -> Path:
+        path = self.output_dir / name
+        self.outputs.append(path)
+        return path
+
+    def test_normalize_frames_one_size_and_mode(self):
+        frames = normalize_frames(self.frames, max_side=100)
+        self.assertEqual({(f.mode, f.size) for f in frames}, {("RGB", (100, 75))})
+        self.assertEqual(frames[2].getpixel((0, 0)), (255, 255, 255))  # Transparency becomes white
+        self.assertEqual(normalize_frames(self.frames, max_side=None)[1].size, (400, 300))
+        self.assertEqual(normalize_frames([Image.new("RGB", (101, 51))], even=True)[0].size, (100, 50))
+
+    def test_gif_frames_share_one_palette(self):
+        from PIL import GifImagePlugin
+        path = build_preview(self.frames, self.output("preview_test.gif"), duration_ms=250)
+        saved_strategy = GifImagePlugin.LOADING_STRATEGY
+        # With this strategy, frames only turn RGB when their palette differs from the first one's
+        GifImagePlugin.LOADING_STRATEGY = GifImagePlugin.LoadingStrategy.RGB_AFTER_DIFFERENT_PALETTE_ONLY
+        try:
+            with Image.open(path) as gif:
+                self.assertEqual(gif.n_frames, 3)
+                self.assertEqual(gif.info["loop"], 0)
+                for i in range(gif.n_frames):
+                    gif.seek(i)
+                    gif.load()
+                    self.assertEqual(gif.info["duration"], 250)
+                    self.assertEqual(gif.mode, "P")
+        finally:
+            GifImagePlugin.LOADING_STRATEGY = saved_strategy
+
+    def test_webp_preview(self):
+        path = build_preview(self.frames, self.output("preview_test.webp"))
+        with Image.open(path) as webp:
+            self.assertEqual((webp.n_frames, webp.size), (3, (400, 300)))
+
+    def test_mp4_preview_is_piped_to_ffmpeg(self):
+        import shutil
+        if not shutil.which(_ffmpeg_executable()):
+            self.skipTest("ffmpeg not available")
+        path = build_preview(self.frames, self.output("preview_test.mp4"))
+        self.assertIsNotNone(path)
+        self.assertEqual(path.read_bytes()[4:8], b"ftyp")
+        self.assertEqual(list(self.output_dir.glob("*frame*")), [])
+
+    def test_unknown_format_rejected(self):
+        with self.assertRaises(ValueError):
+            build_preview(self.frames, self.output("preview_test.avi"))
+
+    def test_create_gif_preview_from_paths(self):
+        paths = []
+        for i, frame in enumerate(self.frames[1:]):
+            path = self.output(f"frame_test_{i}.png")
+            frame.save(path)
+            paths.append(path)
+        gif_path = create_gif_preview(paths + [Path("missing.png")], self.output("legacy_test.gif"))
+        with Image.open(gif_path) as gif:
+            self.assertEqual(gif.n_frames, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.events import JobEventBroker
+
+class TestJobEventBroker(unittest.TestCase):
+    def test_fans_out_to_every_subscriber_of_the_job(self):
+        async def scenario():
+            broker = JobEventBroker()
+            first, second = broker.subscribe("job-1"), broker.subscribe("job-1")
+            other = broker.subscribe("job-2")
+            self.assertEqual(broker.publish("job-1", {"status": "processing_replicate"}), 2)
+            self.assertEqual(await first.get(timeout=1), {"status": "processing_replicate"})
+            self.assertEqual(await second.get(timeout=1), {"status": "processing_replicate"})
+            with self.assertRaises(asyncio.TimeoutError):
+                await other.get(timeout=0.01)
+
+            broker.unsubscribe(first)
+            broker.unsubscribe(second)
+            self.assertFalse(broker.has_subscribers("job-1"))
+            self.assertEqual(broker.publish("job-1", {"status": "complete"}), 0)
+            self.assertEqual(broker.subscriber_count(), 1)
+
+        asyncio.run(scenario())
+
+    def test_slow_subscriber_keeps_newest_events(self):
+        async def scenario():
+            broker = JobEventBroker(max_queue=2)
+            subscription = broker.subscribe("job-1")
+            for i in range(5):
+                broker.publish("job-1", {"n": i})
+            self.assertEqual(subscription.dropped, 3)
+            self.assertEqual([(await subscription.get(timeout=1))["n"] for _ in range(2)], [3, 4])
+
+        asyncio.run(scenario())
+
+    def test_publish_from_another_thread(self):
+        async def scenario():
+            broker = JobEventBroker()
+            subscription = broker.subscribe("job-1")
+            thread = threading.Thread(target=broker.publish, args=("job-1", {"status": "complete"}))
+            thread.start()
+            event = await subscription.get(timeout=1)
+            thread.join()
+            self.assertEqual(event, {"status": "complete"})
+
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()
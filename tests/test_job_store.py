@@ -0,0 +1,198 @@
+import unittest
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.job_store import AsyncJobStore, InMemoryJobStore, SQLiteJobStore, create_job_store
+
+def _claim_from_other_process(db_path: str, job_id: str) -> bool:
+    store = SQLiteJobStore(Path(db_path))
+    return store.transition(job_id, "processing_replicate", from_statuses=("processing_canny",))
+
+class JobStoreContract:
+    """Behaviour shared by every job store backend."""
+
+    def make_store(self, ttl_seconds=60):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_create_and_get(self):
+        self.store.create("job-1", "processing_upload", original_filename="cat.png", edge_map_path=Path("a/b.png"))
+        job = self.store.get("job-1")
+        self.assertEqual(job["status"], "processing_upload")
+        self.assertEqual(job["original_filename"], "cat.png")
+        self.assertEqual(job["edge_map_path"], "a/b.png")  # Paths come back as strings
+        self.assertIsNone(self.store.get("missing"))
+        self.assertEqual(len(self.store), 1)
+
+    def test_duplicate_create_rejected(self):
+        self.store.create("job-1", "processing_upload")
+        with self.assertRaises(KeyError):
+            self.store.create("job-1", "processing_upload")
+
+    def test_update_merges_fields(self):
+        self.store.create("job-1", "processing_canny", original_filename="cat.png")
+        self.assertTrue(self.store.update("job-1", edge_map_path="x.png"))
+        job = self.store.get("job-1")
+        self.assertEqual(job["status"], "processing_canny")
+        self.assertEqual(job["original_filename"], "cat.png")
+        self.assertEqual(job["edge_map_path"], "x.png")
+        self.assertFalse(self.store.update("missing", edge_map_path="x.png"))
+        with self.assertRaises(ValueError):
+            self.store.update("job-1", status="complete")
+
+    def test_listeners_see_every_change(self):
+        seen = []
+        self.store.add_listener(lambda job_id, record: seen.append((job_id, record and record["status"], record and record.get("stylized_image_path"))))
+        self.store.create("job-1", "processing_canny")
+        self.store.transition("job-1", "complete", from_statuses=("processing_replicate",))  # Refused: no event
+        self.store.transition("job-1", "complete", stylized_image_path="s.png")
+        self.store.delete("job-1")
+        self.assertEqual(seen, [
+            ("job-1", "processing_canny", None),
+            ("job-1", "complete", "s.png"),
+            ("job-1", None, None),
+        ])
+
+    def test_transition_checks_current_status(self):
+        self.store.create("job-1", "processing_canny")
+        self.assertFalse(self.store.transition("job-1", "complete", from_statuses=("processing_replicate",)))
+        self.assertTrue(self.store.transition("job-1", "processing_replicate", from_statuses=("processing_canny",)))
+        self.assertTrue(self.store.transition("job-1", "complete", from_statuses=("processing_replicate",), stylized_image_path="s.png"))
+        job = self.store.get("job-1")
+        self.assertEqual(job["status"], "complete")
+        self.assertEqual(job["stylized_image_path"], "s.png")
+
+    def test_find_by_status(self):
+        self.store.create("job-1", "processing_replicate")
+        self.store.create("job-2", "complete")
+        self.store.create("job-3", "processing_replicate")
+        found = sorted(job["job_id"] for job in self.store.find_by_status("processing_replicate"))
+        self.assertEqual(found, ["job-1", "job-3"])
+
+    def test_ttl_expiry(self):
+        store = self.make_store(ttl_seconds=0.05)
+        store.create("job-1", "complete")
+        self.assertIsNotNone(store.get("job-1"))
+        time.sleep(0.1)
+        self.assertIsNone(store.get("job-1"))
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.purge_expired(), ["job-1"])
+        store.create("job-1", "processing_upload")  # The id is free again
+
+    def test_delete(self):
+        self.store.create("job-1", "complete")
+        self.assertTrue(self.store.delete("job-1"))
+        self.assertFalse(self.store.delete("job-1"))
+        self.assertIsNone(self.store.get("job-1"))
+
+    def test_concurrent_transition_has_one_winner(self):
+        self.store.create("job-1", "processing_canny")
+        results = []
+
+        def claim():
+            results.append(self.store.transition("job-1", "processing_replicate", from_statuses=("processing_canny",)))
+
+        threads = [threading.Thread(target=claim) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 1)
+
+class TestInMemoryJobStore(JobStoreContract, unittest.TestCase):
+    def make_store(self, ttl_seconds=60):
+        return InMemoryJobStore(ttl_seconds=ttl_seconds)
+
+class TestSQLiteJobStore(JobStoreContract, unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "jobs.db"
+        super().setUp()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_store(self, ttl_seconds=60):
+        return SQLiteJobStore(self.db_path, ttl_seconds=ttl_seconds)
+
+    def test_uses_wal_mode(self):
+        mode = self.store._conn().execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_shared_across_processes(self):
+        self.store.create("job-1", "processing_canny")
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(_claim_from_other_process, [str(self.db_path)] * 4, ["job-1"] * 4))
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(self.store.get("job-1")["status"], "processing_replicate")
+
+class TestAsyncJobStore(unittest.TestCase):
+    def test_locked_sqlite_write_does_not_block_the_loop(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = SQLiteJobStore(Path(tmp) / "jobs.db")
+            store.create("job-1", "processing_canny")
+            # Another worker holds the write lock for a while
+            other = sqlite3.connect(store.db_path, isolation_level=None, check_same_thread=False)
+            other.execute("BEGIN IMMEDIATE")
+            threading.Timer(0.3, other.rollback).start()
+
+            async def scenario():
+                ticks = 0
+
+                async def tick():
+                    nonlocal ticks
+                    while True:
+                        ticks += 1
+                        await asyncio.sleep(0.01)
+
+                ticker = asyncio.create_task(tick())
+                updated = await AsyncJobStore(store).update("job-1", prediction_id="p-1")
+                ticker.cancel()
+                return updated, ticks
+
+            updated, ticks = asyncio.run(scenario())
+            other.close()
+            self.assertTrue(updated)
+            self.assertGreater(ticks, 10)  # The loop kept running while the write waited
+            self.assertEqual(store.get("job-1")["prediction_id"], "p-1")
+
+    def test_in_memory_store_is_called_in_place(self):
+        store = InMemoryJobStore()
+        threads = []
+        store.add_listener(lambda job_id, record: threads.append(threading.get_ident()))
+
+        async def scenario():
+            jobs = AsyncJobStore(store)
+            await jobs.create("job-1", "processing_canny")
+            self.assertTrue(await jobs.transition("job-1", "complete", from_statuses=("processing_canny",)))
+            self.assertEqual((await jobs.get("job-1"))["status"], "complete")
+            self.assertTrue(await jobs.delete("job-1"))
+
+        asyncio.run(scenario())
+        # Listeners ran on the loop's thread, so they may read loop-only state
+        self.assertEqual(set(threads), {threading.get_ident()})
+
+class TestCreateJobStore(unittest.TestCase):
+    def test_from_url(self):
+        self.assertIsInstance(create_job_store("memory://"), InMemoryJobStore)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = create_job_store(f"sqlite:///{tmp}/jobs.db", ttl_seconds=5)
+            self.assertIsInstance(store, SQLiteJobStore)
+            self.assertEqual(store.ttl_seconds, 5)
+        with self.assertRaises(ValueError):
+            create_job_store("redis://localhost")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.layers import LayerStore
+
+class TestLayerStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_put_writes_once_and_keeps_bytes(self):
+        store = LayerStore(max_bytes=1000)
+        path = store.put("job-1", "edge", b"edge-png", self.dir / "job-1" / "edge.png")
+        self.assertEqual(path.read_bytes(), b"edge-png")
+        self.assertEqual(store.get("job-1", "edge"), b"edge-png")
+        self.assertEqual(store.source("job-1", "edge", path), b"edge-png")
+        self.assertEqual(list(path.parent.iterdir()), [path])  # No temp files left
+
+    def test_drop_releases_memory_but_keeps_files(self):
+        store = LayerStore(max_bytes=1000)
+        path = store.put("job-1", "edge", b"a" * 10, self.dir / "edge.png")
+        store.put("job-1", "stylized", b"b" * 20, self.dir / "stylized.png")
+        store.put("job-2", "edge", b"c" * 30, self.dir / "other.png")
+        store.drop("job-1")
+        self.assertIsNone(store.get("job-1", "edge"))
+        self.assertEqual(store.source("job-1", "edge", path), path)
+        self.assertTrue(path.exists())
+        self.assertEqual(store.stats()["bytes"], 30)
+
+    def test_over_budget_spills_oldest_layers(self):
+        store = LayerStore(max_bytes=25)
+        first = store.put("job-1", "edge", b"a" * 10, self.dir / "a.png", persist=False)
+        self.assertFalse(first.exists())  # Not persisted until it has to be
+        store.put("job-2", "edge", b"b" * 10, self.dir / "b.png", persist=False)
+        store.put("job-3", "edge", b"c" * 10, self.dir / "c.png", persist=False)
+
+        self.assertIsNone(store.get("job-1", "edge"))
+        self.assertEqual(first.read_bytes(), b"a" * 10)  # Spilled to disk
+        self.assertEqual(store.get("job-3", "edge"), b"c" * 10)
+        self.assertEqual(store.stats(), {"layers": 2, "bytes": 20, "max_bytes": 25, "spilled": 1})
+
+        big = store.put("job-4", "edge", b"d" * 100, self.dir / "d.png", persist=False)
+        self.assertIsNone(store.get("job-4", "edge"))
+        self.assertEqual(big.read_bytes(), b"d" * 100)
+
+    def test_replacing_a_layer_does_not_double_count(self):
+        store = LayerStore(max_bytes=100)
+        store.put("job-1", "edge", b"a" * 40, self.dir / "a.png")
+        store.put("job-1", "edge", b"b" * 30, self.dir / "a.png")
+        self.assertEqual(store.stats()["bytes"], 30)
+        self.assertEqual((self.dir / "a.png").read_bytes(), b"b" * 30)
+
+if __name__ == '__main__':
+    unittest.main()
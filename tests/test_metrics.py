@@ -0,0 +1,99 @@
+import unittest
+import asyncio
+import os
+import sys
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import metrics
+
+class TestMetricTypes(unittest.TestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 3.0):
+            histogram.observe(value, stage="canny")
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{stage="canny",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="canny",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="canny",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_sum{stage="canny"} 4.05', lines)
+        self.assertIn('test_seconds_count{stage="canny"} 4', lines)
+        self.assertEqual(lines[1], "# TYPE test_seconds histogram")
+
+    def test_counter_and_callback_metrics(self):
+        registry = metrics.Registry()
+        counter = registry.register(metrics.Counter("test_failures", "Test.", ("stage",)))
+        counter.inc(stage="stylize")
+        counter.inc(2, stage="stylize")
+        registry.register(metrics.CallbackMetric("test_jobs", "Test.", lambda: 3))
+        registry.register(metrics.CallbackMetric(
+            "test_hits", "Test.", lambda: {"edge": 5}, type="counter", label_names=("kind",)
+        ))
+        registry.register(metrics.CallbackMetric("test_broken", "Test.", lambda: 1 / 0))
+
+        text = registry.render()
+        self.assertIn('test_failures_total{stage="stylize"} 3\n', text)
+        self.assertIn("test_jobs 3\n", text)
+        self.assertIn('test_hits_total{kind="edge"} 5\n', text)
+        self.assertIn("# test_broken unavailable", text)
+        with self.assertRaises(ValueError):
+            counter.inc(kind="edge")
+
+class TestTimingHook(unittest.TestCase):
+    def setUp(self):
+        self.was_enabled = metrics.enabled()
+        metrics.set_enabled(True)
+
+    def tearDown(self):
+        metrics.set_enabled(self.was_enabled)
+
+    def count(self, stage):
+        return metrics.STAGE_SECONDS.count(stage=stage)
+
+    def test_context_manager_and_decorators(self):
+        before = self.count("test_stage")
+        with metrics.timed("test_stage"):
+            pass
+
+        @metrics.timed("test_stage")
+        def work():
+            return 1
+
+        @metrics.timed("test_stage")
+        async def async_work():
+            await asyncio.sleep(0)
+            return 2
+
+        self.assertEqual(work(), 1)
+        self.assertEqual(asyncio.run(async_work()), 2)
+        self.assertEqual(self.count("test_stage"), before + 3)
+
+    def test_disabled_records_nothing(self):
+        metrics.set_enabled(False)
+        before = self.count("test_disabled")
+        with metrics.timed("test_disabled"):
+            pass
+        self.assertEqual(list(metrics.timed_iter("test_disabled", [1, 2])), [1, 2])
+        self.assertEqual(self.count("test_disabled"), before)
+
+    def test_call_collecting_returns_observations_instead(self):
+        def work():
+            with metrics.timed("test_collected"):
+                return "done"
+
+        before = self.count("test_collected")
+        result, observations = metrics.call_collecting(work)
+        self.assertEqual(result, "done")
+        self.assertEqual([stage for stage, _ in observations], ["test_collected"])
+        self.assertEqual(self.count("test_collected"), before)
+        metrics.record_observations(observations)
+        self.assertEqual(self.count("test_collected"), before + 1)
+
+    def test_timed_iter_records_once_when_exhausted(self):
+        before = self.count("test_iter")
+        self.assertEqual(list(metrics.timed_iter("test_iter", iter(range(3)))), [0, 1, 2])
+        self.assertEqual(self.count("test_iter"), before + 1)
+
+if __name__ == '__main__':
+    unittest.main()
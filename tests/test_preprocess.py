@@ -4,11 +4,19 @@ import sys
 import cv2
 import numpy as np
 from pathlib import Path
+from unittest import mock
 
 # Add the parent directory to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend.preprocess.image import canny_edge
+from backend import options, preprocess
+from backend.preprocess import (
+    CONTROL_FILTERS, canny_edge, canny_edge_png, compute_control_maps, decode_reduced, detect_edges,
+    edge_map_previews, edge_map_svg, encode_png, parse_control_filters, tiled_canny, write_edge_svg,
+)
+import re
+import tempfile
+import xml.etree.ElementTree as ET
 
 class TestPreprocessing(unittest.TestCase):
     def setUp(self):
@@ -60,5 +68,172 @@ class TestPreprocessing(unittest.TestCase):
         with self.assertRaises(ValueError):
             canny_edge(invalid_bytes, 'invalid.png')
 
+    def test_canny_edge_png_matches_file_output(self):
+        png = canny_edge_png(self.test_image_bytes)
+        edge_map_path = canny_edge(self.test_image_bytes, 'test_square.png')
+        try:
+            from_bytes = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_GRAYSCALE)
+            from_file = cv2.imread(str(edge_map_path), cv2.IMREAD_GRAYSCALE)
+            self.assertTrue(np.array_equal(from_bytes, from_file))
+        finally:
+            edge_map_path.unlink()
+
+    def test_canny_edge_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            canny_edge(self.test_image_bytes, 'test_square.png', mode='bogus')
+
+class TestLargeImageModes(unittest.TestCase):
+    def setUp(self):
+        # 3000x2000 photo-like image: gradient plus shapes, so there are edges everywhere
+        rng = np.random.default_rng(0)
+        img = np.zeros((2000, 3000, 3), dtype=np.uint8)
+        img[:] = np.linspace(0, 200, 3000, dtype=np.uint8)[None, :, None]
+        for _ in range(40):
+            x, y = rng.integers(0, 2800), rng.integers(0, 1800)
+            cv2.circle(img, (int(x), int(y)), int(rng.integers(20, 200)), [int(c) for c in rng.integers(0, 256, 3)], -1)
+        self.image = img
+        self.jpeg_bytes = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+        self.created = []
+
+    def tearDown(self):
+        for path in self.created:
+            path.unlink(missing_ok=True)
+
+    def test_reduced_mode_downscales_to_target(self):
+        edge_map_path = canny_edge(self.jpeg_bytes, 'large.jpg', mode='reduced', target_size=768)
+        self.created.append(edge_map_path)
+        edge_map = cv2.imread(str(edge_map_path), cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(edge_map.shape, (512, 768))
+        self.assertTrue(np.any(edge_map == 255))
+
+    def test_decode_reduced_keeps_small_images(self):
+        small = cv2.imencode('.png', self.image[:300, :400])[1].tobytes()
+        self.assertEqual(decode_reduced(small, 768).shape, (300, 400, 3))
+
+    def test_tiled_mode_matches_full_resolution(self):
+        full_path = canny_edge(self.jpeg_bytes, 'large.jpg')
+        tiled_path = canny_edge(self.jpeg_bytes, 'large.jpg', mode='tiled')
+        self.created += [full_path, tiled_path]
+        full = cv2.imread(str(full_path), cv2.IMREAD_GRAYSCALE)
+        tiled = cv2.imread(str(tiled_path), cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(full.shape, tiled.shape)
+        # Blurring before or after the gray conversion only differs by rounding
+        self.assertLess(np.mean(full != tiled), 0.001)
+
+    def test_edge_previews_form_a_pyramid(self):
+        edges = detect_edges(self.jpeg_bytes)
+        previews = edge_map_previews(edges, (256, 1024, 4000))
+        shapes = {size: cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE).shape
+                  for size, data in previews.items()}
+        self.assertEqual(shapes, {4000: (2000, 3000), 1024: (683, 1024), 256: (171, 256)})
+        self.assertEqual(previews[4000][8:12], b'WEBP')
+        # Thin edges survive the 12x reduction
+        self.assertGreater(np.mean(cv2.imdecode(np.frombuffer(previews[256], np.uint8), 0) > 64), 2 * np.mean(edges > 0))
+
+    def test_tiled_canny_has_no_seams(self):
+        gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        whole = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 100, 200)
+        tiled = tiled_canny(gray, 100, 200, 5, tile_size=256, overlap=32)
+        self.assertLess(np.mean(whole != tiled), 0.0005)
+
+class TestEdgeMapSvg(unittest.TestCase):
+    def svg_points(self, svg: bytes) -> list[np.ndarray]:
+        """Absolute vertices of each subpath of the one path in the SVG."""
+        d = ET.fromstring(svg).find("{http://www.w3.org/2000/svg}path").get("d")
+        subpaths = []
+        for start, moves in re.findall(r"M(-?\d+ -?\d+)l([-\d ]*)z", d):
+            deltas = np.array(moves.split(), dtype=int).reshape(-1, 2)
+            subpaths.append(np.cumsum(np.vstack([np.array(start.split(), dtype=int), deltas]), axis=0))
+        return subpaths
+
+    def test_lines_become_simplified_subpaths(self):
+        edges = np.zeros((200, 300), np.uint8)
+        cv2.rectangle(edges, (20, 30), (120, 150), 255, 1)
+        cv2.circle(edges, (220, 100), 50, 255, 1)
+        edges[5, 5] = 255  # Speck
+        svg = edge_map_svg(edges)
+        root = ET.fromstring(svg)
+        self.assertEqual(root.get("viewBox"), "0 0 300 200")
+        subpaths = self.svg_points(svg)
+        self.assertEqual(len(subpaths), 2)  # Once per line, the speck left out
+        rectangle = next(points for points in subpaths if len(points) == 4)
+        self.assertEqual(sorted(map(tuple, rectangle)), [(20, 30), (20, 150), (120, 30), (120, 150)])
+
+    def test_svg_retraces_the_edges(self):
+        rng = np.random.default_rng(3)
+        img = np.full((600, 800), 30, np.uint8)
+        for _ in range(15):
+            cv2.circle(img, (int(rng.integers(0, 800)), int(rng.integers(0, 600))), int(rng.integers(20, 120)),
+                       int(rng.integers(80, 256)), -1)
+        edges = detect_edges(cv2.imencode(".png", img)[1].tobytes())
+        svg = edge_map_svg(edges)
+        drawn = np.zeros_like(edges)
+        cv2.polylines(drawn, self.svg_points(svg), True, 255, 1)
+        # Within the approxPolyDP tolerance of an edge pixel, and covering nearly all of them
+        near = lambda mask: cv2.dilate(mask, np.ones((3, 3), np.uint8))
+        self.assertGreater(np.mean(near(edges)[drawn > 0] > 0), 0.97)
+        self.assertGreater(np.mean(near(drawn)[edges > 0] > 0), 0.9)
+        self.assertLess(len(svg), len(encode_png(edges)))
+
+    def test_write_edge_svg_accepts_png(self):
+        edges = np.zeros((64, 64), np.uint8)
+        cv2.line(edges, (5, 5), (50, 40), 255, 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_edge_svg(encode_png(edges), Path(tmp) / "edges.svg")
+            self.assertEqual(Path(path).read_bytes(), edge_map_svg(edges))
+            self.assertEqual(os.listdir(tmp), ["edges.svg"])
+
+class TestControlFilters(unittest.TestCase):
+    def setUp(self):
+        # Dark shapes on a mid-gray gradient
+        img = np.zeros((300, 400, 3), dtype=np.uint8)
+        img[:] = np.linspace(90, 170, 400, dtype=np.uint8)[None, :, None]
+        cv2.rectangle(img, (60, 60), (180, 200), (20, 20, 20), -1)
+        cv2.circle(img, (290, 150), 70, (40, 60, 200), -1)
+        self.image = img
+        self.png_bytes = cv2.imencode('.png', img)[1].tobytes()
+
+    def test_option_names_match_the_filters(self):
+        # The API checks requests against options.CONTROL_FILTER_NAMES without importing this module
+        self.assertEqual(tuple(CONTROL_FILTERS), options.CONTROL_FILTER_NAMES)
+
+    def test_all_filters_share_one_decode(self):
+        with mock.patch.object(preprocess.cv2, 'imdecode', wraps=cv2.imdecode) as imdecode:
+            maps = compute_control_maps(self.png_bytes, tuple(CONTROL_FILTERS))
+        self.assertEqual(imdecode.call_count, 1)
+        self.assertEqual(list(maps), list(CONTROL_FILTERS))
+        for name, control_map in maps.items():
+            self.assertEqual(control_map.shape, (300, 400), name)
+            self.assertEqual(control_map.dtype, np.uint8, name)
+            self.assertTrue(np.any(control_map > 0), name)
+
+    def test_canny_filter_matches_detect_edges(self):
+        maps = compute_control_maps(self.png_bytes, ('canny', 'sobel'))
+        np.testing.assert_array_equal(maps['canny'], detect_edges(self.png_bytes))
+
+    def test_parallel_matches_sequential(self):
+        filters = tuple(CONTROL_FILTERS)
+        sequential = compute_control_maps(self.png_bytes, filters, max_threads=1)
+        parallel = compute_control_maps(self.png_bytes, filters, max_threads=4)
+        for name in filters:
+            np.testing.assert_array_equal(sequential[name], parallel[name])
+
+    def test_auto_canny_adapts_to_dark_images(self):
+        dark = cv2.imencode('.png', (self.image * 0.25).astype(np.uint8))[1].tobytes()
+        maps = compute_control_maps(dark, ('canny', 'auto_canny'))
+        # Fixed 100/200 thresholds miss low-contrast outlines; the median rule scales with them
+        self.assertGreater(np.count_nonzero(maps['auto_canny']), 2 * np.count_nonzero(maps['canny']))
+
+    def test_silhouette_is_binary(self):
+        silhouette = compute_control_maps(self.png_bytes, ('silhouette',))['silhouette']
+        self.assertEqual(set(np.unique(silhouette)), {0, 255})
+        self.assertEqual(silhouette[5, 5], 0)  # Flat background stays black
+
+    def test_parse_control_filters(self):
+        self.assertEqual(parse_control_filters(None), ('canny',))
+        self.assertEqual(parse_control_filters(' sobel, canny,sobel '), ('sobel', 'canny'))
+        with self.assertRaises(ValueError):
+            parse_control_filters('canny,hed')
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
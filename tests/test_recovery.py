@@ -0,0 +1,53 @@
+import unittest
+import os
+import sys
+import time
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.job_store import InMemoryJobStore
+from backend.recovery import WorkerRegistry
+
+ACTIVE = ("processing_canny", "processing_replicate")
+
+class TestWorkerRegistry(unittest.TestCase):
+    def setUp(self):
+        self.store = InMemoryJobStore()
+        self.registry = WorkerRegistry(self.store, "me", lease_seconds=60)
+        self.registry.heartbeat()
+
+    def test_heartbeat_keeps_a_worker_alive(self):
+        self.assertTrue(self.registry.is_alive("me"))
+        self.assertFalse(self.registry.is_alive("stranger"))
+        self.registry.retire()
+        self.assertFalse(self.registry.is_alive("me"))
+
+    def test_expired_heartbeat_means_dead(self):
+        self.store.create("worker:old", "alive", kind="worker", alive_until=time.time() - 1)
+        self.assertFalse(self.registry.is_alive("old"))
+
+    def test_only_jobs_of_dead_workers_are_orphaned(self):
+        peer = WorkerRegistry(self.store, "peer")
+        peer.heartbeat()
+        self.store.create("mine", "processing_replicate", worker_id="me")
+        self.store.create("peers", "processing_replicate", worker_id="peer")
+        self.store.create("dead", "processing_replicate", worker_id="crashed")
+        self.store.create("legacy", "processing_canny")  # Written before jobs were stamped
+        self.store.create("done", "complete", worker_id="crashed")
+        self.store.create("flight:key", "processing_replicate", kind="flight")
+        orphans = self.registry.orphaned(ACTIVE)
+        self.assertEqual(sorted(job["job_id"] for job in orphans), ["dead", "legacy"])
+
+    def test_an_orphan_is_claimed_by_one_worker(self):
+        self.store.create("dead", "processing_replicate", worker_id="crashed")
+        other = WorkerRegistry(self.store, "other")
+        other.heartbeat()
+        job = self.registry.orphaned(ACTIVE)[0]
+        self.assertTrue(self.registry.claim(job))
+        self.assertFalse(other.claim(job))
+        self.assertEqual(self.store.get("dead")["worker_id"], "me")
+        self.assertEqual(other.orphaned(ACTIVE), [])  # Now owned by a live worker
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,240 @@
+import unittest
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import sys
+import tempfile
+import time
+import httpx
+from pathlib import Path
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend import replicate_client
+from backend.replicate_client import (
+    AsyncReplicateClient, ReplicateOutputError, ReplicatePredictionError, verify_webhook_signature,
+)
+from fake_replicate import create_fake_replicate_app
+
+FAKE_BASE_URL = "http://fake-replicate/v1"
+
+def make_client(fake_app, **kwargs) -> AsyncReplicateClient:
+    kwargs.setdefault("poll_interval", 0.01)
+    kwargs.setdefault("backoff_base", 0.001)
+    kwargs.setdefault("webhook_url", "")
+    return AsyncReplicateClient(
+        api_token="test-token", base_url=FAKE_BASE_URL, transport=httpx.ASGITransport(app=fake_app), **kwargs
+    )
+
+async def run_and_close(client, coro):
+    try:
+        return await coro
+    finally:
+        await client.aclose()
+
+class TestAsyncReplicateClient(unittest.TestCase):
+    def test_run_polls_until_output(self):
+        fake = create_fake_replicate_app(latency=0.05)
+        client = make_client(fake)
+        output = asyncio.run(run_and_close(client, client.run("owner/model", {"image": "", "prompt": "ink"})))
+        self.assertEqual(len(output), 1)
+        self.assertTrue(output[0].endswith(".png"))
+
+    def test_on_created_may_be_a_coroutine(self):
+        fake = create_fake_replicate_app()
+        client = make_client(fake)
+        recorded = []
+
+        async def record(prediction):
+            await asyncio.sleep(0)  # e.g. a job store write in a thread
+            recorded.append(prediction["id"])
+
+        output = asyncio.run(run_and_close(client, client.run("owner/model", {"prompt": "x"}, on_created=record)))
+        self.assertTrue(output)
+        self.assertEqual(len(recorded), 1)
+
+    def test_version_model_id_uses_predictions_endpoint(self):
+        fake = create_fake_replicate_app()
+        client = make_client(fake)
+        prediction = asyncio.run(run_and_close(client, client.create_prediction("owner/model:abc123", {"prompt": "x"})))
+        self.assertEqual(prediction["version"], "abc123")
+
+    def test_retries_injected_errors(self):
+        fake = create_fake_replicate_app(latency=0.02, error_rate=0.5, seed=1)
+        client = make_client(fake, max_retries=20)
+        output = asyncio.run(run_and_close(client, client.run("owner/model", {"prompt": "x"})))
+        self.assertTrue(output)
+        self.assertGreater(fake.state.calls, fake.state.created)  # Some calls were retried
+
+    def test_gives_up_after_max_retries(self):
+        fake = create_fake_replicate_app(error_rate=1.0, seed=1)
+        client = make_client(fake, max_retries=2)
+        with self.assertRaises(httpx.HTTPStatusError):
+            asyncio.run(run_and_close(client, client.run("owner/model", {"prompt": "x"})))
+        self.assertEqual(fake.state.calls, 3)
+
+    def test_create_is_not_resent_after_a_gateway_error(self):
+        fake = create_fake_replicate_app(gateway_errors=1)
+        client = make_client(fake)
+        with self.assertRaises(httpx.HTTPStatusError):
+            asyncio.run(run_and_close(client, client.create_prediction("owner/model", {"prompt": "x"})))
+        self.assertEqual((fake.state.create_calls, fake.state.created), (1, 1))
+
+    def test_failed_prediction_raises(self):
+        fake = create_fake_replicate_app(fail_predictions=True)
+        client = make_client(fake)
+        with self.assertRaises(ReplicatePredictionError):
+            asyncio.run(run_and_close(client, client.run("owner/model", {"prompt": "x"})))
+
+    def test_in_flight_limit(self):
+        fake = create_fake_replicate_app(latency=0.05)
+        client = make_client(fake, max_in_flight=3)
+
+        async def many():
+            return await asyncio.gather(*(client.run("owner/model", {"prompt": str(i)}) for i in range(12)))
+
+        outputs = asyncio.run(run_and_close(client, many()))
+        self.assertEqual(len(outputs), 12)
+        self.assertLessEqual(fake.state.max_in_flight, 3)
+
+    def test_webhook_wakes_waiter(self):
+        fake = create_fake_replicate_app(latency=0.3)
+        client = make_client(fake, webhook_url="http://api/webhooks/replicate")
+
+        async def scenario():
+            prediction = await client.create_prediction("owner/model", {"prompt": "x"})
+            waiting = asyncio.ensure_future(client.wait_for_prediction(prediction))
+            await asyncio.sleep(0.01)
+            # Forged: the prediction is still running, and its output is never taken from the body
+            forged = client.notify_webhook({"id": prediction["id"], "status": "succeeded", "output": ["http://evil/"]})
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiting.done())
+            await asyncio.sleep(0.3)
+            delivered = client.notify_webhook({"id": prediction["id"], "status": "succeeded"})
+            return forged, delivered, await asyncio.wait_for(waiting, timeout=2)
+
+        started = time.monotonic()
+        forged, delivered, result = asyncio.run(run_and_close(client, scenario()))
+        self.assertTrue(forged and delivered)
+        self.assertTrue(result["output"][0].endswith(".png"))
+        self.assertLess(time.monotonic() - started, 2)  # Not the 10 s fallback poll
+        self.assertFalse(client.notify_webhook({"id": "unknown", "status": "succeeded"}))
+
+    def test_polled_predictions_ignore_webhooks(self):
+        fake = create_fake_replicate_app(latency=0.05)
+        client = make_client(fake)  # No webhook URL
+
+        async def scenario():
+            prediction = await client.create_prediction("owner/model", {"prompt": "x"})
+            waiting = asyncio.ensure_future(client.wait_for_prediction(prediction))
+            await asyncio.sleep(0.01)
+            delivered = client.notify_webhook({"id": prediction["id"], "status": "succeeded"})
+            return delivered, await waiting
+
+        delivered, result = asyncio.run(run_and_close(client, scenario()))
+        self.assertFalse(delivered)
+        self.assertEqual(result["status"], "succeeded")
+
+    def test_stylize_image_async(self):
+        fake = create_fake_replicate_app()
+        saved = replicate_client._async_client
+        replicate_client._async_client = make_client(fake)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                edge_path = Path(tmp) / "edge.png"
+                edge_path.write_bytes(b"\x89PNG\r\n\x1a\n")
+                url = asyncio.run(replicate_client.stylize_image_async(str(edge_path), prompt="ink"))
+                self.assertTrue(url.startswith("http://fake-replicate/files/"))
+                with self.assertRaises(FileNotFoundError):
+                    asyncio.run(replicate_client.stylize_image_async(str(Path(tmp) / "missing.png")))
+                # Bytes already in memory: the file is never read
+                url = asyncio.run(replicate_client.stylize_image_async(
+                    str(Path(tmp) / "missing.png"), prompt="ink", edge_map_bytes=b"\x89PNG\r\n\x1a\n"
+                ))
+                self.assertTrue(url.startswith("http://fake-replicate/files/"))
+        finally:
+            asyncio.run(replicate_client.close_async_client())
+            replicate_client._async_client = saved
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 40
+
+def make_output_client(body, headers=None) -> AsyncReplicateClient:
+    """A client whose output downloads are answered with `body` (bytes, or chunks streamed without a length)."""
+    async def chunks():
+        for chunk in body:
+            await asyncio.sleep(0)  # Let concurrent downloads interleave
+            yield chunk
+
+    def handler(request):
+        return httpx.Response(200, content=body if isinstance(body, bytes) else chunks(), headers=headers)
+
+    return AsyncReplicateClient(api_token="test-token", transport=httpx.MockTransport(handler))
+
+class TestOutputDownload(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.destination = Path(self.tmp.name) / "job" / "stylized.png"
+
+    def download(self, client, **kwargs):
+        return asyncio.run(run_and_close(client, client.download_output("https://cdn.test/out.png", self.destination, **kwargs)))
+
+    def test_streams_output_to_file(self):
+        size = self.download(make_output_client([PNG_BYTES[:5], PNG_BYTES[5:4000], PNG_BYTES[4000:]]))
+        self.assertEqual(size, len(PNG_BYTES))
+        self.assertEqual(self.destination.read_bytes(), PNG_BYTES)
+        self.assertEqual(os.listdir(self.destination.parent), ["stylized.png"])  # Temp file renamed
+
+    def test_concurrent_downloads_to_one_destination_do_not_mix(self):
+        parts = [PNG_BYTES[i:i + 512] for i in range(0, len(PNG_BYTES), 512)]
+        other = PNG_BYTES[:16] + bytes(reversed(PNG_BYTES[16:]))  # Same type, different bytes
+
+        async def both():
+            clients = [make_output_client(parts), make_output_client([other[i:i + 512] for i in range(0, len(other), 512)])]
+            try:
+                return await asyncio.gather(*(
+                    client.download_output("https://cdn.test/out.png", self.destination) for client in clients
+                ))
+            finally:
+                for client in clients:
+                    await client.aclose()
+
+        asyncio.run(both())
+        self.assertIn(self.destination.read_bytes(), (PNG_BYTES, other))  # One whole output, not a mix
+        self.assertEqual(os.listdir(self.destination.parent), ["stylized.png"])
+
+    def test_declared_length_over_limit_is_refused(self):
+        with self.assertRaisesRegex(ReplicateOutputError, "more than"):
+            self.download(make_output_client(PNG_BYTES), max_bytes=1024)
+        self.assertFalse(self.destination.parent.exists())  # Refused before anything was written
+
+    def test_streamed_bytes_over_limit_are_refused(self):
+        with self.assertRaisesRegex(ReplicateOutputError, "larger than"):
+            self.download(make_output_client([PNG_BYTES[:800], PNG_BYTES[800:]]), max_bytes=1024)
+        self.assertEqual(os.listdir(self.destination.parent), [])
+
+    def test_non_image_output_is_refused(self):
+        with self.assertRaisesRegex(ReplicateOutputError, "not a PNG"):
+            self.download(make_output_client(b"<html>error page</html>"))
+        self.assertFalse(self.destination.exists())
+
+class TestWebhookSignature(unittest.TestCase):
+    def test_verify(self):
+        key = b"super-secret-key"
+        secret = "whsec_" + base64.b64encode(key).decode()
+        body = b'{"id": "p1", "status": "succeeded"}'
+        timestamp = str(int(time.time()))
+        signature = base64.b64encode(hmac.new(key, f"msg_1.{timestamp}.".encode() + body, hashlib.sha256).digest()).decode()
+        headers = {"webhook-id": "msg_1", "webhook-timestamp": timestamp, "webhook-signature": f"v1,{signature}"}
+
+        self.assertTrue(verify_webhook_signature(headers, body, secret))
+        self.assertFalse(verify_webhook_signature(headers, body + b" ", secret))
+        self.assertFalse(verify_webhook_signature({**headers, "webhook-timestamp": "0"}, body, secret))
+        self.assertFalse(verify_webhook_signature({}, body, secret))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import asyncio
+import os
+import sys
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.scheduler import FairScheduler, SchedulerSaturated
+
+class TestFairScheduler(unittest.TestCase):
+    def run_order(self, scheduler: FairScheduler, jobs: list[tuple]) -> list[str]:
+        """Queues (job_id, client, tier[, weight]) behind one busy slot; returns the order they run in."""
+        order = []
+
+        async def scenario():
+            blocker = scheduler.enqueue("blocker", "someone")
+            await scheduler.acquire(blocker)
+
+            async def job(job_id, client, tier="normal", weight=1.0):
+                async with scheduler.slot(job_id, client, tier, weight):
+                    order.append(job_id)
+
+            tasks = [asyncio.create_task(job(*spec)) for spec in jobs]
+            await asyncio.sleep(0)  # Everything queued
+            scheduler.release(blocker)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(scenario())
+        return order
+
+    def test_clients_take_turns(self):
+        jobs = [(f"a{i}", "A") for i in range(4)] + [("b0", "B"), ("c0", "C")]
+        order = self.run_order(FairScheduler(max_concurrency=1), jobs)
+        self.assertEqual(order, ["a0", "b0", "c0", "a1", "a2", "a3"])
+
+    def test_weights_give_more_turns(self):
+        jobs = [(f"a{i}", "A", "normal", 2.0) for i in range(4)] + [(f"b{i}", "B") for i in range(3)]
+        order = self.run_order(FairScheduler(max_concurrency=1), jobs)
+        self.assertEqual(order, ["a0", "a1", "b0", "a2", "a3", "b1", "b2"])
+
+    def test_higher_tiers_go_first(self):
+        jobs = [("low", "A", "low"), ("normal", "B", "normal"), ("high", "C", "high")]
+        self.assertEqual(self.run_order(FairScheduler(max_concurrency=1), jobs), ["high", "normal", "low"])
+
+    def test_slots_bound_concurrency(self):
+        scheduler = FairScheduler(max_concurrency=2)
+        peak = 0
+
+        async def job(i):
+            nonlocal peak
+            async with scheduler.slot(f"job{i}", f"client{i % 3}"):
+                peak = max(peak, scheduler.running)
+                await asyncio.sleep(0.01)
+
+        async def scenario():
+            await asyncio.gather(*(job(i) for i in range(8)))
+
+        asyncio.run(scenario())
+        self.assertEqual(peak, 2)
+        self.assertEqual(scheduler.stats()["running"], 0)
+
+    def test_admission_sheds_low_tier_first(self):
+        scheduler = FairScheduler(max_concurrency=1, max_queue=4, low_tier_share=0.5)
+
+        async def scenario():
+            await scheduler.acquire(scheduler.enqueue("running", "A"))
+            for i in range(2):
+                scheduler.enqueue(f"queued{i}", "A")
+            with self.assertRaises(SchedulerSaturated) as cm:
+                scheduler.admit("low")
+            self.assertGreaterEqual(cm.exception.retry_after, 1)
+            scheduler.admit("normal", count=2)
+            with self.assertRaises(SchedulerSaturated):
+                scheduler.admit("normal", count=3)
+
+        asyncio.run(scenario())
+        self.assertEqual(scheduler.shed, 4)
+
+    def test_position_and_eta_follow_dispatch_order(self):
+        scheduler = FairScheduler(max_concurrency=1, default_service_seconds=5.0)
+
+        async def scenario():
+            await scheduler.acquire(scheduler.enqueue("running", "A"))
+            for i in range(3):
+                scheduler.enqueue(f"a{i}", "A")
+            scheduler.enqueue("b0", "B")
+            self.assertIsNone(scheduler.position("running"))
+            self.assertEqual([scheduler.position(job) for job in ("a0", "b0", "a1", "a2")], [0, 1, 2, 3])
+            self.assertEqual(scheduler.eta_seconds("b0"), 10.0)
+            self.assertIsNone(scheduler.position("unknown"))
+
+        asyncio.run(scenario())
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        scheduler = FairScheduler(max_concurrency=1)
+
+        async def scenario():
+            await scheduler.acquire(scheduler.enqueue("running", "A"))
+            waiter = asyncio.create_task(scheduler.acquire(scheduler.enqueue("waiting", "B")))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual(scheduler.stats()["queued"]["normal"], 0)
+            self.assertIsNone(scheduler.position("waiting"))
+
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.job_store import InMemoryJobStore, SQLiteJobStore
+from backend.singleflight import FlightFailed, SingleFlight
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_run(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def scenario():
+            return await asyncio.gather(*(flights.do("key", work) for _ in range(5)))
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], ["result"] * 5)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 4)
+        self.assertEqual((flights.leaders, flights.followers, flights.in_flight()), (1, 4, 0))
+
+    def test_later_calls_run_again(self):
+        flights = SingleFlight(InMemoryJobStore())
+        calls = []
+
+        async def work():
+            calls.append(1)
+            return len(calls)
+
+        async def scenario():
+            return [await flights.do("key", work) for _ in range(2)]
+
+        self.assertEqual(asyncio.run(scenario()), [(1, False), (2, False)])
+
+    def test_leader_error_reaches_followers(self):
+        flights = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("prediction failed")
+
+        async def scenario():
+            return await asyncio.gather(*(flights.do("key", work) for _ in range(3)), return_exceptions=True)
+
+        errors = asyncio.run(scenario())
+        self.assertTrue(all(isinstance(e, ValueError) and str(e) == "prediction failed" for e in errors))
+
+    def test_workers_share_a_flight_through_the_job_store(self):
+        # Two SingleFlight instances on one store stand in for two API workers
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        store = SQLiteJobStore(os.path.join(tmp.name, "jobs.db"))
+        leader = SingleFlight(store, poll_interval=0.01)
+        follower = SingleFlight(store, poll_interval=0.01)
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "/temp_images/job-1/stylized.png"
+
+        async def scenario():
+            first = asyncio.create_task(leader.do("key", work))
+            await asyncio.sleep(0.02)
+            return await asyncio.gather(first, follower.do("key", work))
+
+        results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [("/temp_images/job-1/stylized.png", False), ("/temp_images/job-1/stylized.png", True)])
+
+    def test_remote_failure_is_shared(self):
+        store = InMemoryJobStore()
+        store.create("flight:key", "running", kind="flight", flight_id="f1", lease_until=time.time() + 60)
+        follower = SingleFlight(store, poll_interval=0.01)
+
+        async def fail_remote():
+            await asyncio.sleep(0.03)
+            store.transition("flight:key", "failed", error_message="Replicate is down")
+
+        async def work():
+            self.fail("A follower must not run the work")
+
+        async def scenario():
+            asyncio.get_running_loop().create_task(fail_remote())
+            return await follower.do("key", work)
+
+        with self.assertRaisesRegex(FlightFailed, "Replicate is down"):
+            asyncio.run(scenario())
+
+    def test_expired_lease_is_taken_over(self):
+        store = InMemoryJobStore()
+        # A flight whose worker died: still "running", lease over
+        store.create("flight:key", "running", kind="flight", flight_id="dead", lease_until=time.time() - 1)
+        flights = SingleFlight(store, poll_interval=0.01)
+
+        async def work():
+            return "fresh"
+
+        self.assertEqual(asyncio.run(flights.do("key", work)), ("fresh", False))
+        record = store.get("flight:key")
+        self.assertEqual((record["status"], record["result"]), ("done", "fresh"))
+
+    def test_dead_leader_is_taken_over_before_the_lease_ends(self):
+        store = InMemoryJobStore()
+        store.create("flight:key", "running", kind="flight", flight_id="dead", worker_id="dead-worker",
+                     lease_until=time.time() + 900)
+        flights = SingleFlight(store, poll_interval=0.01, worker_id="live-worker",
+                               is_alive=lambda worker_id: worker_id == "live-worker")
+
+        async def work():
+            return "fresh"
+
+        self.assertEqual(asyncio.run(asyncio.wait_for(flights.do("key", work), timeout=1)), ("fresh", False))
+        self.assertEqual(store.get("flight:key")["worker_id"], "live-worker")
+
+    def test_leader_renews_its_lease(self):
+        store = InMemoryJobStore()
+        flights = SingleFlight(store, lease_seconds=60, worker_id="live-worker")
+
+        async def scenario():
+            started, release = asyncio.Event(), asyncio.Event()
+
+            async def work():
+                started.set()
+                await release.wait()
+                return "done"
+
+            task = asyncio.create_task(flights.do("key", work))
+            await started.wait()
+            store.transition("flight:key", None, lease_until=time.time() + 1)
+            flights.renew_leases()
+            renewed = store.get("flight:key")["lease_until"]
+            release.set()
+            await task
+            return renewed
+
+        self.assertGreater(asyncio.run(scenario()), time.time() + 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.job_store import InMemoryJobStore
+from backend.storage import StorageManager
+
+class TestStorageManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.store = InMemoryJobStore()
+        self.evicted = []
+        self.now = time.time()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def manager(self, **kwargs):
+        return StorageManager(self.root, self.store, on_evict=self.evicted.append, **kwargs)
+
+    def add_job(self, job_id: str, size: int, age: float, status: str = "complete", **fields):
+        """A job record plus a directory of `size` bytes last used `age` seconds ago."""
+        self.store.create(job_id, status, **fields)
+        job_dir = self.root / job_id
+        job_dir.mkdir()
+        (job_dir / "stylized.png").write_bytes(b"x" * size)
+        os.utime(job_dir, (self.now - age, self.now - age))
+
+    def test_ttl_eviction_marks_jobs_expired(self):
+        self.add_job("old", 10, age=7200)
+        self.add_job("fresh", 10, age=60)
+        result = self.manager(ttl_seconds=3600).sweep(self.now)
+
+        self.assertEqual(result["evicted"], 1)
+        self.assertFalse((self.root / "old").exists())
+        self.assertTrue((self.root / "fresh").exists())
+        record = self.store.get("old")
+        self.assertEqual(record["status"], "expired")
+        self.assertEqual(record["expired_reason"], "ttl")
+        self.assertEqual(self.evicted, ["old"])
+
+    def test_quota_evicts_least_recently_used_first(self):
+        self.add_job("a", 100, age=300)
+        self.add_job("b", 100, age=200)
+        self.add_job("c", 100, age=100)
+        manager = self.manager(max_bytes=150)
+        result = manager.sweep(self.now)
+
+        self.assertEqual(sorted(self.evicted), ["a", "b"])
+        self.assertEqual(result["bytes"], 100)
+        self.assertEqual(self.store.get("b")["expired_reason"], "quota")
+        self.assertEqual(manager.stats()["reclaimed_bytes"], 200)
+
+    def test_touch_keeps_a_job(self):
+        self.add_job("a", 100, age=300)
+        self.add_job("b", 100, age=100)
+        manager = self.manager(max_bytes=150)
+        manager.touch("a")
+        manager.sweep(self.now)
+        self.assertEqual(self.evicted, ["b"])
+
+    def test_running_jobs_are_never_evicted(self):
+        self.add_job("running", 100, age=7200, status="processing_replicate")
+        self.add_job("building", 100, age=7200, artifacts_status="building")
+        result = self.manager(max_bytes=10, ttl_seconds=60).sweep(self.now)
+        self.assertEqual(result["evicted"], 0)
+        self.assertEqual(self.store.get("running")["status"], "processing_replicate")
+
+    def test_orphan_directories_removed_after_grace(self):
+        (self.root / "orphan").mkdir()
+        (self.root / "new-orphan").mkdir()
+        os.utime(self.root / "orphan", (self.now - 3600, self.now - 3600))
+        result = self.manager(orphan_grace_seconds=600).sweep(self.now)
+        self.assertEqual(result["removed_dirs"], 1)
+        self.assertFalse((self.root / "orphan").exists())
+        self.assertTrue((self.root / "new-orphan").exists())
+
+    def test_sweep_purges_expired_records(self):
+        store = InMemoryJobStore(ttl_seconds=0.01)
+        store.create("gone", "complete")
+        time.sleep(0.02)
+        result = StorageManager(self.root, store).sweep()
+        self.assertEqual(result["purged_records"], 1)
+
+    def test_record_tracks_bytes_per_job(self):
+        self.add_job("a", 123, age=0)
+        manager = self.manager()
+        self.assertEqual(manager.record("a"), 123)
+        self.assertEqual(manager.usage("a"), 123)
+        self.assertEqual(manager.stats()["bytes"], 123)
+
+if __name__ == '__main__':
+    unittest.main()
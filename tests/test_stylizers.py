@@ -0,0 +1,81 @@
+import unittest
+import asyncio
+import os
+import sys
+import cv2
+import numpy as np
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import stylizers
+from backend.preprocess import canny_edge_png
+from backend.workers import ExecutorSaturated
+
+def make_photo(width=160, height=120) -> bytes:
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    img[:, :, 0] = np.linspace(0, 255, width, dtype=np.uint8)  # Gradient so the filters have texture
+    img[30:90, 40:120] = (40, 160, 220)
+    ok, png = cv2.imencode('.png', img)
+    return png.tobytes()
+
+class TestLocalStyles(unittest.TestCase):
+    def setUp(self):
+        self.photo = make_photo()
+        self.edges = canny_edge_png(self.photo)
+
+    def test_every_style_returns_a_png(self):
+        for style in stylizers.LOCAL_STYLES:
+            with self.subTest(style=style):
+                png = stylizers.render_local_style(style, self.edges, self.photo)
+                img = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+                self.assertEqual(img.shape, (120, 160, 3))
+
+    def test_output_is_deterministic(self):
+        first = stylizers.render_local_style("cartoon", self.edges, self.photo)
+        self.assertEqual(stylizers.render_local_style("cartoon", self.edges, self.photo), first)
+
+    def test_large_inputs_are_reduced(self):
+        png = stylizers.render_local_style("ink", self.edges, max_side=80)
+        img = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(img.shape[:2], (60, 80))
+
+    def test_unknown_style(self):
+        with self.assertRaises(ValueError):
+            stylizers.render_local_style("oil", self.edges)
+
+class FlakyExecutor:
+    """Saturated for the first `busy` calls, then runs the function inline."""
+    def __init__(self, busy: int):
+        self.busy = busy
+        self.calls = 0
+
+    async def run(self, fn, *args):
+        self.calls += 1
+        if self.calls <= self.busy:
+            raise ExecutorSaturated(retry_after=0)
+        return fn(*args)
+
+class TestStylizers(unittest.TestCase):
+    def test_get_stylizer_dispatches_on_model_id(self):
+        local = stylizers.get_stylizer("local/watercolor", executor=None)
+        self.assertIsInstance(local, stylizers.LocalStylizer)
+        self.assertTrue(local.needs_source_image)
+        self.assertFalse(stylizers.get_stylizer("local/ink", executor=None).needs_source_image)
+        remote = stylizers.get_stylizer("jagilley/controlnet-canny", executor=None)
+        self.assertIsInstance(remote, stylizers.ReplicateStylizer)
+        with self.assertRaises(ValueError):
+            stylizers.get_stylizer("local/oil", executor=None)
+
+    def test_local_stylizer_waits_for_room_in_the_pool(self):
+        executor = FlakyExecutor(busy=2)
+        stylizer = stylizers.LocalStylizer("ink", executor)
+        png = asyncio.run(stylizer.stylize(canny_edge_png(make_photo()), "ignored"))
+        self.assertTrue(png.startswith(b"\x89PNG"))
+        self.assertEqual(executor.calls, 3)
+
+        with self.assertRaises(ExecutorSaturated):
+            asyncio.run(stylizers.LocalStylizer("ink", FlakyExecutor(busy=5), max_attempts=2).stylize(b"", ""))
+
+if __name__ == '__main__':
+    unittest.main()
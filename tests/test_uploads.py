@@ -0,0 +1,93 @@
+import unittest
+import asyncio
+import io
+import os
+import sys
+import zipfile
+from fastapi import HTTPException, UploadFile
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.uploads import extract_zip_images, read_upload_limited, sniff_image_type, sniff_upload_type
+
+PNG_HEAD = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR"
+ALLOWED = {"image/jpeg", "image/png", "image/heic"}
+
+def make_upload(data: bytes, content_type="image/png", declare_size=True) -> UploadFile:
+    return UploadFile(
+        io.BytesIO(data), size=len(data) if declare_size else None,
+        filename="upload.bin", headers={"content-type": content_type},
+    )
+
+class TestSniffImageType(unittest.TestCase):
+    def test_known_signatures(self):
+        self.assertEqual(sniff_image_type(b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"), "image/jpeg")
+        self.assertEqual(sniff_image_type(PNG_HEAD), "image/png")
+        self.assertEqual(sniff_image_type(b"\x00\x00\x00\x18ftypheic"), "image/heic")
+        self.assertEqual(sniff_image_type(b"RIFF\x24\x00\x00\x00WEBPVP8 "), "image/webp")
+        self.assertIsNone(sniff_image_type(b"GIF89a......"))
+        self.assertIsNone(sniff_image_type(b"import os\n"))
+
+    def test_zip_is_an_upload_type_but_not_an_image(self):
+        self.assertEqual(sniff_upload_type(b"PK\x03\x04\x14\x00\x00\x00\x08\x00\x00\x00"), "application/zip")
+        self.assertEqual(sniff_upload_type(PNG_HEAD), "image/png")
+        self.assertIsNone(sniff_image_type(b"PK\x03\x04\x14\x00\x00\x00\x08\x00\x00\x00"))
+
+class TestReadUploadLimited(unittest.TestCase):
+    def test_reads_whole_upload_into_bytearray(self):
+        data = PNG_HEAD + os.urandom(700_000)
+        for declare_size in (True, False):
+            contents, sniffed = asyncio.run(read_upload_limited(make_upload(data, declare_size=declare_size), 1_000_000, ALLOWED))
+            self.assertIsInstance(contents, bytearray)
+            self.assertEqual(bytes(contents), data)
+            self.assertEqual(sniffed, "image/png")
+
+    def test_trusts_bytes_not_content_type(self):
+        contents, sniffed = asyncio.run(read_upload_limited(make_upload(PNG_HEAD, "application/octet-stream"), 100, ALLOWED))
+        self.assertEqual(sniffed, "image/png")
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(read_upload_limited(make_upload(b"print('not an image')", "image/png"), 100, ALLOWED))
+        self.assertEqual(ctx.exception.status_code, 415)
+
+    def test_rejects_oversized_upload(self):
+        data = PNG_HEAD + b"\x00" * 2_000_000
+        for declare_size in (True, False):
+            with self.assertRaises(HTTPException) as ctx:
+                asyncio.run(read_upload_limited(make_upload(data, declare_size=declare_size), 1_000_000, ALLOWED))
+            self.assertEqual(ctx.exception.status_code, 413)
+
+def make_zip(entries: dict[str, bytes]) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, data in entries.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+class TestExtractZipImages(unittest.TestCase):
+    def test_keeps_images_in_order_and_skips_the_rest(self):
+        data = make_zip({
+            "set/b.png": PNG_HEAD + b"b",
+            "set/readme.txt": b"hello",
+            "set/.hidden.png": PNG_HEAD,
+            "__MACOSX/set/._b.png": PNG_HEAD,
+            "a.jpg": b"\xff\xd8\xff\xe0\x00\x10JFIF\x00",
+        })
+        images = extract_zip_images(data, 1000, 10, ALLOWED)
+        self.assertEqual([name for name, _ in images], ["b.png", "a.jpg"])
+        self.assertEqual(images[0][1], PNG_HEAD + b"b")
+
+    def test_limits(self):
+        cases = [
+            (make_zip({"big.png": PNG_HEAD + b"\x00" * 5000}), 413),  # Compresses well, still too big unpacked
+            (make_zip({f"{i}.png": PNG_HEAD for i in range(3)}), 413),
+            (make_zip({"notes.txt": b"no images"}), 400),
+            (b"PK\x03\x04 truncated", 400),
+        ]
+        for data, status_code in cases:
+            with self.assertRaises(HTTPException) as ctx:
+                extract_zip_images(data, 1000, 2, ALLOWED)
+            self.assertEqual(ctx.exception.status_code, status_code)
+
+if __name__ == '__main__':
+    unittest.main()
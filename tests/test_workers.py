@@ -0,0 +1,51 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.workers import BoundedExecutor, ExecutorSaturated
+
+def add(a, b):
+    return a + b
+
+class TestBoundedExecutor(unittest.TestCase):
+    def test_runs_in_process_pool(self):
+        executor = BoundedExecutor(kind="process", max_workers=1, max_queue=0)
+        try:
+            self.assertEqual(asyncio.run(executor.run(add, 2, b=3)), 5)
+            self.assertEqual(executor.pending, 0)
+        finally:
+            executor.shutdown()
+
+    def test_rejects_when_saturated(self):
+        executor = BoundedExecutor(kind="thread", max_workers=1, max_queue=1, retry_after=7)
+        release = threading.Event()
+
+        async def scenario():
+            running = asyncio.ensure_future(executor.run(release.wait))
+            queued = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(ExecutorSaturated) as ctx:
+                await executor.run(add, 1, 1)
+            self.assertEqual(ctx.exception.retry_after, 7)
+            release.set()
+            await asyncio.gather(running, queued)
+            # Slots are released once the work is done
+            self.assertEqual(executor.pending, 0)
+            self.assertEqual(await executor.run(add, 1, 1), 2)
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            executor.shutdown()
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            BoundedExecutor(kind="gpu")
+
+if __name__ == '__main__':
+    unittest.main()